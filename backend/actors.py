@@ -0,0 +1,121 @@
+"""Per-key write actors: one mailbox per character, drained in order.
+
+Mutations submitted for the same key run one after another, in arrival order,
+so two requests for one character never race each other in this worker; keys
+don't wait on each other. A mutation submitted with ``merge`` names a batch
+function: consecutive queued mutations with the same one are handed to it
+together and cost a single write, each caller getting its own result back.
+
+A mailbox's task exits once it has been idle for ``idle_timeout`` seconds and
+the next mutation for that key starts a new one. Mutations run as tasks in the
+context of the request that submitted them (the first one of a merged batch),
+so per-request metrics count their database commands. A mutation whose caller
+went away before it started is dropped; one that already started completes.
+
+This orders writes within one worker only. Across workers, the conditional
+and atomic updates in server.py still decide.
+"""
+import asyncio
+import contextvars
+from collections import deque
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+
+class _Mutation:
+    __slots__ = ("fn", "merge", "payload", "context", "future")
+
+    def __init__(self, fn=None, merge=None, payload=None):
+        self.fn = fn
+        self.merge = merge
+        self.payload = payload
+        self.context = contextvars.copy_context()
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class _Mailbox:
+    def __init__(self):
+        self.queue = deque()
+        self.wakeup = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        self.task: Optional[asyncio.Task] = None
+
+
+class WriteActors:
+    def __init__(self, idle_timeout: float = 30.0, max_batch: int = 64):
+        self.idle_timeout = idle_timeout
+        self.max_batch = max_batch
+        self._mailboxes: Dict[Hashable, _Mailbox] = {}
+        self.counts = {"mutations": 0, "writes": 0, "merged": 0, "dropped": 0, "started": 0, "stopped": 0}
+
+    async def call(self, key: Hashable, fn: Callable[[], Awaitable]):
+        """Run fn() once every earlier mutation for key has finished."""
+        return await self._submit(key, _Mutation(fn=fn))
+
+    async def merge(self, key: Hashable, batch: Callable[[Hashable, List], Awaitable[List]], payload):
+        """Queue payload; consecutive queued payloads for the same batch go to batch(key, [...]) together.
+
+        batch returns one result per payload, in order.
+        """
+        return await self._submit(key, _Mutation(merge=batch, payload=payload))
+
+    async def _submit(self, key, mutation: _Mutation):
+        mailbox = self._mailboxes.get(key)
+        # A mailbox left behind by another event loop (e.g. a test client's) is never drained.
+        if mailbox is None or mailbox.loop is not asyncio.get_running_loop():
+            mailbox = self._mailboxes[key] = _Mailbox()
+            mailbox.task = asyncio.create_task(self._run(key, mailbox))
+            self.counts["started"] += 1
+        mailbox.queue.append(mutation)
+        mailbox.wakeup.set()
+        self.counts["mutations"] += 1
+        return await mutation.future
+
+    async def _run(self, key, mailbox: _Mailbox):
+        while True:
+            if not mailbox.queue:
+                mailbox.wakeup.clear()
+                try:
+                    await asyncio.wait_for(mailbox.wakeup.wait(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    # No await between this check and the removal, so nothing can be queued in between.
+                    if not mailbox.queue:
+                        if self._mailboxes.get(key) is mailbox:
+                            del self._mailboxes[key]
+                        self.counts["stopped"] += 1
+                        return
+                continue
+
+            group = [mailbox.queue.popleft()]
+            if group[0].merge is not None:
+                while (mailbox.queue and mailbox.queue[0].merge is group[0].merge
+                       and len(group) < self.max_batch):
+                    group.append(mailbox.queue.popleft())
+            live = [mutation for mutation in group if not mutation.future.done()]
+            self.counts["dropped"] += len(group) - len(live)
+            if live:
+                await self._execute(key, live)
+
+    async def _execute(self, key, group: List[_Mutation]):
+        first = group[0]
+        if first.merge is not None:
+            work = first.merge(key, [mutation.payload for mutation in group])
+        else:
+            work = first.fn()
+        self.counts["writes"] += 1
+        self.counts["merged"] += len(group) - 1
+        try:
+            # Callers await their own futures, so one disconnecting can't cancel the write.
+            result = await asyncio.create_task(work, context=first.context)
+        except Exception as exc:
+            for mutation in group:
+                if not mutation.future.done():
+                    mutation.future.set_exception(exc)
+            return
+        results = result if first.merge is not None else [result]
+        for mutation, value in zip(group, results):
+            if not mutation.future.done():
+                mutation.future.set_result(value)
+
+    def stats(self) -> dict:
+        return {"actors": len(self._mailboxes), "queued": sum(len(m.queue) for m in self._mailboxes.values()),
+                **self.counts}
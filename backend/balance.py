@@ -0,0 +1,293 @@
+"""Monte Carlo balance simulator over CHARACTER_CLASSES x SHOP_ITEMS loadouts.
+
+Every class is paired with every combination of weapon, armor, relic and scroll
+(or an empty slot) it could wear at the given level, and each loadout fights each
+enemy ``fights`` times. A fight follows the game client's rules: the player hits
+every ATTACK_INTERVAL seconds for the effective_stats damage roll, the enemy's
+contact damage is reduced by damage_reduction and lands at most once per
+invulnerability window.
+
+Items the fight model can't see (no stat in COMBAT_STATS for their slot, e.g.
+scrolls) are left out of the loadouts and listed separately, and loadouts that
+end up with identical combat stats are simulated once. All loadouts of a class
+fight an enemy with the same damage rolls (common random numbers), so the
+differences between them are the gear, not sampling noise. Loadouts are
+simulated in chunks sized to keep each chunk's roll array under CHUNK_BYTES;
+chunks go to worker processes for large sweeps.
+
+Power is DPS times toughness (enemy hits survived, averaged over enemies), which
+is what the gold-per-power figures divide the price by.
+
+Run from the backend directory::
+
+    python balance.py [--level 1] [--fights 200] [--build primary] [--workers 4] [--json]
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from typing import Optional
+
+import numpy as np
+
+import effective_stats
+import progression
+from catalog import CHARACTER_CLASSES, SHOP_ITEMS
+
+# Mirrors ENEMY_STATS / BOSS_STATS in frontend/src/game/data/gameData.js.
+ENEMIES = {
+    "undead": {"hp": 30, "attack": 8},
+    "demon": {"hp": 50, "attack": 15},
+    "cultist": {"hp": 35, "attack": 12},
+    "dragon_mini": {"hp": 80, "attack": 20},
+    "undead_king": {"hp": 300, "attack": 20},
+    "demon_lord": {"hp": 500, "attack": 30},
+    "ancient_dragon": {"hp": 800, "attack": 40},
+}
+# GameScene: attackCooldown after a basic attack, and the invulnerability tween after a hit.
+ATTACK_INTERVAL = 0.35
+INVULNERABLE_FOR = 1.12
+BUILDS = ["primary", "end", "even"]
+SLOTS = ["weapon", "armor", "relic", "scroll"]
+# Per slot, the item stats the fight model reads.
+COMBAT_STATS = {
+    "weapon": ["attack", "health_bonus"],
+    "armor": ["defense", "health_bonus"],
+    "relic": ["health_bonus"],
+    "scroll": ["health_bonus"],
+}
+# Upper bound for the largest array one chunk allocates (its damage rolls).
+CHUNK_BYTES = 32 * 2**20
+
+_CLASSES = list(CHARACTER_CLASSES)
+_ITEMS_BY_SLOT = {slot: [item for item in SHOP_ITEMS if item["type"] == slot] for slot in SLOTS}
+_ENEMY_HP = np.array([enemy["hp"] for enemy in ENEMIES.values()], dtype=np.int64)
+_ENEMY_ATTACK = np.array([enemy["attack"] for enemy in ENEMIES.values()], dtype=np.int64)
+
+
+def has_combat_stats(slot: str, item: dict) -> bool:
+    return any(item["stats"].get(key, 0) for key in COMBAT_STATS[slot])
+
+
+def _item_column(slot, indexes, key):
+    values = np.array([0] + [item["stats"].get(key, 0) for item in _ITEMS_BY_SLOT[slot]], dtype=np.int64)
+    return values[indexes + 1]
+
+
+def _stats_at(level: int, build: str):
+    """(classes, STATS) stat blocks at level with every granted point spent per build."""
+    points = progression.STAT_POINTS_PER_LEVEL * (level - 1)
+    stats = np.array([[cls[stat] for stat in progression.STATS] for cls in CHARACTER_CLASSES.values()])
+    primary = [progression.STATS.index("int" if name in effective_stats.RANGED_CLASSES else "str") for name in _CLASSES]
+    end = progression.STATS.index("end")
+    rows = np.arange(len(_CLASSES))
+    if build == "primary":
+        stats[rows, primary] += points
+    elif build == "end":
+        stats[:, end] += points
+    else:
+        stats[rows, primary] += points - points // 2
+        stats[:, end] += points // 2
+    return stats
+
+
+def loadouts(level: int = 1, build: str = "primary"):
+    """Column arrays describing every class x loadout wearable at level."""
+    options = [
+        [-1] + [
+            i for i, item in enumerate(_ITEMS_BY_SLOT[slot])
+            if item["level_req"] <= level and has_combat_stats(slot, item)
+        ]
+        for slot in SLOTS
+    ]
+    combos = np.array(list(product(range(len(_CLASSES)), *options)), dtype=np.int64)
+    classes, slots = combos[:, 0], {slot: combos[:, i + 1] for i, slot in enumerate(SLOTS)}
+
+    stats = _stats_at(level, build)
+    primary = np.array([progression.STATS.index("int" if name in effective_stats.RANGED_CLASSES else "str")
+                        for name in _CLASSES])[classes]
+    weapon_attack = _item_column("weapon", slots["weapon"], "attack")
+    base_damage = np.where(weapon_attack > 0, weapon_attack, effective_stats.UNARMED_ATTACK) \
+        + stats[classes, primary] * effective_stats.DAMAGE_PER_STAT
+    endurance = stats[classes, progression.STATS.index("end")]
+    reduction = (endurance * 1.5 + _item_column("armor", slots["armor"], "defense")) / 4
+    max_health = progression.maxima_batch([_CLASSES[i] for i in range(len(_CLASSES))], stats)["max_health"][classes]
+    max_health = max_health + sum(_item_column(slot, slots[slot], "health_bonus") for slot in SLOTS)
+    price = sum(
+        np.array([0] + [item["price"] for item in _ITEMS_BY_SLOT[slot]], dtype=np.int64)[slots[slot] + 1]
+        for slot in SLOTS
+    )
+    return {"class": classes, **slots, "base_damage": base_damage, "reduction": reduction,
+            "max_health": max_health, "price": price}
+
+
+def _max_hits(hp: int, base_damage_min: float) -> int:
+    return int(np.ceil(hp / max(1, np.floor(base_damage_min * effective_stats.DAMAGE_VARIANCE[0]))))
+
+
+def _rolls(seed: int, class_index: int, stream: int, shape):
+    """Damage multipliers shared by every loadout of a class; stream is the enemy (or len(ENEMIES) for DPS)."""
+    return np.random.default_rng((seed, class_index, stream)).uniform(*effective_stats.DAMAGE_VARIANCE, shape)
+
+
+def _simulate_chunk(args):
+    class_index, base_damage, reduction, max_health, fights, seed, max_hits = args
+    n = len(base_damage)
+    ttk = np.empty((n, len(ENEMIES)))
+    win_rate = np.empty((n, len(ENEMIES)))
+    mean_hit = np.floor(base_damage[:, None] * _rolls(seed, class_index, len(ENEMIES), fights)).mean(axis=1)
+
+    for e, (hp, attack) in enumerate(zip(_ENEMY_HP, _ENEMY_ATTACK)):
+        rolls = _rolls(seed, class_index, e, (fights, max_hits[e]))
+        hits = np.floor(base_damage[:, None, None] * rolls[None])
+        needed = np.argmax(np.cumsum(hits, axis=2) >= hp, axis=2) + 1
+        seconds = (needed - 1) * ATTACK_INTERVAL
+        taken = (np.floor(seconds / INVULNERABLE_FOR) + 1) * np.maximum(1, np.floor(attack - reduction))[:, None]
+        ttk[:, e] = seconds.mean(axis=1)
+        win_rate[:, e] = (taken < max_health[:, None]).mean(axis=1)
+    return ttk, win_rate, mean_hit
+
+
+def simulate(level: int = 1, fights: int = 200, build: str = "primary", workers: int = 1, seed: int = 0,
+             max_loadouts: Optional[int] = None):
+    table = loadouts(level, build)
+    # Loadouts with the same class and combat stats fight identically; simulate each once.
+    combat = np.column_stack([table["class"], table["base_damage"], table["reduction"], table["max_health"]])
+    distinct, inverse = np.unique(combat, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    if max_loadouts is not None and len(distinct) > max_loadouts:
+        raise ValueError(f"{len(distinct)} distinct loadouts exceed the limit of {max_loadouts}")
+
+    chunks, order = [], []
+    for class_index in range(len(_CLASSES)):
+        rows = np.flatnonzero(distinct[:, 0] == class_index)
+        if not len(rows):
+            continue
+        base_damage, reduction, max_health = distinct[rows, 1], distinct[rows, 2], distinct[rows, 3]
+        # Same per class for every chunk, so all of its loadouts share the rolls.
+        max_hits = [_max_hits(hp, base_damage.min()) for hp in _ENEMY_HP]
+        size = max(1, CHUNK_BYTES // (fights * max(max_hits) * 8))
+        for i in range(0, len(rows), size):
+            chunks.append((class_index, base_damage[i:i + size], reduction[i:i + size], max_health[i:i + size],
+                           fights, seed, max_hits))
+            order.append(rows[i:i + size])
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(_simulate_chunk, chunks))
+    else:
+        results = [_simulate_chunk(chunk) for chunk in chunks]
+
+    ttk = np.empty((len(distinct), len(ENEMIES)))
+    win_rate = np.empty((len(distinct), len(ENEMIES)))
+    mean_hit = np.empty(len(distinct))
+    for rows, (chunk_ttk, chunk_win_rate, chunk_mean_hit) in zip(order, results):
+        ttk[rows], win_rate[rows], mean_hit[rows] = chunk_ttk, chunk_win_rate, chunk_mean_hit
+
+    table["distinct"] = len(distinct)
+    table["ttk"] = ttk[inverse]
+    table["win_rate"] = win_rate[inverse]
+    table["dps"] = mean_hit[inverse] / ATTACK_INTERVAL
+    damage_taken = np.maximum(1, np.floor(_ENEMY_ATTACK[None, :] - table["reduction"][:, None]))
+    table["toughness"] = (table["max_health"][:, None] / damage_taken).mean(axis=1)
+    table["power"] = table["dps"] * table["toughness"]
+    return table
+
+
+def _item_name(slot, index) -> Optional[str]:
+    return _ITEMS_BY_SLOT[slot][index]["id"] if index >= 0 else None
+
+
+def report(table, level: int, fights: int, curve_points: int = 12) -> dict:
+    """Per-class best loadouts and gold-per-power curves, plus each item's marginal value."""
+    empty = np.all([table[slot] == -1 for slot in SLOTS], axis=0)
+    classes = {}
+    for c, name in enumerate(_CLASSES):
+        rows = np.flatnonzero(table["class"] == c)
+        bare = rows[empty[rows]][0]
+        # Among loadouts with equal power, the cheapest one.
+        best = rows[np.lexsort((table["price"][rows], -table["power"][rows]))[0]]
+        # Pareto front of price vs power: the most power any budget up to that price buys.
+        by_price = rows[np.argsort(table["price"][rows], kind="stable")]
+        front = by_price[table["power"][by_price] >= np.maximum.accumulate(table["power"][by_price])]
+        front = front[np.linspace(0, len(front) - 1, min(curve_points, len(front))).astype(int)]
+        classes[name] = {
+            "bare": {"dps": round(float(table["dps"][bare]), 1), "power": round(float(table["power"][bare]), 1)},
+            "best": {
+                **{slot: _item_name(slot, table[slot][best]) for slot in SLOTS},
+                "price": int(table["price"][best]),
+                "dps": round(float(table["dps"][best]), 1),
+                "power": round(float(table["power"][best]), 1),
+                "ttk": {enemy: round(float(t), 2) for enemy, t in zip(ENEMIES, table["ttk"][best])},
+                "win_rate": {enemy: round(float(w), 3) for enemy, w in zip(ENEMIES, table["win_rate"][best])},
+            },
+            "gold_per_power_curve": [
+                {"price": int(table["price"][row]), "power": round(float(table["power"][row]), 1)} for row in front
+            ],
+        }
+
+    items = []
+    bare_power = table["power"][empty]  # one per class, in class order
+    for slot in SLOTS:
+        others_empty = np.all([table[other] == -1 for other in SLOTS if other != slot], axis=0)
+        for index, item in enumerate(_ITEMS_BY_SLOT[slot]):
+            rows = np.flatnonzero(others_empty & (table[slot] == index))
+            if not len(rows):
+                continue
+            gain = float((table["power"][rows] - bare_power[table["class"][rows]]).mean())
+            items.append({
+                "id": item["id"], "slot": slot, "rarity": item["rarity"], "price": item["price"],
+                "power_gain": round(gain, 1),
+                "gold_per_power": round(item["price"] / gain, 3) if gain > 0 else None,
+            })
+    items.sort(key=lambda row: (row["gold_per_power"] is None, row["gold_per_power"] or 0))
+    no_combat_stats = [
+        item["id"] for slot in SLOTS for item in _ITEMS_BY_SLOT[slot]
+        if item["level_req"] <= level and not has_combat_stats(slot, item)
+    ]
+
+    return {
+        "level": level,
+        "fights": fights,
+        "loadouts": int(len(table["class"])),
+        "distinct_loadouts": int(table["distinct"]),
+        "classes": classes,
+        "items": items,
+        "no_combat_stats": no_combat_stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--level", type=int, default=1)
+    parser.add_argument("--fights", type=int, default=200, help="fights per loadout and enemy")
+    parser.add_argument("--build", choices=BUILDS, default="primary", help="where level-up stat points go")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the full report as JSON")
+    args = parser.parse_args()
+
+    table = simulate(args.level, args.fights, args.build, args.workers, args.seed)
+    result = report(table, args.level, args.fights)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    total = result["distinct_loadouts"] * len(ENEMIES) * args.fights
+    print(f"level {args.level}, {result['loadouts']} loadouts ({result['distinct_loadouts']} distinct), "
+          f"{total} fights\n")
+    print(f"{'class':<14}{'bare dps':>9}{'best dps':>9}{'best power':>11}{'price':>7}  best loadout")
+    for name, row in result["classes"].items():
+        best = row["best"]
+        gear = ", ".join(best[slot] for slot in SLOTS if best[slot]) or "-"
+        print(f"{name:<14}{row['bare']['dps']:>9}{best['dps']:>9}{best['power']:>11}{best['price']:>7}  {gear}")
+    print(f"\n{'item':<6}{'slot':<8}{'rarity':<11}{'price':>7}{'power gain':>12}{'gold/power':>12}")
+    for item in result["items"]:
+        print(f"{item['id']:<6}{item['slot']:<8}{item['rarity']:<11}{item['price']:>7}"
+              f"{item['power_gain']:>12}{item['gold_per_power'] if item['gold_per_power'] is not None else '-':>12}")
+    if result["no_combat_stats"]:
+        print(f"\nnot ranked (no stats the fight model uses): {', '.join(result['no_combat_stats'])}")
+
+
+if __name__ == "__main__":
+    main()
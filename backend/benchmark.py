@@ -0,0 +1,263 @@
+"""Load-test the API in-process and compare against a saved baseline.
+
+The FastAPI app is driven through an in-process ASGI transport (no network, no
+uvicorn) by ``--concurrency`` virtual players. Each player creates a character
+and then loops over a weighted mix of scenarios: shop browsing, buy/equip/sell
+churn, complete-level bursts and leaderboard polling. Latency is recorded per
+route template; DB commands per route come from the metrics module's command
+listener.
+
+The database is whatever MONGO_URL / DB_NAME point at (use a local ``mongod``
+and a throwaway DB_NAME), or with ``--memory`` an in-memory mongomock_motor
+stand-in, if installed. mongomock implements only part of the aggregation
+pipeline language and emits no command events, so memory runs are for smoke
+checks and Python-side overhead, not for DB numbers.
+
+Every non-2xx response is counted per route and status. A status a route is not
+expected to return (EXPECTED_STATUSES) fails the run with exit status 1: fast
+rejections would otherwise pass for fast requests. ``--save-baseline FILE``
+stores the results; ``--baseline FILE`` compares a run against them and exits
+with status 1 if a route's p95 or the overall throughput regressed by more than
+``--tolerance``, or a route fails more often than in the baseline.
+
+Run from the backend directory::
+
+    python benchmark.py [--concurrency 32] [--duration 20] [--memory] [--baseline bench.json]
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+from catalog import LEVEL_IDS
+
+SCENARIO_WEIGHTS = {
+    "browse_shop": 30,
+    "gear_churn": 25,
+    "complete_levels": 20,
+    "leaderboard": 20,
+    "create": 5,
+}
+# Non-2xx statuses the scenarios can legitimately get; anything else is a failure.
+EXPECTED_STATUSES = {
+    "POST /api/shop/buy": {400},  # not enough gold
+}
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    async def call(self, client: httpx.AsyncClient, method: str, url: str, route: str, **kwargs):
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        key = f"{method} {route}"
+        self.latencies[key].append(time.perf_counter() - started)
+        if not 200 <= response.status_code < 300:
+            self.statuses[key][response.status_code] += 1
+        return response
+
+
+class Player:
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, rng: random.Random):
+        self.client, self.recorder, self.rng = client, recorder, rng
+        self.character = None
+        # Only catalog levels are accepted; anything else would time a fast rejection.
+        self.levels = itertools.cycle(LEVEL_IDS)
+
+    async def call(self, method, url, route, **kwargs):
+        return await self.recorder.call(self.client, method, url, route, **kwargs)
+
+    async def create(self):
+        response = await self.call("POST", "/api/characters", "/api/characters", json={
+            "name": f"bench-{self.rng.randrange(10 ** 6)}",
+            "class_type": self.rng.choice(["knight", "mage", "assassin", "dark_mage", "soldier"]),
+        })
+        if response.status_code == 200:
+            self.character = response.json()
+
+    async def browse_shop(self):
+        level = self.character["level"]
+        await self.call("GET", f"/api/shop?level={level}", "/api/shop")
+        await self.call("GET", "/api/items", "/api/items")
+        await self.call("GET", f"/api/characters/{self.character['id']}", "/api/characters/{character_id}")
+
+    async def gear_churn(self):
+        char_id = self.character["id"]
+        response = await self.call("POST", "/api/shop/buy", "/api/shop/buy",
+                                   json={"character_id": char_id, "item_id": self.rng.choice(["w1", "a1", "r1", "r2"])})
+        if response.status_code != 200:
+            return
+        bought = response.json()["inventory"][-1]
+        slot = {"weapon": "weapon", "armor": "armor", "relic": "relic"}.get(bought.get("type"), "relic")
+        await self.call("POST", f"/api/characters/{char_id}/equip", "/api/characters/{character_id}/equip",
+                        json={"instance_id": bought["instance_id"], "slot": slot})
+        await self.call("POST", f"/api/characters/{char_id}/unequip", "/api/characters/{character_id}/unequip",
+                        json={"slot": slot})
+        response = await self.call("POST", f"/api/characters/{char_id}/sell", "/api/characters/{character_id}/sell",
+                                   json={"instance_id": bought["instance_id"]})
+        if response.status_code == 200:
+            self.character = response.json()["character"]
+
+    async def complete_levels(self):
+        for _ in range(self.rng.randint(1, 4)):
+            response = await self.call("POST", "/api/game/complete-level", "/api/game/complete-level", json={
+                "character_id": self.character["id"], "level_id": next(self.levels),
+                "xp_gained": self.rng.randint(20, 200), "gold_gained": self.rng.randint(10, 120),
+                "kills": self.rng.randint(0, 12),
+            })
+            if response.status_code == 200:
+                self.character = response.json()["character"]
+
+    async def leaderboard(self):
+        await self.call("GET", "/api/leaderboard", "/api/leaderboard")
+        await self.call("GET", f"/api/leaderboard/rank/{self.character['id']}", "/api/leaderboard/rank/{character_id}")
+
+    async def run(self, deadline: float):
+        await self.create()
+        scenarios, weights = zip(*SCENARIO_WEIGHTS.items())
+        while self.character and time.monotonic() < deadline:
+            await getattr(self, self.rng.choices(scenarios, weights)[0])()
+
+
+def _db_commands_by_route(metrics) -> dict:
+    totals = defaultdict(float)
+    for labels, series in list(metrics.request_db_commands._series.items()):
+        labels = dict(labels)
+        totals[f"{labels['method']} {labels['route']}"] += series[-2]
+    return totals
+
+
+async def run(concurrency: int, duration: float, memory: bool, seed: int) -> dict:
+    if memory:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("--memory needs mongomock_motor (pip install mongomock-motor)")
+        # Read by server at import; the Motor client itself is never created.
+        os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+        os.environ.setdefault("DB_NAME", "benchmark")
+
+    import server
+    import metrics
+
+    if memory:
+        server.mongo.db = AsyncMongoMockClient()[server.mongo.name]
+        server.leaderboard.collection = server.mongo.db.characters
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    rng = random.Random(seed)
+    recorder = Recorder()
+    # Startup connects the real client and manages indexes (via $indexStats, which mongomock lacks).
+    lifespan = contextlib.nullcontext() if memory else server.app.router.lifespan_context(server.app)
+    async with lifespan:
+        commands_before = _db_commands_by_route(metrics)
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            started = time.monotonic()
+            deadline = started + duration
+            players = [Player(client, recorder, random.Random(rng.random())) for _ in range(concurrency)]
+            await asyncio.gather(*(player.run(deadline) for player in players))
+            elapsed = time.monotonic() - started
+        commands_after = _db_commands_by_route(metrics)
+
+    routes = {}
+    for route, samples in sorted(recorder.latencies.items()):
+        p50, p95, p99 = np.percentile(np.array(samples) * 1000, [50, 95, 99])
+        routes[route] = {
+            "requests": len(samples),
+            "rps": round(len(samples) / elapsed, 1),
+            "p50_ms": round(float(p50), 2),
+            "p95_ms": round(float(p95), 2),
+            "p99_ms": round(float(p99), 2),
+            "db_ops_per_request": round((commands_after[route] - commands_before[route]) / len(samples), 2),
+            "statuses": {str(status): count for status, count in sorted(recorder.statuses[route].items())},
+        }
+    total = sum(route["requests"] for route in routes.values())
+    return {"concurrency": concurrency, "duration_s": round(elapsed, 2), "memory": memory,
+            "requests": total, "rps": round(total / elapsed, 1), "routes": routes}
+
+
+def unexpected_statuses(result: dict) -> list:
+    return [
+        f"{route}: {count} responses with status {status}"
+        for route, stats in result["routes"].items()
+        for status, count in stats["statuses"].items()
+        if int(status) not in EXPECTED_STATUSES.get(route, ())
+    ]
+
+
+def compare(result: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> list:
+    regressions = []
+    if result["rps"] < baseline["rps"] * (1 - tolerance):
+        regressions.append(f"throughput {result['rps']} req/s vs baseline {baseline['rps']}")
+    for route, stats in result["routes"].items():
+        before = baseline["routes"].get(route)
+        if not before:
+            continue
+        slower = stats["p95_ms"] - before["p95_ms"]
+        # The absolute floor keeps sub-millisecond jitter on fast routes from failing runs.
+        if stats["p95_ms"] > before["p95_ms"] * (1 + tolerance) and slower > min_delta_ms:
+            regressions.append(f"{route}: p95 {stats['p95_ms']} ms vs baseline {before['p95_ms']} ms")
+        failed, failed_before = sum(stats["statuses"].values()), sum(before.get("statuses", {}).values())
+        if failed / stats["requests"] > failed_before / before["requests"] * (1 + tolerance) + 0.01:
+            regressions.append(f"{route}: {failed} of {stats['requests']} requests failed vs baseline "
+                               f"{failed_before} of {before['requests']}")
+        if stats["db_ops_per_request"] > before["db_ops_per_request"] + 0.5:
+            regressions.append(
+                f"{route}: {stats['db_ops_per_request']} DB ops/request vs baseline {before['db_ops_per_request']}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=32, help="virtual players")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--memory", action="store_true", help="use an in-memory mongomock_motor database")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline", type=Path)
+    parser.add_argument("--baseline", type=Path)
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="ignore p95 changes smaller than this")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.concurrency, args.duration, args.memory, args.seed))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"{result['requests']} requests in {result['duration_s']} s, {result['rps']} req/s "
+              f"at concurrency {result['concurrency']}\n")
+        print(f"{'route':<48}{'req':>7}{'rps':>8}{'p50':>8}{'p95':>8}{'p99':>8}{'db ops':>8}  non-2xx")
+        for route, stats in result["routes"].items():
+            statuses = ", ".join(f"{status}: {count}" for status, count in stats["statuses"].items())
+            print(f"{route:<48}{stats['requests']:>7}{stats['rps']:>8}{stats['p50_ms']:>8}{stats['p95_ms']:>8}"
+                  f"{stats['p99_ms']:>8}{stats['db_ops_per_request']:>8}  {statuses or '-'}")
+
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps(result, indent=2))
+    failures = [f"UNEXPECTED {line}" for line in unexpected_statuses(result)]
+    if args.baseline:
+        regressions = compare(result, json.loads(args.baseline.read_text()), args.tolerance, args.min_delta_ms)
+        failures += [f"REGRESSION {line}" for line in regressions]
+    for line in failures:
+        print(line, file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
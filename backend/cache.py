@@ -0,0 +1,92 @@
+"""Small in-process caches with LRU eviction, TTL expiry and hit/miss counters."""
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Any:
+        entry = self._data.get(key)
+        if entry is not None and entry[0] is not None and entry[0] < time.monotonic():
+            del self._data[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class CharacterCache(TTLCache):
+    """Stored character documents keyed by id, ordered by their ``version`` field.
+
+    Every write bumps ``version``, so a document that is older than the cached
+    one (a read or write that finished after a newer write) is dropped instead
+    of replacing it. Invalidating with a version keeps that floor for a while
+    after the entry is gone, so a read that started before the change can't
+    bring the old document back.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        super().__init__(maxsize, ttl)
+        self._floors = TTLCache(maxsize, ttl=max(ttl or 0, 5))
+
+    def store(self, character: dict):
+        entry = self._data.get(character["id"])
+        if entry is not None and entry[1].get("version", 0) > character.get("version", 0):
+            return
+        floor = self._floors.get(character["id"]) if self._floors else None
+        if floor is not None and character.get("version", 0) < floor:
+            return
+        self.put(character["id"], character)
+
+    def peek(self, key: Hashable) -> Any:
+        """The cached document, even if expired, without counting a lookup."""
+        entry = self._data.get(key)
+        return entry[1] if entry is not None else None
+
+    def invalidate(self, key: Hashable, version: Optional[int] = None):
+        super().invalidate(key)
+        if version is not None:
+            self._floors.put(key, version)
+
+    def clear(self):
+        super().clear()
+        self._floors.clear()
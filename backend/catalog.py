@@ -0,0 +1,136 @@
+"""Static game catalog: character classes and shop items.
+
+Everything derived from the catalog is built once at import time: the
+id -> item index used by the character handlers, and the already-encoded
+JSON bodies (with strong ETags) served by /classes, /items and /shop.
+"""
+import hashlib
+import os
+from bisect import bisect_right
+from typing import NamedTuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+import responses
+
+# Character class definitions
+CHARACTER_CLASSES = {
+    "knight": {
+        "name": "Rycerz", "str": 12, "dex": 8, "end": 14, "int": 4, "lck": 7,
+        "health": 120, "mana": 30, "stamina": 100, "weapon_type": "sword",
+        "description": "Wytrzymaly wojownik z mieczem i tarcza"
+    },
+    "mage": {
+        "name": "Mag", "str": 4, "dex": 6, "end": 6, "int": 16, "lck": 8,
+        "health": 70, "mana": 120, "stamina": 60, "weapon_type": "staff",
+        "description": "Potezny czarodziej wladajacy zywiolami"
+    },
+    "assassin": {
+        "name": "Zabojca", "str": 8, "dex": 16, "end": 6, "int": 6, "lck": 10,
+        "health": 80, "mana": 50, "stamina": 120, "weapon_type": "dagger",
+        "description": "Szybki i smiertelny cien nocy"
+    },
+    "dark_mage": {
+        "name": "Czarny Mag", "str": 3, "dex": 5, "end": 5, "int": 18, "lck": 9,
+        "health": 60, "mana": 140, "stamina": 50, "weapon_type": "wand",
+        "description": "Mistrz mrocznych sztuk i zakazanej magii"
+    },
+    "soldier": {
+        "name": "Zolnierz", "str": 14, "dex": 7, "end": 12, "int": 3, "lck": 6,
+        "health": 130, "mana": 20, "stamina": 110, "weapon_type": "spear",
+        "description": "Doswiadczony weteran wielu bitew"
+    },
+    "elite_soldier": {
+        "name": "Elitarny Zolnierz", "str": 13, "dex": 10, "end": 11, "int": 5, "lck": 8,
+        "health": 110, "mana": 40, "stamina": 100, "weapon_type": "crossbow",
+        "description": "Najlepszy z najlepszych, mistrz taktyki"
+    },
+    "dark_knight": {
+        "name": "Ciemny Rycerz", "str": 15, "dex": 6, "end": 13, "int": 8, "lck": 5,
+        "health": 140, "mana": 60, "stamina": 90, "weapon_type": "greatsword",
+        "description": "Rycerz pochloniety przez mrok"
+    }
+}
+
+SHOP_ITEMS = [
+    {"id": "w1", "name": "Zelazny Miecz", "type": "weapon", "weapon_type": "sword", "rarity": "common", "stats": {"attack": 8, "defense": 0, "magic": 0, "speed": 0}, "level_req": 1, "price": 100, "description": "Prosty, ale solidny miecz"},
+    {"id": "w2", "name": "Stalowy Topor", "type": "weapon", "weapon_type": "axe", "rarity": "common", "stats": {"attack": 10, "defense": 0, "magic": 0, "speed": -1}, "level_req": 1, "price": 120, "description": "Ciezki topor zadajacy potezne ciosy"},
+    {"id": "w3", "name": "Debowy Kostur", "type": "weapon", "weapon_type": "staff", "rarity": "common", "stats": {"attack": 4, "defense": 0, "magic": 8, "speed": 0}, "level_req": 1, "price": 80, "description": "Kostur wzmacniajacy magie"},
+    {"id": "w4", "name": "Luk Lowcy", "type": "weapon", "weapon_type": "bow", "rarity": "common", "stats": {"attack": 7, "defense": 0, "magic": 0, "speed": 2}, "level_req": 1, "price": 90, "description": "Szybki i celny luk"},
+    {"id": "w5", "name": "Sztylet Cienia", "type": "weapon", "weapon_type": "dagger", "rarity": "rare", "stats": {"attack": 12, "defense": 0, "magic": 0, "speed": 4}, "level_req": 3, "price": 300, "description": "Sztylet przesiakni?ty ciemnoscia"},
+    {"id": "w6", "name": "Ognisty Miecz", "type": "weapon", "weapon_type": "sword", "rarity": "rare", "stats": {"attack": 16, "defense": 2, "magic": 4, "speed": 0}, "level_req": 3, "price": 350, "description": "Miecz plonacy wiecznym ogniem"},
+    {"id": "w7", "name": "Mlot Gromu", "type": "weapon", "weapon_type": "hammer", "rarity": "epic", "stats": {"attack": 24, "defense": 4, "magic": 6, "speed": -2}, "level_req": 5, "price": 800, "description": "Mlot przyzywajacy blyskawice"},
+    {"id": "w8", "name": "Rozdzka Mrozu", "type": "weapon", "weapon_type": "wand", "rarity": "epic", "stats": {"attack": 8, "defense": 0, "magic": 22, "speed": 2}, "level_req": 5, "price": 750, "description": "Rozdzka zamrazajaca wrogow"},
+    {"id": "w9", "name": "Wlocznia Pustki", "type": "weapon", "weapon_type": "spear", "rarity": "mythic", "stats": {"attack": 30, "defense": 6, "magic": 10, "speed": 0}, "level_req": 7, "price": 1500, "description": "Wlocznia wykuta w otchlani"},
+    {"id": "w11", "name": "All Seeing Sword", "type": "weapon", "weapon_type": "sword", "rarity": "mythic", "stats": {"attack": 50, "defense": 15, "magic": 0, "speed": 2, "health_bonus": 10}, "level_req": 7, "price": 1800, "description": "Miecz ktory widzi wszystko"},
+    {"id": "a7", "name": "Warden of Demons Armour", "type": "armor", "rarity": "mythic", "stats": {"attack": 15, "defense": 0, "magic": 0, "speed": 5}, "level_req": 7, "price": 2000, "description": "Zbroja straznika demonow"},
+    {"id": "w10", "name": "Smoczobjca", "type": "weapon", "weapon_type": "sword", "rarity": "legendary", "stats": {"attack": 40, "defense": 8, "magic": 12, "speed": 3}, "level_req": 10, "price": 3000, "description": "Legendarny miecz zabojcow smokow"},
+    {"id": "a1", "name": "Skorzana Zbroja", "type": "armor", "rarity": "common", "stats": {"attack": 0, "defense": 6, "magic": 0, "speed": 0}, "level_req": 1, "price": 80, "description": "Lekka zbroja ze skorki"},
+    {"id": "a2", "name": "Kolczuga", "type": "armor", "rarity": "common", "stats": {"attack": 0, "defense": 10, "magic": 0, "speed": -1}, "level_req": 1, "price": 150, "description": "Solidna kolczuga stalowa"},
+    {"id": "a3", "name": "Plyta Stalowa", "type": "armor", "rarity": "rare", "stats": {"attack": 0, "defense": 18, "magic": 0, "speed": -2}, "level_req": 3, "price": 400, "description": "Ciezka zbroja platowa"},
+    {"id": "a4", "name": "Plaszcz Cienia", "type": "armor", "rarity": "rare", "stats": {"attack": 0, "defense": 10, "magic": 6, "speed": 3}, "level_req": 3, "price": 350, "description": "Plaszcz ukrywajacy wlasciciela"},
+    {"id": "a5", "name": "Skora Demona", "type": "armor", "rarity": "epic", "stats": {"attack": 4, "defense": 22, "magic": 8, "speed": 0}, "level_req": 5, "price": 900, "description": "Zbroja z demonskiej skory"},
+    {"id": "a6", "name": "Luska Smoka", "type": "armor", "rarity": "legendary", "stats": {"attack": 6, "defense": 35, "magic": 10, "speed": -1}, "level_req": 10, "price": 2500, "description": "Zbroja ze smoczych lusek"},
+    {"id": "r1", "name": "Amulet Zdrowia", "type": "relic", "rarity": "common", "stats": {"attack": 0, "defense": 2, "magic": 0, "speed": 0, "health_bonus": 20}, "level_req": 1, "price": 100, "description": "Zwieksza maksymalne zdrowie"},
+    {"id": "r2", "name": "Pierscień Many", "type": "relic", "rarity": "common", "stats": {"attack": 0, "defense": 0, "magic": 4, "speed": 0, "mana_bonus": 20}, "level_req": 1, "price": 100, "description": "Zwieksza maksymalna mane"},
+    {"id": "r3", "name": "Pas Wytrzymalosci", "type": "relic", "rarity": "rare", "stats": {"attack": 0, "defense": 4, "magic": 0, "speed": 1, "stamina_bonus": 30}, "level_req": 3, "price": 300, "description": "Zwieksza wytrzymalosc"},
+    {"id": "r4", "name": "Relikwia Mocy", "type": "relic", "rarity": "legendary", "stats": {"attack": 10, "defense": 8, "magic": 10, "speed": 2}, "level_req": 8, "price": 2000, "description": "Pradawna relikwia nieskonczonej mocy"},
+    {"id": "s1", "name": "Zwoj Leczenia", "type": "scroll", "rarity": "common", "stats": {"heal": 30}, "level_req": 1, "price": 50, "description": "Przywraca 30 punktow zdrowia", "consumable": True},
+    {"id": "s2", "name": "Zwoj Kuli Ognia", "type": "scroll", "rarity": "rare", "stats": {"damage": 40}, "level_req": 3, "price": 200, "description": "Zadaje 40 obrazen ognia", "consumable": True},
+    {"id": "s3", "name": "Zwoj Blyskawicy", "type": "scroll", "rarity": "epic", "stats": {"damage": 80}, "level_req": 5, "price": 500, "description": "Potezna blyskawica raz?ca wrogow", "consumable": True},
+    {"id": "w12", "name": "Broń Franka", "type": "weapon", "weapon_type": "sword", "rarity": "legendary", "stats": {"attack": 20, "defense": 5, "magic": 1, "speed": 3, "health_bonus": 20}, "level_req": 1, "price": 1, "description": "Tani miecz Michała"},
+]
+
+ITEMS_BY_ID = {item["id"]: item for item in SHOP_ITEMS}
+ITEM_IDS = list(ITEMS_BY_ID)
+ITEM_PRICES = [ITEMS_BY_ID[item_id]["price"] for item_id in ITEM_IDS]
+
+# Must match the ids of LEVELS in frontend/src/game/data/gameData.js: a level added
+# there is rejected by the API until it is listed here too. A level unlocks once the
+# one before it is completed.
+LEVEL_IDS = [1, 2, 3]
+
+
+class EncodedBody(NamedTuple):
+    body: bytes
+    etag: str
+
+
+def _encode(content) -> EncodedBody:
+    # Same encoding as the app's default response class, so clients see identical bytes.
+    body = responses.dumps(content)
+    return EncodedBody(body, '"%s"' % hashlib.sha256(body).hexdigest()[:32])
+
+
+CLASSES_BODY = _encode(CHARACTER_CLASSES)
+ITEMS_BODY = _encode(SHOP_ITEMS)
+
+# /shop?level=N lists the items with level_req <= N + 2, in catalog order. Only the
+# distinct level_req values matter, so one body per threshold covers every N.
+_SHOP_THRESHOLDS = sorted({item["level_req"] for item in SHOP_ITEMS})
+_SHOP_BODIES = [
+    _encode([item for item in SHOP_ITEMS if item["level_req"] <= threshold])
+    for threshold in [_SHOP_THRESHOLDS[0] - 1] + _SHOP_THRESHOLDS
+]
+
+
+def shop_body(level: int) -> EncodedBody:
+    return _SHOP_BODIES[bisect_right(_SHOP_THRESHOLDS, level + 2)]
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison, so a W/ prefix doesn't matter.
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def respond(request: Request, encoded: EncodedBody) -> Response:
+    # The catalog only changes on deploy; by default clients revalidate every time
+    # and get an empty 304 back until it does.
+    headers = {"ETag": encoded.etag, "Cache-Control": os.environ.get("CATALOG_CACHE_CONTROL", "public, no-cache")}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, encoded.etag):
+        return Response(status_code=304, headers=headers)
+    return responses.encoded_response(encoded.body, headers=headers)
@@ -0,0 +1,48 @@
+"""Single-flight coalescing of identical concurrent reads.
+
+Callers that ask for the same key while a read for it is in flight await that
+read instead of starting their own, so a burst of identical requests costs one
+query. A finished result can optionally keep being handed out for a short
+linger window; failures are never shared after the fact.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    def __init__(self, linger: float = 0.0):
+        self.linger = linger
+        self._flights: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        flight = self._flights.get(key)
+        if flight is None:
+            self.calls += 1
+            flight = asyncio.ensure_future(fn())
+            self._flights[key] = flight
+            flight.add_done_callback(lambda done: self._land(key, done))
+        else:
+            self.shared += 1
+        # One caller going away (client disconnect) must not cancel the read for the others.
+        return await asyncio.shield(flight)
+
+    def _land(self, key, flight):
+        if self.linger > 0 and not flight.cancelled() and flight.exception() is None:
+            asyncio.get_running_loop().call_later(self.linger, self._drop, key, flight)
+        else:
+            self._drop(key, flight)
+
+    def _drop(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def forget(self, key: Hashable):
+        """Stop handing out a lingering result, e.g. after the underlying data changed."""
+        flight = self._flights.get(key)
+        if flight is not None and flight.done():
+            del self._flights[key]
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._flights), "calls": self.calls, "shared": self.shared}
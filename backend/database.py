@@ -0,0 +1,202 @@
+"""MongoDB connection lifecycle: pool configuration, warm-up and readiness.
+
+The Motor client is created when the app starts (Mongo.connected, run from the
+FastAPI lifespan) rather than at import, so every uvicorn worker owns exactly
+one pool and closes it on shutdown. Pool sizes, timeouts and wire compression
+come from the environment; unset values fall back to MONGO_URL options and then
+PyMongo's defaults. Each worker opens its own pool, so MONGO_MAX_POOL_SIZE times
+the number of workers is what the server has to accept.
+
+Startup opens MONGO_WARM_CONNECTIONS connections with concurrent pings, so the
+first requests don't pay for TCP, TLS and auth handshakes. PoolListener tracks
+open and checked-out connections per server for the readiness probe and the
+metrics endpoint.
+"""
+import asyncio
+import contextlib
+import importlib.util
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Environment variable -> MongoClient keyword.
+POOL_OPTIONS = {
+    "MONGO_MAX_POOL_SIZE": "maxPoolSize",
+    "MONGO_MIN_POOL_SIZE": "minPoolSize",
+    "MONGO_MAX_IDLE_MS": "maxIdleTimeMS",
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": "waitQueueTimeoutMS",
+    "MONGO_CONNECT_TIMEOUT_MS": "connectTimeoutMS",
+    "MONGO_SOCKET_TIMEOUT_MS": "socketTimeoutMS",
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": "serverSelectionTimeoutMS",
+}
+# Compressor -> module PyMongo needs for it; zlib ships with Python.
+COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+
+def client_options(environ=os.environ) -> dict:
+    options = {keyword: int(environ[name]) for name, keyword in POOL_OPTIONS.items() if environ.get(name)}
+    requested = [name.strip() for name in environ.get("MONGO_COMPRESSORS", "").split(",") if name.strip()]
+    available = []
+    for name in requested:
+        module = COMPRESSOR_MODULES.get(name)
+        if module and importlib.util.find_spec(module):
+            available.append(name)
+        else:
+            logger.warning("MongoDB compressor %s is unavailable (needs the %s module); skipping it", name, module)
+    if available:
+        options["compressors"] = ",".join(available)
+    return options
+
+
+class PoolListener(monitoring.ConnectionPoolListener):
+    """Open, checked-out and waiting connection counts per server address."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open: Dict[str, int] = defaultdict(int)
+        self.in_use: Dict[str, int] = defaultdict(int)
+        self.waiting: Dict[str, int] = defaultdict(int)
+        self.checkout_timeouts = 0
+
+    def _add(self, counts, event, amount):
+        with self._lock:
+            counts["%s:%s" % event.address] += amount
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        with self._lock:
+            address = "%s:%s" % event.address
+            for counts in (self.open, self.in_use, self.waiting):
+                counts.pop(address, None)
+
+    def connection_created(self, event):
+        self._add(self.open, event, 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(self.open, event, -1)
+
+    def connection_check_out_started(self, event):
+        self._add(self.waiting, event, 1)
+
+    def connection_check_out_failed(self, event):
+        self._add(self.waiting, event, -1)
+        if event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT:
+            with self._lock:
+                self.checkout_timeouts += 1
+
+    def connection_checked_out(self, event):
+        self._add(self.waiting, event, -1)
+        self._add(self.in_use, event, 1)
+
+    def connection_checked_in(self, event):
+        self._add(self.in_use, event, -1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                address: {"open": self.open[address], "in_use": self.in_use[address], "waiting": self.waiting[address]}
+                for address in self.open
+            }
+
+
+class Mongo:
+    def __init__(self, url: str, name: str, options: Optional[dict] = None, warm_connections: int = 0):
+        self.url, self.name = url, name
+        self.options = options or {}
+        self.warm_connections = warm_connections
+        self.pool = PoolListener()
+        self.client: Optional[AsyncIOMotorClient] = None
+        self.db = None
+
+    @classmethod
+    def from_env(cls, environ=os.environ) -> "Mongo":
+        return cls(
+            environ["MONGO_URL"],
+            environ["DB_NAME"],
+            client_options(environ),
+            warm_connections=int(environ.get("MONGO_WARM_CONNECTIONS", 4)),
+        )
+
+    @property
+    def max_pool_size(self) -> int:
+        return self.client.options.pool_options.max_pool_size
+
+    async def connect(self, warm_up: bool = True):
+        self.client = AsyncIOMotorClient(
+            self.url, event_listeners=[metrics.CommandListener(), self.pool], **self.options
+        )
+        self.db = self.client[self.name]
+        if warm_up:
+            await self.warm_up()
+        return self.db
+
+    async def warm_up(self):
+        started = time.perf_counter()
+        # Concurrent pings each check out their own connection, so the pool grows to
+        # this many before the first request arrives.
+        count = max(1, min(self.warm_connections, self.max_pool_size))
+        await asyncio.gather(*(self.client.admin.command("ping") for _ in range(count)))
+        logger.info("MongoDB ready: %d connections warmed in %.1f ms (pool max %d, compression %s)",
+                    count, (time.perf_counter() - started) * 1000, self.max_pool_size,
+                    self.options.get("compressors", "off"))
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+        self.client = self.db = None
+
+    @contextlib.asynccontextmanager
+    async def connected(self, warm_up: bool = True):
+        try:
+            yield await self.connect(warm_up)
+        finally:
+            self.close()
+
+    def pool_stats(self) -> dict:
+        servers = self.pool.snapshot()
+        in_use = max((server["in_use"] for server in servers.values()), default=0)
+        return {
+            "max_size": self.max_pool_size,
+            "saturation": round(in_use / self.max_pool_size, 3) if self.max_pool_size else 0.0,
+            "waiting": sum(server["waiting"] for server in servers.values()),
+            "checkout_timeouts": self.pool.checkout_timeouts,
+            "servers": servers,
+        }
+
+    async def readiness(self, timeout: float = 2.0) -> dict:
+        """Ping latency and pool usage; ``ready`` is False if the ping fails or requests queue for connections."""
+        if self.client is None:
+            return {"ready": False, "error": "not connected"}
+        pool = self.pool_stats()
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.client.admin.command("ping"), timeout)
+        except Exception as exc:
+            return {"ready": False, "error": f"ping failed: {exc!r}", "pool": pool}
+        saturated = pool["saturation"] >= 1 and pool["waiting"] > 0
+        return {
+            "ready": not saturated,
+            "ping_ms": round((time.perf_counter() - started) * 1000, 2),
+            "pool": pool,
+        }
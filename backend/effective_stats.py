@@ -0,0 +1,75 @@
+"""Effective combat stats: what a character fights with once its equipment is on.
+
+The equipment part only depends on the class, the stat block and which catalog
+items are equipped, and those builds repeat heavily across players, so it is
+memoized on exactly that tuple. Damage and damage reduction follow the formulas
+the game client (GameScene.calcDamage / takeDamage) applies, so the numbers
+served here are the ones anti-cheat checks can compare reported fights with.
+"""
+import os
+from typing import Optional
+
+from cache import TTLCache
+from catalog import ITEMS_BY_ID
+from progression import STATS
+
+ITEM_STATS = ["attack", "defense", "magic", "speed"]
+# Equipment bonuses raise the character's own maxima.
+BONUSES = {"health_bonus": "max_health", "mana_bonus": "max_mana", "stamina_bonus": "max_stamina"}
+RANGED_CLASSES = {"mage", "dark_mage", "elite_soldier"}
+UNARMED_ATTACK = 5
+DAMAGE_PER_STAT = 1.8
+DAMAGE_VARIANCE = (0.85, 1.15)
+
+memo = TTLCache(maxsize=int(os.environ.get('EFFECTIVE_STATS_CACHE_SIZE', 4096)))
+
+
+def _equipment_totals(class_type, stats, equipped):
+    """stats is a tuple in STATS order, equipped a (slot, item) tuple of the hydrated items."""
+    stats = dict(zip(STATS, stats))
+    items = dict(equipped)
+    totals = {name: 0 for name in [*ITEM_STATS, *BONUSES]}
+    for item in items.values():
+        if item:
+            for name, value in (item.get("stats") or {}).items():
+                if name in totals:
+                    totals[name] += value
+
+    weapon = items.get("weapon")
+    weapon_attack = ((weapon or {}).get("stats") or {}).get("attack") or UNARMED_ATTACK
+    primary = stats.get("int" if class_type in RANGED_CLASSES else "str", 0)
+    base_damage = weapon_attack + primary * DAMAGE_PER_STAT
+    armor_defense = ((items.get("armor") or {}).get("stats") or {}).get("defense", 0)
+    return {
+        **totals,
+        "damage": {"min": int(base_damage * DAMAGE_VARIANCE[0]), "max": int(base_damage * DAMAGE_VARIANCE[1])},
+        "damage_reduction": (stats.get("end", 0) * 1.5 + armor_defense) / 4,
+    }
+
+
+def compute(character: dict) -> Optional[dict]:
+    """Effective stats of a presented character (hydrated ``equipment``), or None for legacy shapes."""
+    equipment = character.get("equipment")
+    if not isinstance(equipment, dict) or not isinstance(character.get("stats"), dict):
+        return None
+
+    stats = tuple(character["stats"].get(stat, 0) for stat in STATS)
+    equipped = tuple((slot, item) for slot, item in equipment.items())
+    if all(not item or item.get("id") in ITEMS_BY_ID for _, item in equipped):
+        key = (character.get("class_type"), stats, tuple((slot, item and item["id"]) for slot, item in equipped))
+        totals = memo.get(key)
+        if totals is None:
+            totals = _equipment_totals(character.get("class_type"), stats, equipped)
+            memo.put(key, totals)
+    else:
+        # Items outside the catalog carry their own stats and can't be keyed by id.
+        totals = _equipment_totals(character.get("class_type"), stats, equipped)
+
+    # totals may be the memoized dict shared by every character with this build, so
+    # nothing of it is handed out by reference.
+    return {
+        "stats": dict(zip(STATS, stats)),
+        **totals,
+        "damage": dict(totals["damage"]),
+        **{maximum: character.get(maximum, 0) + totals[bonus] for bonus, maximum in BONUSES.items()},
+    }
@@ -0,0 +1,209 @@
+"""Idempotency-Key support for retried mutations.
+
+A client that sends ``Idempotency-Key: <unique value>`` with a POST to one of
+the configured routes can retry it safely: the first response is stored under
+the key (and the request path), and a retry gets that response back, marked
+``Idempotent-Replayed: true``, without the handler running again. The stored
+response is tied to a hash of the request body; reusing a key for a different
+body is rejected with 422. A retry that arrives while the first request is
+still running waits for it instead of running alongside it.
+
+Only final answers are stored: successes and client errors, but not 409/429
+(the client is told to retry those) or server errors. Entries live in a
+bounded in-process TTLCache. With a database bound (``bind``), they are also
+written to the ``idempotency_keys`` collection, whose TTL index expires them,
+so a retry that lands on another worker is answered too; there a key is
+claimed with an insert before the handler runs, and a concurrent duplicate
+on another worker gets 409.
+"""
+import asyncio
+import hashlib
+import logging
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import orjson
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+HEADER = b"idempotency-key"
+MAX_KEY_LENGTH = 255
+# Statuses that invite a retry, so they must not be replayed.
+RETRYABLE = {409, 429}
+
+
+class _Stored:
+    __slots__ = ("fingerprint", "status", "headers", "body")
+
+    def __init__(self, fingerprint: str, status: int, headers: List, body: bytes):
+        self.fingerprint = fingerprint
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+def _storable(status: int) -> bool:
+    return status < 500 and status not in RETRYABLE
+
+
+def _error(status: int, detail: str):
+    body = orjson.dumps({"detail": detail})
+    return _Stored("", status, [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+                   body)
+
+
+class IdempotencyStore:
+    def __init__(self, maxsize: int = 10000, ttl: float = 86400):
+        self.ttl = ttl
+        self.responses = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.collection = None
+        self.in_flight: Dict[str, asyncio.Future] = {}
+        self.counts = {"stored": 0, "replayed": 0, "waited": 0, "conflicts": 0, "mismatches": 0}
+
+    async def bind(self, db):
+        """Mirror entries to MongoDB; the TTL index removes them after ``ttl`` seconds."""
+        self.collection = db.idempotency_keys
+        await self.collection.create_index("created_at", expireAfterSeconds=int(self.ttl))
+
+    def _expired_before(self) -> datetime:
+        # The TTL monitor only runs once a minute; entries it hasn't removed yet are ignored.
+        return datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+
+    async def lookup(self, entry_id: str) -> Optional[_Stored]:
+        stored = self.responses.get(entry_id)
+        if stored is not None or self.collection is None:
+            return stored
+        try:
+            doc = await self.collection.find_one({"_id": entry_id, "status": {"$exists": True}})
+        except PyMongoError as exc:
+            logger.warning("Idempotency key lookup failed: %s", exc)
+            return None
+        if doc is None or doc["created_at"].replace(tzinfo=timezone.utc) < self._expired_before():
+            return None
+        stored = _Stored(doc["fingerprint"], doc["status"], [tuple(pair) for pair in doc["headers"]], doc["body"])
+        self.responses.put(entry_id, stored)
+        return stored
+
+    async def claim(self, entry_id: str) -> bool:
+        """False if another worker holds the key for a request still in progress."""
+        if self.collection is None:
+            return True
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.insert_one({"_id": entry_id, "created_at": now})
+        except DuplicateKeyError:
+            # In progress elsewhere, or a claim left behind past its TTL.
+            result = await self.collection.replace_one(
+                {"_id": entry_id, "created_at": {"$lt": self._expired_before()}}, {"created_at": now})
+            return result.modified_count == 1
+        except PyMongoError as exc:
+            logger.warning("Idempotency key claim failed: %s; handling the request unguarded", exc)
+        return True
+
+    async def finish(self, entry_id: str, stored: Optional[_Stored]):
+        if stored is not None:
+            self.responses.put(entry_id, stored)
+            self.counts["stored"] += 1
+        if self.collection is None:
+            return
+        try:
+            if stored is None:
+                # Nothing final to replay; release the key so a retry runs the request again.
+                await self.collection.delete_one({"_id": entry_id})
+            else:
+                await self.collection.update_one({"_id": entry_id}, {"$set": {
+                    "fingerprint": stored.fingerprint,
+                    "status": stored.status,
+                    "headers": [list(pair) for pair in stored.headers],
+                    "body": stored.body,
+                }})
+        except PyMongoError as exc:
+            logger.warning("Storing idempotency key failed: %s", exc)
+
+    def stats(self) -> dict:
+        return {"cache": self.responses.stats(), "in_flight": len(self.in_flight), **self.counts}
+
+
+class IdempotencyMiddleware:
+    def __init__(self, app, store: IdempotencyStore, paths: List[str]):
+        self.app = app
+        self.store = store
+        self.paths = re.compile("|".join(f"(?:{path})" for path in paths))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not self.paths.fullmatch(scope["path"]):
+            return await self.app(scope, receive, send)
+        key = dict(scope.get("headers") or []).get(HEADER)
+        if key is None:
+            return await self.app(scope, receive, send)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return await _send(send, _error(400, f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters"))
+
+        # The body is read here to fingerprint it, then handed to the app unchanged.
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        body = b"".join(chunks)
+        fingerprint = hashlib.sha256(body).hexdigest()
+        entry_id = f"{scope['path']}|{key.decode('latin-1')}"
+        store = self.store
+
+        stored = await store.lookup(entry_id)
+        if stored is None and entry_id in store.in_flight:
+            store.counts["waited"] += 1
+            stored = await asyncio.shield(store.in_flight[entry_id])
+        if stored is not None:
+            if stored.fingerprint != fingerprint:
+                store.counts["mismatches"] += 1
+                return await _send(send, _error(422, "Idempotency-Key was already used for a different request"))
+            store.counts["replayed"] += 1
+            return await _send(send, stored, replayed=True)
+
+        if entry_id in store.in_flight or not await store.claim(entry_id):
+            store.counts["conflicts"] += 1
+            return await _send(send, _error(409, "A request with this Idempotency-Key is in progress"))
+
+        flight = store.in_flight[entry_id] = asyncio.get_running_loop().create_future()
+        status, headers, sent = 500, [], []
+
+        async def replay_receive():
+            nonlocal body
+            if body is None:
+                return await receive()
+            message, body = {"type": "http.request", "body": body, "more_body": False}, None
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                status, headers = message["status"], message.get("headers", [])
+            elif message["type"] == "http.response.body":
+                sent.append(message.get("body", b""))
+            await send(message)
+
+        stored = None
+        try:
+            await self.app(scope, replay_receive, send_wrapper)
+            if _storable(status):
+                stored = _Stored(fingerprint, status, list(headers), b"".join(sent))
+        finally:
+            await store.finish(entry_id, stored)
+            del store.in_flight[entry_id]
+            flight.set_result(stored)
+
+
+async def _send(send, stored: _Stored, replayed: bool = False):
+    headers = list(stored.headers)
+    if replayed:
+        headers.append((b"idempotent-replayed", b"true"))
+    await send({"type": "http.response.start", "status": stored.status, "headers": headers})
+    await send({"type": "http.response.body", "body": stored.body})
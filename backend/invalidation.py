@@ -0,0 +1,207 @@
+"""Keep this worker's caches in step with writes made by other workers.
+
+A change stream on ``characters`` reports every insert, update, replace and
+delete, including our own. Inserts and replaces carry the whole document and
+are stored as is. An update is applied to the cached document when that is
+exactly one version behind, so the cache moves forward without a read;
+anything else (not cached, a gap in versions, truncated arrays) invalidates
+the entry, with the new version as a floor so an older in-flight read can't
+put it back. Deletes drop the entry. Changes to leaderboard fields go to the
+materialized boards the same way.
+
+The resume token of the last handled event is kept, and a stream that fails
+is reopened after it, so nothing is skipped across reconnects. If the token
+has expired from the oplog, every cache is cleared instead.
+
+Change streams need a replica set. On a standalone ``mongod``, or with a
+client that has no ``watch`` at all (mongomock in tests), the watcher logs
+that once and stops, and the caches run on their plain TTLs, as they also do
+while a stream is down. While a stream is open, the TTLs are raised to the
+``watched_ttl`` values. For local testing, a single-node replica set is
+enough (``mongod --replSet rs0`` followed by ``rs.initiate()``).
+"""
+import asyncio
+import contextlib
+import logging
+from typing import Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from leaderboard import ENTRY_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# $changeStream is only supported on replica sets / resume token no longer in the oplog.
+STANDALONE_ERROR = 40573
+HISTORY_LOST_ERRORS = {260, 280, 286}
+OPERATIONS = ["insert", "update", "replace", "delete", "drop", "rename", "dropDatabase", "invalidate"]
+
+
+def _assign(container, parts, value, remove=False):
+    """A copy of container with the dotted path set (or unset); shares untouched branches."""
+    head, rest = parts[0], parts[1:]
+    if isinstance(container, list):
+        index = int(head)
+        updated = list(container)
+        if rest:
+            updated[index] = _assign(updated[index], rest, value, remove)
+        elif remove:
+            updated[index] = None  # $unset on an array element leaves null behind
+        elif index == len(updated):
+            updated.append(value)
+        else:
+            updated[index] = value
+        return updated
+    updated = dict(container)
+    if rest:
+        updated[head] = _assign(updated.get(head, {}), rest, value, remove)
+    elif remove:
+        updated.pop(head, None)
+    else:
+        updated[head] = value
+    return updated
+
+
+def apply_update(doc: dict, description: dict) -> Optional[dict]:
+    """doc with a change event's updateDescription applied, or None if it can't be replayed."""
+    if description.get("truncatedArrays"):
+        return None
+    try:
+        for path, value in description.get("updatedFields", {}).items():
+            doc = _assign(doc, path.split("."), value)
+        for path in description.get("removedFields", []):
+            doc = _assign(doc, path.split("."), None, remove=True)
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+    return doc
+
+
+class CacheWatcher:
+    def __init__(self, character_cache, leaderboard, reads, watched_ttl: float, leaderboard_watched_ttl: float):
+        self.character_cache = character_cache
+        self.leaderboard = leaderboard
+        self.reads = reads
+        self._ttls = {
+            "watched": (watched_ttl, leaderboard_watched_ttl),
+            "fallback": (character_cache.ttl, leaderboard.ttl),
+        }
+        self.mode = "fallback"
+        self.resume_token = None
+        self.counts = {"stored": 0, "patched": 0, "invalidated": 0, "skipped": 0, "deleted": 0, "resets": 0}
+
+    def _set_mode(self, mode: str):
+        if mode != self.mode:
+            self.character_cache.ttl, self.leaderboard.ttl = self._ttls[mode]
+            self.mode = mode
+            logger.info("Cache invalidation: %s TTLs", mode)
+
+    def reset(self):
+        self.character_cache.clear()
+        self.leaderboard.expire()
+        self.counts["resets"] += 1
+
+    def apply(self, change: dict):
+        operation = change["operationType"]
+        character_id = (change.get("documentKey") or {}).get("_id")
+        if operation in ("insert", "replace"):
+            doc = {key: value for key, value in change["fullDocument"].items() if key != "_id"}
+            self.character_cache.store(doc)
+            self.counts["stored"] += 1
+            self.leaderboard.record(doc)
+        elif operation == "update":
+            self._apply_update(character_id, change["updateDescription"])
+        elif operation == "delete":
+            self.character_cache.invalidate(character_id)
+            self.reads.forget(("character", character_id))
+            self.reads.forget(("rank", character_id))
+            self.leaderboard.remove(character_id)
+            self.counts["deleted"] += 1
+        else:
+            # The collection itself went away or was renamed; nothing cached can be trusted.
+            self.reset()
+
+    def _apply_update(self, character_id, description):
+        changed = description.get("updatedFields", {})
+        version = changed.get("version")
+        touched = {path.split(".", 1)[0] for path in [*changed, *description.get("removedFields", [])]}
+        cached = self.character_cache.peek(character_id)
+        if cached is not None and version is not None and cached.get("version", 0) >= version:
+            # Our own write (or a newer one) is already cached. The boards may still be
+            # behind: a read can cache another worker's write before its event arrives.
+            self.counts["skipped"] += 1
+            if touched.intersection(ENTRY_FIELDS):
+                self.leaderboard.record(cached)
+            return
+
+        patched = None
+        if cached is not None and version is not None and cached.get("version", 0) == version - 1:
+            patched = apply_update(cached, description)
+        self.reads.forget(("character", character_id))
+        self.reads.forget(("rank", character_id))
+        if patched is not None:
+            self.character_cache.store(patched)
+            self.counts["patched"] += 1
+        else:
+            self.character_cache.invalidate(character_id, version)
+            self.counts["invalidated"] += 1
+
+        if touched.intersection(ENTRY_FIELDS):
+            if patched is not None:
+                self.leaderboard.record(patched)
+            else:
+                self.leaderboard.expire()
+
+    async def watch(self, collection, retry_delay: float = 1.0, max_retry_delay: float = 30.0):
+        pipeline = [{"$match": {"operationType": {"$in": OPERATIONS}}}]
+        delay = retry_delay
+        while True:
+            try:
+                stream = collection.watch(pipeline, resume_after=self.resume_token)
+            except (AttributeError, NotImplementedError, TypeError) as exc:
+                logger.warning("Change streams unsupported by this client (%s); caches rely on their TTLs", exc)
+                self._set_mode("fallback")
+                return
+            try:
+                async with stream:
+                    self._set_mode("watched")
+                    delay = retry_delay
+                    async for change in stream:
+                        self.apply(change)
+                        self.resume_token = stream.resume_token
+            except OperationFailure as exc:
+                if exc.code == STANDALONE_ERROR:
+                    logger.info("Change streams unavailable (standalone mongod); caches rely on their TTLs")
+                    self._set_mode("fallback")
+                    return
+                if exc.code in HISTORY_LOST_ERRORS:
+                    logger.warning("Change stream can't resume (%s); clearing caches", exc)
+                    self.resume_token = None
+                    self.reset()
+                    continue
+                logger.warning("Change stream failed: %s; retrying in %.0f s", exc, delay)
+            except PyMongoError as exc:
+                logger.warning("Change stream failed: %s; retrying in %.0f s", exc, delay)
+            except Exception:
+                # Not a database problem, so retrying would fail the same way.
+                logger.exception("Change stream watcher stopped; caches rely on their TTLs")
+                self.reset()
+                self._set_mode("fallback")
+                return
+            # Writes made elsewhere go unseen until the stream is back; the TTLs bound that.
+            self._set_mode("fallback")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_retry_delay)
+
+    @contextlib.asynccontextmanager
+    async def running(self, collection):
+        task = asyncio.create_task(self.watch(collection))
+        try:
+            yield self
+        finally:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+            self._set_mode("fallback")
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, **self.counts}
@@ -0,0 +1,227 @@
+"""Materialized leaderboards over the characters collection.
+
+The global board and one board per class_type are loaded once from an
+indexed sort and then kept current by the handlers that change standings
+(record/remove), so reading a board never touches MongoDB. Ranks for a
+single character come from an indexed count of the characters ahead of it.
+
+LeaderboardFeed pushes boards to live subscribers: one producer per board
+wakes up when record/remove change standings (debounced, or every ttl to pick
+up other workers' writes), re-reads the board once and sends every subscriber
+only the ranks that changed.
+"""
+import asyncio
+import contextlib
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+from pymongo import ASCENDING, DESCENDING
+
+from coalesce import SingleFlight
+
+ENTRY_FIELDS = ["id", "name", "class_type", "level", "kills", "completed_levels"]
+SORT = [("level", DESCENDING), ("kills", DESCENDING), ("_id", ASCENDING)]
+# Created at startup by schema.ensure_indexes.
+INDEXES = [
+    SORT,
+    [("class_type", ASCENDING)] + SORT,
+]
+
+
+def _sort_key(entry):
+    return (-entry.get("level", 0), -entry.get("kills", 0), entry["id"])
+
+
+class Leaderboard:
+    def __init__(self, collection, size: int = 20, ttl: float = 60.0):
+        self.collection = collection
+        self.size = size
+        # Other workers write to the same collection; boards are re-read after ttl
+        # seconds so their changes show up eventually.
+        self.ttl = ttl
+        self._boards: Dict[Optional[str], List[dict]] = {}
+        self._loaded_at: Dict[Optional[str], float] = {}
+        self._generation = 0
+        # Requests that find a board missing or expired at the same moment share one load.
+        self._loads = SingleFlight()
+        # Called after every record/remove, e.g. by LeaderboardFeed.
+        self.listeners: List[Callable[[], None]] = []
+
+    async def top(self, class_type: Optional[str] = None) -> List[dict]:
+        board = self._boards.get(class_type)
+        if board is None or time.monotonic() - self._loaded_at[class_type] > self.ttl:
+            board = await self._loads.do(class_type, lambda: self._load(class_type))
+        return [dict(entry) for entry in board]
+
+    async def _load(self, class_type):
+        generation = self._generation
+        query = {} if class_type is None else {"class_type": class_type}
+        projection = {"_id": 0, **{field: 1 for field in ENTRY_FIELDS}}
+        board = await self.collection.find(query, projection).sort(SORT).limit(self.size).to_list(self.size)
+        # A record/remove that landed while we were reading may be missing from
+        # this snapshot; serve it but let the next read load again.
+        if generation == self._generation:
+            self._boards[class_type] = board
+            self._loaded_at[class_type] = time.monotonic()
+        return board
+
+    def record(self, character: dict):
+        """Apply a character's new level/kills/name to every cached board it belongs to."""
+        self._generation += 1
+        entry = {field: character[field] for field in ENTRY_FIELDS if field in character}
+        for class_type in list(self._boards):
+            if class_type is not None and class_type != entry.get("class_type"):
+                continue
+            board = self._boards[class_type]
+            was_listed = self._discard(board, entry["id"])
+            full = len(board) >= self.size - (1 if was_listed else 0)
+            if full and board and _sort_key(entry) > _sort_key(board[-1]):
+                if was_listed:
+                    # It dropped out; whoever takes the freed place is only known to the DB.
+                    self._invalidate(class_type)
+                continue
+            board.append(entry)
+            board.sort(key=_sort_key)
+            del board[self.size:]
+        self._notify()
+
+    def remove(self, character_id: str):
+        self._generation += 1
+        for class_type in list(self._boards):
+            if self._discard(self._boards[class_type], character_id):
+                self._invalidate(class_type)
+        self._notify()
+
+    def _notify(self):
+        for listener in self.listeners:
+            listener()
+
+    def expire(self):
+        """Drop every board so the next read loads it again (standings changed elsewhere)."""
+        self._generation += 1
+        self._boards.clear()
+        self._loaded_at.clear()
+        self._notify()
+
+    def _invalidate(self, class_type):
+        self._boards.pop(class_type, None)
+        self._loaded_at.pop(class_type, None)
+
+    @staticmethod
+    def _discard(board, character_id) -> bool:
+        for index, entry in enumerate(board):
+            if entry["id"] == character_id:
+                del board[index]
+                return True
+        return False
+
+    async def rank(self, character: dict) -> dict:
+        level, kills = character.get("level", 0), character.get("kills", 0)
+        ahead = {"$or": [
+            {"level": {"$gt": level}},
+            {"level": level, "kills": {"$gt": kills}},
+            {"level": level, "kills": kills, "_id": {"$lt": character["id"]}},
+        ]}
+        overall, in_class = await asyncio.gather(
+            self.collection.count_documents(ahead),
+            self.collection.count_documents({"class_type": character.get("class_type"), **ahead}),
+        )
+        return {"rank": overall + 1, "class_rank": in_class + 1}
+
+
+def board_diff(before: List[dict], after: List[dict]) -> Optional[dict]:
+    """The ranks whose entry changed and the new board length, or None if nothing did."""
+    changed = [
+        {"rank": rank, "entry": entry}
+        for rank, entry in enumerate(after, 1)
+        if rank > len(before) or before[rank - 1] != entry
+    ]
+    if not changed and len(before) == len(after):
+        return None
+    return {"changes": changed, "size": len(after)}
+
+
+class _Channel:
+    def __init__(self, class_type: Optional[str]):
+        self.class_type = class_type
+        self.board: Optional[List[dict]] = None
+        self.seq = 0
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.changed = asyncio.Event()
+        self.producer: Optional[asyncio.Task] = None
+
+    def snapshot(self) -> dict:
+        return {"type": "snapshot", "seq": self.seq, "board": self.board}
+
+
+class LeaderboardFeed:
+    def __init__(self, leaderboard: Leaderboard, debounce: float = 0.25, queue_size: int = 64):
+        self.leaderboard = leaderboard
+        self.debounce = debounce
+        self.queue_size = queue_size
+        self._channels: Dict[Optional[str], _Channel] = {}
+        self.broadcasts = 0
+        leaderboard.listeners.append(self._changed)
+
+    def _changed(self):
+        for channel in self._channels.values():
+            channel.changed.set()
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, class_type: Optional[str] = None):
+        """A queue that gets a snapshot first, then a diff message per change."""
+        channel = self._channels.get(class_type)
+        if channel is None:
+            channel = self._channels[class_type] = _Channel(class_type)
+        queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        channel.subscribers.add(queue)
+        try:
+            if channel.board is None:
+                channel.board = await self.leaderboard.top(class_type)
+            queue.put_nowait(channel.snapshot())
+            if channel.producer is None:
+                channel.producer = asyncio.create_task(self._produce(channel))
+            yield queue
+        finally:
+            channel.subscribers.discard(queue)
+            if not channel.subscribers and self._channels.get(class_type) is channel:
+                del self._channels[class_type]
+                if channel.producer is not None:
+                    channel.producer.cancel()
+
+    async def _produce(self, channel: _Channel):
+        while True:
+            try:
+                await asyncio.wait_for(channel.changed.wait(), self.leaderboard.ttl)
+            except asyncio.TimeoutError:
+                pass
+            # Changes landing during the debounce window are folded into this round.
+            await asyncio.sleep(self.debounce)
+            channel.changed.clear()
+            try:
+                board = await self.leaderboard.top(channel.class_type)
+            except Exception:
+                # Subscribers keep the last board; the next change or tick tries again.
+                continue
+            diff = board_diff(channel.board, board)
+            if diff is None:
+                continue
+            channel.seq += 1
+            channel.board = board
+            self.broadcasts += 1
+            message = {"type": "diff", "seq": channel.seq, **diff}
+            for queue in list(channel.subscribers):
+                try:
+                    queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    # Too far behind to catch up diff by diff; start it over from the current board.
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(channel.snapshot())
+
+    def stats(self) -> dict:
+        return {
+            "channels": len(self._channels),
+            "subscribers": sum(len(channel.subscribers) for channel in self._channels.values()),
+            "broadcasts": self.broadcasts,
+        }
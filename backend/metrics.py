@@ -0,0 +1,216 @@
+"""Request and MongoDB instrumentation, exported in the Prometheus text format.
+
+MetricsMiddleware times every HTTP request per route template and records the
+request/response payload sizes. CommandListener is registered on the Mongo
+client and times every command; Motor runs commands on its executor with a
+copy of the caller's context, so each command is also attributed to the request
+that issued it, which gives the DB commands-per-request histogram and the
+optional slow-request log. Values owned elsewhere (cache counters) are pulled
+at scrape time through register_callback.
+"""
+import logging
+import threading
+import time
+from collections import Counter as _Tally
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+BYTES_BUCKETS = (128, 1024, 8192, 65536, 524288, 4194304)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name, self.help = name, help
+        self._values: Dict[Labels, float] = {}
+        # The command listener runs on Motor's executor threads.
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...]):
+        self.name, self.help, self.buckets = name, help, buckets
+        self._series: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            # Per-bucket (non-cumulative) counts, then +Inf, sum and count.
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 1) + [0, 0])
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            series = [(labels, list(values)) for labels, values in self._series.items()]
+        for labels, values in series:
+            cumulative = 0
+            for bound, count in zip([*self.buckets, "+Inf"], values):
+                cumulative += count
+                le = bound if bound == "+Inf" else _format_value(float(bound))
+                yield f"{self.name}_bucket{_format_labels(labels, ('le', le))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(values[-2])}"
+            yield f"{self.name}_count{_format_labels(labels)} {values[-1]}"
+
+
+class _Callback:
+    def __init__(self, name: str, kind: str, help: str, collect: Callable[[], List[Tuple[dict, float]]]):
+        self.name, self.kind, self.help, self.collect = name, kind, help, collect
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self.collect():
+            yield f"{self.name}{_format_labels(tuple(sorted(labels.items())))} {_format_value(value)}"
+
+
+_REGISTRY: list = []
+
+
+def _register(metric):
+    _REGISTRY.append(metric)
+    return metric
+
+
+def register_callback(name: str, kind: str, help: str, collect: Callable[[], List[Tuple[dict, float]]]):
+    """Export values owned by another component; collect returns (labels, value) pairs."""
+    _register(_Callback(name, kind, help, collect))
+
+
+def render() -> str:
+    lines = []
+    for metric in _REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+request_duration = _register(Histogram(
+    "http_request_duration_seconds", "Time spent serving HTTP requests.", LATENCY_BUCKETS))
+request_db_commands = _register(Histogram(
+    "http_request_db_commands", "MongoDB commands issued while serving a request.", COUNT_BUCKETS))
+request_db_seconds = _register(Histogram(
+    "http_request_db_seconds", "Time spent in MongoDB commands while serving a request.", LATENCY_BUCKETS))
+request_bytes = _register(Histogram(
+    "http_request_bytes", "Request body size.", BYTES_BUCKETS))
+response_bytes = _register(Histogram(
+    "http_response_bytes", "Response body size.", BYTES_BUCKETS))
+db_command_duration = _register(Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command round-trip time.", LATENCY_BUCKETS))
+db_command_failures = _register(Counter(
+    "mongodb_command_failures_total", "MongoDB commands that returned an error."))
+
+
+class _RequestRecord:
+    __slots__ = ("commands",)
+
+    def __init__(self):
+        self.commands: List[Tuple[str, float]] = []
+
+
+_current: ContextVar[Optional[_RequestRecord]] = ContextVar("metrics_request", default=None)
+
+
+class CommandListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event.command_name, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        db_command_failures.inc(command=event.command_name)
+        self._record(event.command_name, event.duration_micros / 1e6)
+
+    @staticmethod
+    def _record(command: str, seconds: float):
+        db_command_duration.observe(seconds, command=command)
+        record = _current.get()
+        if record is not None:
+            record.commands.append((command, seconds))
+
+
+class MetricsMiddleware:
+    def __init__(self, app, slow_request_seconds: float = 0.0):
+        self.app = app
+        self.slow_request_seconds = slow_request_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        record = _RequestRecord()
+        token = _current.set(record)
+        status, sent = 500, 0
+
+        async def send_wrapper(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current.reset(token)
+            # The router stores the matched route in the scope; label by its template
+            # so /characters/{character_id} is one series, not one per character.
+            route = getattr(scope.get("route"), "path", "unmatched")
+            labels = {"method": scope["method"], "route": route}
+            commands = list(record.commands)
+            db_seconds = sum(seconds for _, seconds in commands)
+            received = dict(scope.get("headers") or []).get(b"content-length", b"0")
+
+            request_duration.observe(elapsed, status=str(status), **labels)
+            request_db_commands.observe(len(commands), **labels)
+            request_db_seconds.observe(db_seconds, **labels)
+            request_bytes.observe(int(received) if received.isdigit() else 0, **labels)
+            response_bytes.observe(sent, **labels)
+
+            if self.slow_request_seconds and elapsed >= self.slow_request_seconds:
+                breakdown = ", ".join(f"{name} x{count}" for name, count in _Tally(n for n, _ in commands).items())
+                logger.warning(
+                    "slow request %s %s -> %s in %.1f ms: %d db commands in %.1f ms (%s), %d bytes out",
+                    scope["method"], route, status, elapsed * 1000, len(commands), db_seconds * 1000,
+                    breakdown or "none", sent,
+                )
@@ -0,0 +1,188 @@
+"""Stream the characters collection through a declared transformation.
+
+Each transformation (see TRANSFORMS) reads a projection of every character and
+returns, per document, the update that brings it in line with the current
+catalog and progression rules, or None. Documents are read in ``_id`` order
+from a batched cursor and written with unordered bulk writes, one chunk at a
+time; every update is conditional on the ``version`` it was computed from, so a
+character the live API changed in between is left alone (and counted as a
+conflict) rather than overwritten. ``--pause`` throttles between chunks.
+
+With ``--checkpoint`` the last written ``_id`` is saved after every chunk and an
+interrupted run picks up from there; the file is removed once the run completes.
+``--dry-run`` writes nothing and prints the changes instead.
+
+Run from the backend directory::
+
+    python migrate.py maxima [--batch-size 500] [--dry-run] [--checkpoint FILE] [--pause 0]
+"""
+import argparse
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Callable, List, NamedTuple, Optional
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+from catalog import CHARACTER_CLASSES
+import database
+import progression
+from storage import compact_item_storage
+
+load_dotenv(Path(__file__).parent / '.env')
+# Same environment and pool settings as the API; connected by main().
+mongo = database.Mongo.from_env()
+
+
+class Transform(NamedTuple):
+    description: str
+    fields: List[str]
+    apply: Callable[[List[dict]], List[Optional[dict]]]
+
+
+def _rederive_maxima(docs):
+    updates = [None] * len(docs)
+    rows = [i for i, doc in enumerate(docs) if doc.get("class_type") in CHARACTER_CLASSES and "stats" in doc]
+    if not rows:
+        return updates
+
+    maxima = progression.maxima_batch(
+        [docs[i]["class_type"] for i in rows],
+        [[docs[i]["stats"].get(stat, 0) for stat in progression.STATS] for i in rows],
+    )
+    for row, i in enumerate(rows):
+        doc, changes = docs[i], {}
+        for pool, maximum in progression.POOL_MAXIMA.items():
+            value = int(maxima[maximum][row])
+            if doc.get(maximum) != value:
+                changes[maximum] = value
+            if pool in doc and doc[pool] > value:
+                changes[pool] = value
+        if changes:
+            updates[i] = {"$set": changes}
+    return updates
+
+
+def _compact_items(docs):
+    updates = []
+    for doc in docs:
+        items, equipped = compact_item_storage(doc)
+        if "items" in doc and items == doc["items"]:
+            updates.append(None)
+            continue
+        updates.append({
+            "$set": {"items": items, "equipped": equipped},
+            "$unset": {"inventory": "", "equipment": ""},
+        })
+    return updates
+
+
+TRANSFORMS = {
+    "maxima": Transform(
+        "Re-derive max_health/max_mana/max_stamina from class base values and stats",
+        ["class_type", "stats", *progression.POOL_MAXIMA, *progression.MAXIMA],
+        _rederive_maxima,
+    ),
+    "item-refs": Transform(
+        "Rewrite embedded item copies as compact catalog references",
+        ["items", "equipped", "inventory", "equipment"],
+        _compact_items,
+    ),
+}
+
+
+def _diff(doc, update) -> str:
+    def short(value):
+        text = json.dumps(value, default=str)
+        return text if len(text) <= 60 else text[:57] + "..."
+
+    changes = [f"{field}: {short(doc.get(field))} -> {short(value)}" for field, value in update.get("$set", {}).items()]
+    changes += [f"{field}: removed" for field in update.get("$unset", {}) if field in doc]
+    return f"{doc['_id']}: " + ", ".join(changes)
+
+
+async def run(name: str, batch_size: int = 500, dry_run: bool = False, checkpoint: Optional[Path] = None,
+              pause: float = 0.0, show: int = 20, log=print):
+    transform = TRANSFORMS[name]
+    query = {}
+    if checkpoint and checkpoint.exists():
+        saved = json.loads(checkpoint.read_text())
+        if saved["transform"] != name:
+            raise SystemExit(f"{checkpoint} belongs to the {saved['transform']} transform")
+        query["_id"] = {"$gt": saved["last_id"]}
+        log(f"resuming after {saved['last_id']}")
+
+    totals = {"scanned": 0, "changed": 0, "written": 0, "conflicts": 0}
+    started = time.monotonic()
+
+    async def flush(docs):
+        ops = []
+        for doc, update in zip(docs, transform.apply(docs)):
+            if update is None:
+                continue
+            totals["changed"] += 1
+            if dry_run:
+                if totals["changed"] <= show:
+                    log(_diff(doc, update))
+                continue
+            # Documents written before versioning have no version field.
+            condition = {"_id": doc["_id"], "version": doc.get("version") or None}
+            ops.append(UpdateOne(condition, {**update, "$inc": {"version": 1}}))
+        if ops:
+            result = await mongo.db.characters.bulk_write(ops, ordered=False)
+            totals["written"] += result.modified_count
+            totals["conflicts"] += len(ops) - result.matched_count
+        if checkpoint and not dry_run:
+            checkpoint.write_text(json.dumps({"transform": name, "last_id": docs[-1]["_id"]}))
+
+        elapsed = time.monotonic() - started
+        log(f"scanned {totals['scanned']}, changed {totals['changed']}, conflicts {totals['conflicts']} "
+            f"({totals['scanned'] / elapsed if elapsed else 0:.0f} docs/s)")
+        if pause:
+            await asyncio.sleep(pause)
+
+    projection = {"_id": 1, "version": 1, **{field: 1 for field in transform.fields}}
+    cursor = mongo.db.characters.find(query, projection).sort("_id", 1).batch_size(batch_size)
+    docs = []
+    async for doc in cursor:
+        totals["scanned"] += 1
+        docs.append(doc)
+        if len(docs) >= batch_size:
+            await flush(docs)
+            docs = []
+    if docs:
+        await flush(docs)
+
+    if checkpoint and not dry_run and checkpoint.exists():
+        checkpoint.unlink()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        epilog="transforms:\n" + "\n".join(f"  {name}: {t.description}" for name, t in TRANSFORMS.items()),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("transform", choices=sorted(TRANSFORMS))
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--checkpoint", type=Path)
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to wait between chunks")
+    parser.add_argument("--show", type=int, default=20, help="changes printed in dry-run mode")
+    args = parser.parse_args()
+
+    async def migrate():
+        async with mongo.connected(warm_up=False):
+            return await run(args.transform, args.batch_size, args.dry_run, args.checkpoint, args.pause, args.show)
+
+    totals = asyncio.run(migrate())
+    verb = "would rewrite" if args.dry_run else "rewrote"
+    print(f"scanned {totals['scanned']} characters, {verb} {totals['changed'] if args.dry_run else totals['written']}"
+          + (f", {totals['conflicts']} changed concurrently and skipped" if totals["conflicts"] else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""Rewrite stored character items as compact catalog references.
+
+Replaces embedded SHOP_ITEMS copies (legacy ``inventory``/``equipment``
+documents as well as full dicts kept in ``items``) with ``{"item_id": ...}``
+entries. This is the ``item-refs`` transform of migrate.py, which also offers
+checkpoints and throttling; this entry point is kept for existing runbooks.
+
+Run from the backend directory::
+
+    python migrate_item_refs.py [--batch-size 500] [--dry-run]
+"""
+import argparse
+import asyncio
+
+from migrate import mongo, run
+
+
+async def migrate(batch_size: int = 500, dry_run: bool = False):
+    async with mongo.connected(warm_up=False):
+        totals = await run("item-refs", batch_size, dry_run, log=lambda line: None)
+    return totals["scanned"], totals["changed"] if dry_run else totals["written"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    scanned, changed = asyncio.run(migrate(args.batch_size, args.dry_run))
+    verb = "would rewrite" if args.dry_run else "rewrote"
+    print(f"scanned {scanned} characters, {verb} {changed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Character progression: the XP curve, level-ups and what a stat point buys.
+
+Going from level L to L + 1 costs ``xp_to_next(L)`` XP. The running total of
+that curve is precomputed as a table, so the level reached with any amount of
+XP is a bisect rather than one loop iteration per level. The ``*_batch``
+functions answer the same questions for whole arrays of characters with NumPy,
+e.g. to re-derive stored documents after the curve or STAT_EFFECTS were
+rebalanced.
+"""
+from bisect import bisect_right
+from math import isqrt
+from typing import Dict
+
+import numpy as np
+
+from catalog import CHARACTER_CLASSES
+
+XP_PER_LEVEL = 100
+STAT_POINTS_PER_LEVEL = 3
+STATS = ["str", "dex", "end", "int", "lck"]
+
+# What one point spent in a stat adds. Pools never go above their maximum.
+STAT_EFFECTS: Dict[str, Dict[str, int]] = {
+    "end": {"max_health": 5, "health": 5, "max_stamina": 3},
+    "int": {"max_mana": 5},
+}
+POOL_MAXIMA = {"health": "max_health", "mana": "max_mana", "stamina": "max_stamina"}
+MAXIMA = list(POOL_MAXIMA.values())
+
+
+def xp_to_next(level):
+    return level * XP_PER_LEVEL
+
+
+# _CUMULATIVE[level] is the XP it takes to get from level 1 to level; index 0 is
+# unused and kept at 0 so that levels can index the table directly. Past the table,
+# far beyond anything reachable in play, the curve continues with the closed form
+# of a linear xp_to_next (as server._xp_progress_expr assumes), which keeps even
+# absurd XP grants constant-time and memory-bounded.
+TABLE_LEVELS = 10_000
+_CUMULATIVE = [0, 0]
+for _level in range(1, TABLE_LEVELS):
+    _CUMULATIVE.append(_CUMULATIVE[-1] + xp_to_next(_level))
+_CUMULATIVE_ARRAY = np.asarray(_CUMULATIVE, dtype=np.int64)
+
+
+def _linear_cumulative(level):
+    return XP_PER_LEVEL * level * (level - 1) // 2
+
+
+_TAIL_OFFSET = _CUMULATIVE[TABLE_LEVELS] - _linear_cumulative(TABLE_LEVELS)
+
+
+def cumulative_xp(level: int) -> int:
+    if level <= TABLE_LEVELS:
+        return _CUMULATIVE[level]
+    return _linear_cumulative(level) + _TAIL_OFFSET
+
+
+def level_for_xp(total_xp: int) -> int:
+    if total_xp < _CUMULATIVE[TABLE_LEVELS]:
+        return bisect_right(_CUMULATIVE, total_xp) - 1
+    rest = total_xp - _TAIL_OFFSET
+    level = (1 + isqrt(1 + 8 * rest // XP_PER_LEVEL)) // 2
+    while _linear_cumulative(level + 1) <= rest:
+        level += 1
+    while _linear_cumulative(level) > rest:
+        level -= 1
+    return level
+
+
+def _cumulative_batch(level):
+    tail = level > TABLE_LEVELS
+    return np.where(tail, _linear_cumulative(level) + _TAIL_OFFSET, _CUMULATIVE_ARRAY[np.minimum(level, TABLE_LEVELS)])
+
+
+def _level_for_xp_batch(total_xp):
+    level = np.searchsorted(_CUMULATIVE_ARRAY, total_xp, side="right") - 1
+    tail = total_xp >= _CUMULATIVE[TABLE_LEVELS]
+    if tail.any():
+        rest = np.maximum(total_xp - _TAIL_OFFSET, 0)
+        estimate = ((1 + np.sqrt(1 + 8 * rest / XP_PER_LEVEL)) // 2).astype(np.int64)
+        estimate += _linear_cumulative(estimate + 1) <= rest
+        estimate -= _linear_cumulative(estimate) > rest
+        level = np.where(tail, estimate, level)
+    return level
+
+
+def gain_xp(char: dict, xp_gained: int) -> dict:
+    """New xp, xp_to_next, level and stat_points after gaining xp_gained.
+
+    The first level-up costs the stored xp_to_next, which is not necessarily on the
+    curve; every level after that is.
+    """
+    xp = char["xp"] + xp_gained
+    level, next_cost = char["level"], char["xp_to_next"]
+    stat_points = char.get("stat_points", 0)
+    if xp < next_cost:
+        return {"xp": xp, "xp_to_next": next_cost, "level": level, "stat_points": stat_points}
+
+    total = cumulative_xp(level + 1) + xp - next_cost
+    new_level = level_for_xp(total)
+    return {
+        "xp": total - cumulative_xp(new_level),
+        "xp_to_next": xp_to_next(new_level),
+        "level": new_level,
+        "stat_points": stat_points + STAT_POINTS_PER_LEVEL * (new_level - level),
+    }
+
+
+def spend_stat_point(char: dict, stat: str):
+    """Apply one stat point to char in place."""
+    char["stats"][stat] += 1
+    char["stat_points"] -= 1
+    effects = STAT_EFFECTS.get(stat, {})
+    for field, amount in effects.items():
+        char[field] += amount
+    for pool, maximum in POOL_MAXIMA.items():
+        if pool in effects:
+            char[pool] = min(char[pool], char[maximum])
+
+
+_CLASS_NAMES = list(CHARACTER_CLASSES)
+_CLASS_BASE_STATS = np.array([[cls[stat] for stat in STATS] for cls in CHARACTER_CLASSES.values()], dtype=np.int64)
+_CLASS_BASE_MAXIMA = np.array(
+    [[cls[pool] for pool in POOL_MAXIMA] for cls in CHARACTER_CLASSES.values()], dtype=np.int64
+)
+
+
+def gain_xp_batch(level, xp, xp_to_next_stored, stat_points, xp_gained) -> Dict[str, np.ndarray]:
+    """gain_xp over arrays, one element per character."""
+    level, xp, next_cost, stat_points, xp_gained = (
+        np.asarray(a, dtype=np.int64) for a in (level, xp, xp_to_next_stored, stat_points, xp_gained)
+    )
+    xp = xp + xp_gained
+    leveled = xp >= next_cost
+    if not leveled.any():
+        return {"xp": xp, "xp_to_next": next_cost, "level": level, "stat_points": stat_points}
+
+    total = np.where(leveled, _cumulative_batch(level + 1) + xp - next_cost, 0)
+    new_level = np.where(leveled, _level_for_xp_batch(total), level)
+    return {
+        "xp": np.where(leveled, total - _cumulative_batch(new_level), xp),
+        "xp_to_next": np.where(leveled, xp_to_next(new_level), next_cost),
+        "level": new_level,
+        "stat_points": stat_points + STAT_POINTS_PER_LEVEL * (new_level - level),
+    }
+
+
+def total_xp_batch(level, xp) -> np.ndarray:
+    """Lifetime XP of characters on the current curve, to carry over into a new one."""
+    return _cumulative_batch(np.asarray(level, dtype=np.int64)) + np.asarray(xp, dtype=np.int64)
+
+
+def recompute_batch(total_xp, class_types, stats) -> Dict[str, np.ndarray]:
+    """Level, xp, xp_to_next, unspent stat_points and maxima from lifetime XP and stats.
+
+    stats is an (n, len(STATS)) array in STATS order. Points spent beyond what the
+    level grants (e.g. set through PUT) leave stat_points at 0 rather than negative.
+    """
+    total_xp = np.asarray(total_xp, dtype=np.int64)
+    level = _level_for_xp_batch(total_xp)
+    spent = _spent_stats(class_types, stats)
+    return {
+        "level": level,
+        "xp": total_xp - _cumulative_batch(level),
+        "xp_to_next": xp_to_next(level),
+        "stat_points": np.maximum(0, STAT_POINTS_PER_LEVEL * (level - 1) - spent.sum(axis=1)),
+        **_maxima(class_types, spent),
+    }
+
+
+def maxima_batch(class_types, stats) -> Dict[str, np.ndarray]:
+    """max_health, max_mana and max_stamina from class base values and current stats."""
+    return _maxima(class_types, _spent_stats(class_types, stats))
+
+
+def _class_indexes(class_types):
+    names, inverse = np.unique(np.asarray(class_types), return_inverse=True)
+    return np.array([_CLASS_NAMES.index(name) for name in names], dtype=np.int64)[inverse.ravel()]
+
+
+def _spent_stats(class_types, stats):
+    stats = np.asarray(stats, dtype=np.int64).reshape(len(class_types), len(STATS))
+    return stats - _CLASS_BASE_STATS[_class_indexes(class_types)]
+
+
+def _maxima(class_types, spent):
+    effects = np.array(
+        [[STAT_EFFECTS.get(stat, {}).get(maximum, 0) for maximum in MAXIMA] for stat in STATS], dtype=np.int64
+    )
+    maxima = _CLASS_BASE_MAXIMA[_class_indexes(class_types)] + spent @ effects
+    return {maximum: maxima[:, index] for index, maximum in enumerate(MAXIMA)}
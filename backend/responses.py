@@ -0,0 +1,160 @@
+"""JSON encoding and negotiated compression for API responses.
+
+ORJSONResponse is the app's default response class, so whatever a handler
+returns is encoded by orjson. A plain dict still goes through FastAPI's
+jsonable_encoder first; the character and leaderboard handlers return
+``json_response(...)`` instead, which skips that pass (their payloads are JSON
+types already). Handlers that hold a body encoded ahead of time (the catalog)
+send the bytes with ``encoded_response``.
+
+CompressionMiddleware compresses bodies of at least COMPRESSION_MIN_SIZE bytes
+with brotli (when the module is installed) or gzip, whichever the client's
+Accept-Encoding prefers. Streaming bodies are compressed chunk by chunk and
+flushed per chunk, so NDJSON rows still arrive as they are produced. Responses
+with a strong ETag are compressed once per encoding and reused afterwards.
+"""
+import zlib
+from typing import Optional
+
+import orjson
+from fastapi.responses import Response
+
+from cache import TTLCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+# Media types worth compressing; everything else passes through untouched.
+COMPRESSIBLE = (b"application/json", b"application/x-ndjson", b"text/")
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, option=JSON_OPTIONS)
+
+
+def json_response(content, status_code: int = 200, headers: Optional[dict] = None) -> Response:
+    """Encode content with orjson directly, without the jsonable_encoder pass."""
+    return Response(dumps(content), status_code=status_code, headers=headers, media_type="application/json")
+
+
+def encoded_response(body: bytes, status_code: int = 200, headers: Optional[dict] = None) -> Response:
+    """Send a JSON body that was encoded ahead of time."""
+    return Response(body, status_code=status_code, headers=headers, media_type="application/json")
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """The supported coding the client ranks highest; brotli wins ties."""
+    supported = ("br", "gzip") if brotli is not None else ("gzip",)
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding, quality = coding.strip().lower(), 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                continue
+        if coding == "*":
+            for name in supported:
+                weights.setdefault(name, quality)
+        elif coding in supported:
+            weights[coding] = quality
+    ranked = [name for name in supported if weights.get(name, 0) > 0]
+    return max(ranked, key=lambda name: weights[name]) if ranked else None
+
+
+class _Compressor:
+    def __init__(self, coding: str, gzip_level: int, brotli_quality: int):
+        if coding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._brotli = None
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)  # wbits 31: gzip container
+
+    def chunk(self, data: bytes) -> bytes:
+        if self._brotli is not None:
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self._brotli is not None:
+            return self._brotli.process(data) + self._brotli.finish()
+        return self._zlib.compress(data) + self._zlib.flush()
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        # Low brotli qualities compress about as well as gzip -6 at a fraction of the CPU.
+        self.brotli_quality = brotli_quality
+        self.encoded = TTLCache(maxsize=64)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept_encoding = dict(scope.get("headers") or []).get(b"accept-encoding", b"").decode("latin-1")
+        coding = negotiate(accept_encoding) if accept_encoding else None
+        if coding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                return await send(message)
+
+            body, more_body = message.get("body", b""), message.get("more_body", False)
+            if compressor is not None:
+                data = compressor.chunk(body) if more_body else compressor.finish(body)
+                return await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+            headers = {name.lower(): value for name, value in start["headers"]}
+            content_type = headers.get(b"content-type", b"")
+            if (b"content-encoding" in headers or not content_type.startswith(COMPRESSIBLE)
+                    or (not more_body and len(body) < self.minimum_size)):
+                passthrough = True
+                await send(start)
+                return await send(message)
+
+            etag = headers.get(b"etag", b"")
+            vary = headers.get(b"vary")
+            response_headers = [
+                (name, value) for name, value in start["headers"]
+                if name.lower() not in (b"content-length", b"etag", b"vary")
+            ]
+            response_headers += [
+                (b"content-encoding", coding.encode()),
+                (b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"),
+            ]
+            if etag:
+                # The compressed bytes are a different representation; a weak tag still
+                # validates If-None-Match (weak comparison) but not range requests.
+                response_headers.append((b"etag", etag if etag.startswith(b"W/") else b"W/" + etag))
+
+            if more_body:
+                compressor = _Compressor(coding, self.gzip_level, self.brotli_quality)
+                await send({**start, "headers": response_headers})
+                return await send({"type": "http.response.body", "body": compressor.chunk(body), "more_body": True})
+
+            key = (etag, coding) if etag and not etag.startswith(b"W/") else None
+            data = self.encoded.get(key) if key else None
+            if data is None:
+                data = _Compressor(coding, self.gzip_level, self.brotli_quality).finish(body)
+                if key:
+                    self.encoded.put(key, data)
+            response_headers.append((b"content-length", str(len(data)).encode()))
+            await send({**start, "headers": response_headers})
+            await send({"type": "http.response.body", "body": data})
+
+        await self.app(scope, receive, send_wrapper)
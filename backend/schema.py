@@ -0,0 +1,66 @@
+"""Index bootstrap for the collections the API queries.
+
+Runs once at startup: creates any declared index that is missing, then
+logs indexes that exist but are not declared here, and declared ones
+that MongoDB reports as never used since it last restarted.
+"""
+import logging
+
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+
+import leaderboard
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+# Collection name -> the index key lists its queries rely on. Single-character
+# lookups go through the built-in _id index and need nothing here.
+REQUIRED_INDEXES = {
+    "characters": leaderboard.INDEXES + [
+        [("created_at", ASCENDING), ("_id", ASCENDING)],
+    ],
+    "run_stats": telemetry.INDEXES,
+}
+
+
+def index_name(keys) -> str:
+    # Same naming scheme MongoDB uses for unnamed indexes.
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+
+async def ensure_indexes(db) -> dict:
+    report = {"created": [], "missing": [], "undeclared": [], "unused": []}
+    for collection_name, indexes in REQUIRED_INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        declared = {index_name(keys) for keys in indexes} | {"_id_"}
+
+        for keys in indexes:
+            name = index_name(keys)
+            if name in existing:
+                continue
+            try:
+                await collection.create_index(keys, name=name)
+                report["created"].append(f"{collection_name}.{name}")
+            except OperationFailure as exc:
+                report["missing"].append(f"{collection_name}.{name}")
+                logger.error("Could not create index %s.%s: %s", collection_name, name, exc)
+
+        report["undeclared"] += [f"{collection_name}.{name}" for name in existing if name not in declared]
+
+        try:
+            stats = await collection.aggregate([{"$indexStats": {}}]).to_list(None)
+        except OperationFailure as exc:
+            logger.info("Index usage stats unavailable for %s: %s", collection_name, exc)
+            continue
+        report["unused"] += [
+            f"{collection_name}.{stat['name']}" for stat in stats
+            if stat["name"] in existing and stat["name"] != "_id_" and not stat["accesses"]["ops"]
+        ]
+
+    for kind in ("created", "missing", "undeclared", "unused"):
+        if report[kind]:
+            log = logger.warning if kind in ("missing", "undeclared") else logger.info
+            log("Indexes %s: %s", kind, ", ".join(report[kind]))
+    return report
@@ -1,92 +1,116 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, ValidationError, field_validator
+from pydantic_core import PydanticCustomError
 from typing import List, Optional, Dict, Any
+import asyncio
+import base64
+import contextlib
+import copy
+import functools
+import hmac
+import json
 import uuid
 from datetime import datetime, timezone
 
+from actors import WriteActors
+import balance
+import catalog
+from cache import CharacterCache
+from coalesce import SingleFlight
+import database
+import effective_stats
+import idempotency
+from catalog import CHARACTER_CLASSES, ITEMS_BY_ID, ITEM_IDS, ITEM_PRICES
+from invalidation import CacheWatcher
+from leaderboard import Leaderboard, LeaderboardFeed
+import metrics
+import progression
+from progression import STATS
+import responses
+import schema
+from storage import (
+    EQUIPMENT_SLOTS, INSTANCE_ID_RE, compact_item_storage, hydrate_item, items_from_presented, new_instance_id,
+)
+from telemetry import RunLog
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Connected by the app lifespan; see database.py for the pool settings.
+mongo = database.Mongo.from_env()
+
 
-app = FastAPI()
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with mongo.connected() as db:
+        leaderboard.collection = db.characters
+        await schema.ensure_indexes(db)
+        if os.environ.get('IDEMPOTENCY_MIRROR', '').lower() in ('1', 'true', 'yes'):
+            await idempotent.bind(db)
+        async with cache_watcher.running(db.characters), run_log.running(db):
+            yield
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 api_router = APIRouter(prefix="/api")
 
-# Character class definitions
-CHARACTER_CLASSES = {
-    "knight": {
-        "name": "Rycerz", "str": 12, "dex": 8, "end": 14, "int": 4, "lck": 7,
-        "health": 120, "mana": 30, "stamina": 100, "weapon_type": "sword",
-        "description": "Wytrzymaly wojownik z mieczem i tarcza"
-    },
-    "mage": {
-        "name": "Mag", "str": 4, "dex": 6, "end": 6, "int": 16, "lck": 8,
-        "health": 70, "mana": 120, "stamina": 60, "weapon_type": "staff",
-        "description": "Potezny czarodziej wladajacy zywiolami"
-    },
-    "assassin": {
-        "name": "Zabojca", "str": 8, "dex": 16, "end": 6, "int": 6, "lck": 10,
-        "health": 80, "mana": 50, "stamina": 120, "weapon_type": "dagger",
-        "description": "Szybki i smiertelny cien nocy"
-    },
-    "dark_mage": {
-        "name": "Czarny Mag", "str": 3, "dex": 5, "end": 5, "int": 18, "lck": 9,
-        "health": 60, "mana": 140, "stamina": 50, "weapon_type": "wand",
-        "description": "Mistrz mrocznych sztuk i zakazanej magii"
-    },
-    "soldier": {
-        "name": "Zolnierz", "str": 14, "dex": 7, "end": 12, "int": 3, "lck": 6,
-        "health": 130, "mana": 20, "stamina": 110, "weapon_type": "spear",
-        "description": "Doswiadczony weteran wielu bitew"
-    },
-    "elite_soldier": {
-        "name": "Elitarny Zolnierz", "str": 13, "dex": 10, "end": 11, "int": 5, "lck": 8,
-        "health": 110, "mana": 40, "stamina": 100, "weapon_type": "crossbow",
-        "description": "Najlepszy z najlepszych, mistrz taktyki"
-    },
-    "dark_knight": {
-        "name": "Ciemny Rycerz", "str": 15, "dex": 6, "end": 13, "int": 8, "lck": 5,
-        "health": 140, "mana": 60, "stamina": 90, "weapon_type": "greatsword",
-        "description": "Rycerz pochloniety przez mrok"
-    }
-}
 
-SHOP_ITEMS = [
-    {"id": "w1", "name": "Zelazny Miecz", "type": "weapon", "weapon_type": "sword", "rarity": "common", "stats": {"attack": 8, "defense": 0, "magic": 0, "speed": 0}, "level_req": 1, "price": 100, "description": "Prosty, ale solidny miecz"},
-    {"id": "w2", "name": "Stalowy Topor", "type": "weapon", "weapon_type": "axe", "rarity": "common", "stats": {"attack": 10, "defense": 0, "magic": 0, "speed": -1}, "level_req": 1, "price": 120, "description": "Ciezki topor zadajacy potezne ciosy"},
-    {"id": "w3", "name": "Debowy Kostur", "type": "weapon", "weapon_type": "staff", "rarity": "common", "stats": {"attack": 4, "defense": 0, "magic": 8, "speed": 0}, "level_req": 1, "price": 80, "description": "Kostur wzmacniajacy magie"},
-    {"id": "w4", "name": "Luk Lowcy", "type": "weapon", "weapon_type": "bow", "rarity": "common", "stats": {"attack": 7, "defense": 0, "magic": 0, "speed": 2}, "level_req": 1, "price": 90, "description": "Szybki i celny luk"},
-    {"id": "w5", "name": "Sztylet Cienia", "type": "weapon", "weapon_type": "dagger", "rarity": "rare", "stats": {"attack": 12, "defense": 0, "magic": 0, "speed": 4}, "level_req": 3, "price": 300, "description": "Sztylet przesiakni?ty ciemnoscia"},
-    {"id": "w6", "name": "Ognisty Miecz", "type": "weapon", "weapon_type": "sword", "rarity": "rare", "stats": {"attack": 16, "defense": 2, "magic": 4, "speed": 0}, "level_req": 3, "price": 350, "description": "Miecz plonacy wiecznym ogniem"},
-    {"id": "w7", "name": "Mlot Gromu", "type": "weapon", "weapon_type": "hammer", "rarity": "epic", "stats": {"attack": 24, "defense": 4, "magic": 6, "speed": -2}, "level_req": 5, "price": 800, "description": "Mlot przyzywajacy blyskawice"},
-    {"id": "w8", "name": "Rozdzka Mrozu", "type": "weapon", "weapon_type": "wand", "rarity": "epic", "stats": {"attack": 8, "defense": 0, "magic": 22, "speed": 2}, "level_req": 5, "price": 750, "description": "Rozdzka zamrazajaca wrogow"},
-    {"id": "w9", "name": "Wlocznia Pustki", "type": "weapon", "weapon_type": "spear", "rarity": "mythic", "stats": {"attack": 30, "defense": 6, "magic": 10, "speed": 0}, "level_req": 7, "price": 1500, "description": "Wlocznia wykuta w otchlani"},
-    {"id": "w11", "name": "All Seeing Sword", "type": "weapon", "weapon_type": "sword", "rarity": "mythic", "stats": {"attack": 50, "defense": 15, "magic": 0, "speed": 2, "health_bonus": 10}, "level_req": 7, "price": 1800, "description": "Miecz ktory widzi wszystko"},
-    {"id": "a7", "name": "Warden of Demons Armour", "type": "armor", "rarity": "mythic", "stats": {"attack": 15, "defense": 0, "magic": 0, "speed": 5}, "level_req": 7, "price": 2000, "description": "Zbroja straznika demonow"},
-    {"id": "w10", "name": "Smoczobjca", "type": "weapon", "weapon_type": "sword", "rarity": "legendary", "stats": {"attack": 40, "defense": 8, "magic": 12, "speed": 3}, "level_req": 10, "price": 3000, "description": "Legendarny miecz zabojcow smokow"},
-    {"id": "a1", "name": "Skorzana Zbroja", "type": "armor", "rarity": "common", "stats": {"attack": 0, "defense": 6, "magic": 0, "speed": 0}, "level_req": 1, "price": 80, "description": "Lekka zbroja ze skorki"},
-    {"id": "a2", "name": "Kolczuga", "type": "armor", "rarity": "common", "stats": {"attack": 0, "defense": 10, "magic": 0, "speed": -1}, "level_req": 1, "price": 150, "description": "Solidna kolczuga stalowa"},
-    {"id": "a3", "name": "Plyta Stalowa", "type": "armor", "rarity": "rare", "stats": {"attack": 0, "defense": 18, "magic": 0, "speed": -2}, "level_req": 3, "price": 400, "description": "Ciezka zbroja platowa"},
-    {"id": "a4", "name": "Plaszcz Cienia", "type": "armor", "rarity": "rare", "stats": {"attack": 0, "defense": 10, "magic": 6, "speed": 3}, "level_req": 3, "price": 350, "description": "Plaszcz ukrywajacy wlasciciela"},
-    {"id": "a5", "name": "Skora Demona", "type": "armor", "rarity": "epic", "stats": {"attack": 4, "defense": 22, "magic": 8, "speed": 0}, "level_req": 5, "price": 900, "description": "Zbroja z demonskiej skory"},
-    {"id": "a6", "name": "Luska Smoka", "type": "armor", "rarity": "legendary", "stats": {"attack": 6, "defense": 35, "magic": 10, "speed": -1}, "level_req": 10, "price": 2500, "description": "Zbroja ze smoczych lusek"},
-    {"id": "r1", "name": "Amulet Zdrowia", "type": "relic", "rarity": "common", "stats": {"attack": 0, "defense": 2, "magic": 0, "speed": 0, "health_bonus": 20}, "level_req": 1, "price": 100, "description": "Zwieksza maksymalne zdrowie"},
-    {"id": "r2", "name": "Pierscień Many", "type": "relic", "rarity": "common", "stats": {"attack": 0, "defense": 0, "magic": 4, "speed": 0, "mana_bonus": 20}, "level_req": 1, "price": 100, "description": "Zwieksza maksymalna mane"},
-    {"id": "r3", "name": "Pas Wytrzymalosci", "type": "relic", "rarity": "rare", "stats": {"attack": 0, "defense": 4, "magic": 0, "speed": 1, "stamina_bonus": 30}, "level_req": 3, "price": 300, "description": "Zwieksza wytrzymalosc"},
-    {"id": "r4", "name": "Relikwia Mocy", "type": "relic", "rarity": "legendary", "stats": {"attack": 10, "defense": 8, "magic": 10, "speed": 2}, "level_req": 8, "price": 2000, "description": "Pradawna relikwia nieskonczonej mocy"},
-    {"id": "s1", "name": "Zwoj Leczenia", "type": "scroll", "rarity": "common", "stats": {"heal": 30}, "level_req": 1, "price": 50, "description": "Przywraca 30 punktow zdrowia", "consumable": True},
-    {"id": "s2", "name": "Zwoj Kuli Ognia", "type": "scroll", "rarity": "rare", "stats": {"damage": 40}, "level_req": 3, "price": 200, "description": "Zadaje 40 obrazen ognia", "consumable": True},
-    {"id": "s3", "name": "Zwoj Blyskawicy", "type": "scroll", "rarity": "epic", "stats": {"damage": 80}, "level_req": 5, "price": 500, "description": "Potezna blyskawica raz?ca wrogow", "consumable": True},
-    {"id": "w12", "name": "Broń Franka", "type": "weapon", "weapon_type": "sword", "rarity": "legendary", "stats": {"attack": 20, "defense": 5, "magic": 1, "speed": 3, "health_bonus": 20}, "level_req": 1, "price": 1, "description": "Tani miecz Michała"},
-]
+def _require_ops_token(request: Request):
+    # Without OPS_TOKEN configured the operational endpoints don't exist.
+    token = os.environ.get('OPS_TOKEN')
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, credentials = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(credentials.encode(), token.encode()):
+        raise HTTPException(status_code=401, detail="Invalid ops token", headers={"WWW-Authenticate": "Bearer"})
+
+
+# Metrics, cache internals and admin tools; callers send Authorization: Bearer $OPS_TOKEN.
+ops_router = APIRouter(prefix="/api", dependencies=[Depends(_require_ops_token)])
+
+leaderboard = Leaderboard(
+    None,
+    size=int(os.environ.get('LEADERBOARD_SIZE', 20)),
+    ttl=float(os.environ.get('LEADERBOARD_TTL', 60)),
+)
+leaderboard_feed = LeaderboardFeed(leaderboard, debounce=float(os.environ.get('LEADERBOARD_STREAM_DEBOUNCE', 0.25)))
+# Stored character documents, newest version wins. Without a change stream (see
+# cache_watcher) the TTL bounds how long a write made by another worker can go unseen here.
+character_cache = CharacterCache(
+    maxsize=int(os.environ.get('CHARACTER_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('CHARACTER_CACHE_TTL', 5)),
+)
+# Identical reads that arrive together share one query; see coalesce.py.
+reads = SingleFlight(linger=float(os.environ.get('READ_COALESCE_LINGER', 0.05)))
+# Follows other workers' writes through a change stream, which allows the longer TTLs.
+cache_watcher = CacheWatcher(
+    character_cache,
+    leaderboard,
+    reads,
+    watched_ttl=float(os.environ.get('CHARACTER_CACHE_TTL_WATCHED', 300)),
+    leaderboard_watched_ttl=float(os.environ.get('LEADERBOARD_TTL_WATCHED', 600)),
+)
+# Responses to retried mutations that carry an Idempotency-Key; see idempotency.py.
+idempotent = idempotency.IdempotencyStore(
+    maxsize=int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('IDEMPOTENCY_TTL', 86400)),
+)
+# Mutations of one character run one at a time in this worker; see actors.py.
+writes = WriteActors(idle_timeout=float(os.environ.get('WRITE_ACTOR_IDLE_TIMEOUT', 30)))
+# Run outcomes for the analytics endpoints, written in batches off the request path.
+run_log = RunLog(
+    batch_size=int(os.environ.get('TELEMETRY_BATCH_SIZE', 500)),
+    interval=float(os.environ.get('TELEMETRY_FLUSH_INTERVAL', 1)),
+)
 
 
 class CharacterCreate(BaseModel):
@@ -113,6 +137,8 @@ class CharacterUpdate(BaseModel):
     completed_levels: Optional[List[int]] = None
     kills: Optional[int] = None
     deaths: Optional[int] = None
+    # When sent, the update only applies if the stored character still has this version.
+    version: Optional[int] = None
 
 
 class ShopBuy(BaseModel):
@@ -121,22 +147,272 @@ class ShopBuy(BaseModel):
 
 
 class EquipItem(BaseModel):
-    inventory_index: int
     slot: str
+    instance_id: Optional[str] = None
+    inventory_index: Optional[int] = None
 
 
 class LevelUpRequest(BaseModel):
     stat: str
 
 
+class BatchOperation(BaseModel):
+    op: str
+    item_id: Optional[str] = None  # buy
+    instance_id: Optional[str] = None  # sell / equip, or inventory_index
+    inventory_index: Optional[int] = None
+    slot: Optional[str] = None  # equip / unequip
+    stat: Optional[str] = None  # levelup
+
+
+class CharacterBatch(BaseModel):
+    operations: List[BatchOperation]
+
+
+class GameEvent(BaseModel):
+    type: str
+    count: int = 1  # kill
+    amount: int = 0  # gold
+    level_id: Optional[int] = None  # complete_level, with xp_gained/gold_gained/kills; death
+    xp_gained: int = 0
+    gold_gained: int = 0
+    kills: int = 0
+
+    @field_validator("level_id")
+    @classmethod
+    def _known_level(cls, level_id):
+        # Stored in completed_levels and used as a run_stats key, so only catalog levels.
+        if level_id is not None and level_id not in catalog.LEVEL_IDS:
+            raise PydanticCustomError("unknown_level", "Unknown level_id {level_id}", {"level_id": level_id})
+        return level_id
+
+
+class GameEventBatch(BaseModel):
+    character_id: str
+    events: List[GameEvent]
+
+
+def _present_character(char):
+    if char is None or "items" not in char:
+        return char
+    # Builds a new dict: the stored document may be the one held by character_cache.
+    items = char["items"]
+    equipped = char.get("equipped") or {}
+    equipped_ids = {instance_id for instance_id in equipped.values() if instance_id}
+    presented = {k: v for k, v in char.items() if k not in ("items", "equipped")}
+    presented["inventory"] = [
+        hydrate_item(entry, instance_id)
+        for instance_id, entry in items.items() if instance_id not in equipped_ids
+    ]
+    presented["equipment"] = {
+        slot: hydrate_item(items[equipped[slot]], equipped[slot]) if equipped.get(slot) in items else None
+        for slot in EQUIPMENT_SLOTS
+    }
+    presented["effective_stats"] = effective_stats.compute(presented)
+    return presented
+
+
+async def _upgrade_item_storage(char):
+    items, equipped = compact_item_storage(char)
+    await mongo.db.characters.update_one(
+        {"_id": char["id"], "items": {"$exists": False}},
+        {
+            "$set": {"items": items, "equipped": equipped},
+            "$unset": {"inventory": "", "equipment": ""},
+            "$inc": {"version": 1},
+        },
+    )
+
+
+# Every write bumps "version" by one. It orders the copies held by character_cache
+# and lets a writer that read an older copy make its update conditional on it.
+def _bump_version(update):
+    if isinstance(update, list):
+        return update + [{"$set": {"version": {"$add": [{"$ifNull": ["$version", 0]}, 1]}}}]
+    return {**update, "$inc": {**update.get("$inc", {}), "version": 1}}
+
+
+def _version_condition(version):
+    # Documents written before versioning have no field and count as version 0.
+    return {"version": version or None}
+
+
+async def _fetch_character(character_id: str):
+    char = await mongo.db.characters.find_one({"_id": character_id}, {"_id": 0})
+    if not char:
+        raise HTTPException(status_code=404, detail="Character not found")
+    character_cache.store(char)
+    return char
+
+
+async def _load_character(character_id: str):
+    char = character_cache.get(character_id)
+    if char is None:
+        char = await reads.do(("character", character_id), lambda: _fetch_character(character_id))
+    return char
+
+
+async def _update_character(character_id: str, update, conditions=None, guards=(),
+                            return_document=ReturnDocument.AFTER):
+    # With ReturnDocument.BEFORE the caller derives the new document and caches it.
+    for _ in range(2):
+        char = await mongo.db.characters.find_one_and_update(
+            {"_id": character_id, **(conditions or {})},
+            _bump_version(update),
+            projection={"_id": 0},
+            return_document=return_document,
+        )
+        if char:
+            if return_document == ReturnDocument.AFTER:
+                character_cache.store(char)
+            return char
+
+        # A conditional update that matched nothing doesn't say why; re-read once,
+        # on the failure path only, to tell a missing character from a failed guard.
+        current = await mongo.db.characters.find_one({"_id": character_id}, {"_id": 0})
+        if not current:
+            character_cache.invalidate(character_id)
+            raise HTTPException(status_code=404, detail="Character not found")
+        if "items" in current:
+            # A cached copy that led to this conflict is replaced by the fresh one.
+            character_cache.store(current)
+            break
+        # Documents written before the keyed item storage are converted on first touch.
+        await _upgrade_item_storage(current)
+
+    for passed, detail in guards:
+        if not passed(current):
+            raise HTTPException(status_code=400, detail=detail)
+    raise HTTPException(status_code=409, detail="Character was modified concurrently, please retry")
+
+
+def _serialized(character_id_of):
+    """Run the decorated handler in the write actor of the character it changes."""
+    def decorate(handler):
+        @functools.wraps(handler)
+        async def serialized(**kwargs):
+            return await writes.call(character_id_of(kwargs), lambda: handler(**kwargs))
+        return serialized
+    return decorate
+
+
+async def _resolve_instance_id(character_id: str, instance_id, inventory_index):
+    if instance_id is not None:
+        if not isinstance(instance_id, str) or not INSTANCE_ID_RE.match(instance_id):
+            raise HTTPException(status_code=400, detail="Invalid instance id")
+        return instance_id
+
+    # Index-based requests from older clients need the current bag order first.
+    char = await _load_character(character_id)
+    if "items" not in char:
+        await _upgrade_item_storage(char)
+        char = await mongo.db.characters.find_one({"_id": character_id}, {"_id": 0})
+    inventory = _present_character(char)["inventory"]
+    if not isinstance(inventory_index, int) or inventory_index < 0 or inventory_index >= len(inventory):
+        raise HTTPException(status_code=400, detail="Invalid inventory index")
+    return inventory[inventory_index]["instance_id"]
+
+
+def _append_unique_expr(array_path: str, values):
+    # values must not repeat themselves; only the ones not stored yet are appended.
+    array = {"$ifNull": [array_path, []]}
+    return {"$concatArrays": [array, {"$filter": {
+        "input": {"$literal": values},
+        "as": "value",
+        "cond": {"$not": [{"$in": ["$$value", array]}]},
+    }}]}
+
+
+def _death_penalty(gold):
+    return max(0, int(gold * 0.1))
+
+
+def _death_penalty_expr(gold):
+    return {"$max": [0, {"$toInt": {"$multiply": [gold, 0.1]}}]}
+
+
+_PROGRESS_STAGES = [
+    {"$set": {
+        "xp": "$_progress.xp",
+        "xp_to_next": "$_progress.xp_to_next",
+        "level": "$_progress.level",
+        "stat_points": "$_progress.stat_points",
+    }},
+    {"$unset": "_progress"},
+]
+
+
+def _xp_progress_expr(xp_gained):
+    # Closed form of progression.gain_xp for its arithmetic curve: the first level-up
+    # costs the stored xp_to_next, every later one costs new_level * p (p being
+    # XP_PER_LEVEL), so after the first one the number of extra level-ups n is the
+    # largest n with p / 2 * n * (2a + n - 1) <= rest, a being the level reached by
+    # the first level-up. The sqrt estimate is nudged by one step either way to
+    # absorb floating point error.
+    per_level = progression.XP_PER_LEVEL
+
+    def cost(n):
+        # n * (2a + n - 1) is always even, so the division is exact.
+        return {"$toLong": {"$divide": [
+            {"$multiply": [per_level, n, {"$add": [{"$multiply": [2, "$$a"]}, n, -1]}]}, 2
+        ]}}
+
+    estimate = {"$toInt": {"$floor": {"$divide": [
+        {"$subtract": [
+            {"$sqrt": {"$add": [
+                {"$pow": [{"$subtract": [{"$multiply": [2, "$$a"]}, 1]}, 2]},
+                {"$multiply": [8 / per_level, "$$rest"]},
+            ]}},
+            {"$subtract": [{"$multiply": [2, "$$a"]}, 1]},
+        ]},
+        2,
+    ]}}}
+
+    leveled = {"$let": {
+        "vars": {"rest": {"$subtract": ["$$xp", "$xp_to_next"]}, "a": {"$add": ["$level", 1]}},
+        "in": {"$let": {
+            "vars": {"n0": estimate},
+            "in": {"$let": {
+                "vars": {"n": {"$switch": {"branches": [
+                    {"case": {"$gt": [cost("$$n0"), "$$rest"]}, "then": {"$subtract": ["$$n0", 1]}},
+                    {"case": {"$lte": [cost({"$add": ["$$n0", 1]}), "$$rest"]}, "then": {"$add": ["$$n0", 1]}},
+                ], "default": "$$n0"}}},
+                "in": {
+                    "xp": {"$subtract": ["$$rest", cost("$$n")]},
+                    "level": {"$add": ["$$a", "$$n"]},
+                    "xp_to_next": {"$multiply": [{"$add": ["$$a", "$$n"]}, per_level]},
+                    "stat_points": {"$add": [
+                        {"$ifNull": ["$stat_points", 0]},
+                        {"$multiply": [progression.STAT_POINTS_PER_LEVEL, {"$add": ["$$n", 1]}]},
+                    ]},
+                },
+            }},
+        }},
+    }}
+
+    return {"$let": {
+        "vars": {"xp": {"$add": ["$xp", {"$literal": xp_gained}]}},
+        "in": {"$cond": [
+            {"$gte": ["$$xp", "$xp_to_next"]},
+            leveled,
+            {
+                "xp": "$$xp",
+                "level": "$level",
+                "xp_to_next": "$xp_to_next",
+                "stat_points": {"$ifNull": ["$stat_points", 0]},
+            },
+        ]},
+    }}
+
+
 @api_router.get("/")
 async def root():
     return {"message": "Dark Realms API"}
 
 
 @api_router.get("/classes")
-async def get_classes():
-    return CHARACTER_CLASSES
+async def get_classes(request: Request):
+    return catalog.respond(request, catalog.CLASSES_BODY)
 
 
 @api_router.post("/characters")
@@ -151,7 +427,7 @@ async def create_character(data: CharacterCreate):
         "class_type": data.class_type,
         "level": 1,
         "xp": 0,
-        "xp_to_next": 100,
+        "xp_to_next": progression.xp_to_next(1),
         "stats": {
             "str": cls["str"], "dex": cls["dex"], "end": cls["end"],
             "int": cls["int"], "lck": cls["lck"]
@@ -164,301 +440,749 @@ async def create_character(data: CharacterCreate):
         "stamina": cls["stamina"],
         "max_stamina": cls["stamina"],
         "gold": 200,
-        "equipment": {"weapon": None, "armor": None, "relic": None, "scroll": None},
-        "inventory": [],
+        "items": {},
+        "equipped": {slot: None for slot in EQUIPMENT_SLOTS},
         "skills": [],
         "completed_levels": [],
         "kills": 0,
         "deaths": 0,
+        "version": 1,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
 
-    await db.characters.insert_one({**character, "_id": character["id"]})
-    return character
+    await mongo.db.characters.insert_one({**character, "_id": character["id"]})
+    character_cache.store(character)
+    leaderboard.record(character)
+    return _present_character(character)
+
+
+SUMMARY_FIELDS = ["id", "name", "class_type", "level", "kills", "gold", "created_at"]
+LIST_SORT = [("created_at", 1), ("_id", 1)]
+MAX_PAGE_SIZE = 500
+
+
+def _encode_cursor(char) -> str:
+    raw = json.dumps([char.get("created_at"), char["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at, last_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Keyset continuation: everything strictly after the last row of the previous page.
+    # Documents without created_at sort first, and $gt never matches across types.
+    after = {"$gt": created_at} if created_at is not None else {"$ne": None}
+    return {"$or": [
+        {"created_at": after},
+        {"created_at": created_at, "_id": {"$gt": last_id}},
+    ]}
 
 
 @api_router.get("/characters")
-async def list_characters():
-    chars = await db.characters.find({}, {"_id": 0}).to_list(100)
-    return chars
+async def list_characters(
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    view: str = Query("full", pattern="^(full|summary)$"),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+):
+    query = _decode_cursor(cursor) if cursor else {}
+    projection = {"_id": 0, **{field: 1 for field in SUMMARY_FIELDS}} if view == "summary" else {"_id": 0}
+
+    if format == "ndjson":
+        # Export mode: rows go out as the driver yields them, never held as a list.
+        chars = mongo.db.characters.find(query, projection).sort(LIST_SORT)
+        if limit:
+            chars = chars.limit(limit)
+
+        async def rows():
+            async for char in chars:
+                yield responses.dumps(_present_character(char)) + b"\n"
+
+        return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+    limit = min(limit or 100, MAX_PAGE_SIZE)
+    chars = await mongo.db.characters.find(query, projection).sort(LIST_SORT).limit(limit + 1).to_list(limit + 1)
+    headers = {}
+    if len(chars) > limit:
+        chars = chars[:limit]
+        headers["X-Next-Cursor"] = _encode_cursor(chars[-1])
+    return responses.json_response([_present_character(char) for char in chars], headers=headers)
 
 
 @api_router.get("/characters/{character_id}")
 async def get_character(character_id: str):
-    char = await db.characters.find_one({"id": character_id}, {"_id": 0})
-    if not char:
-        raise HTTPException(status_code=404, detail="Character not found")
-    return char
+    return responses.json_response(_present_character(await _load_character(character_id)))
+
+
+@api_router.get("/characters/{character_id}/stats")
+async def get_character_stats(character_id: str):
+    char = await _load_character(character_id)
+    if "items" not in char:
+        return effective_stats.compute(char)
+    return _present_character(char)["effective_stats"]
+
+
+def _level_progress(char) -> list:
+    completed = set(char.get("completed_levels") or [])
+    return [
+        {"id": level_id, "unlocked": index == 0 or catalog.LEVEL_IDS[index - 1] in completed,
+         "completed": level_id in completed}
+        for index, level_id in enumerate(catalog.LEVEL_IDS)
+    ]
+
+
+@api_router.get("/views/shop/{character_id}")
+@api_router.get("/views/level-select/{character_id}")
+async def get_character_view(character_id: str):
+    # Everything the shop and level-select screens render, in one round trip: the
+    # character is the only read, the rest is derived from it. The shop list is
+    # spliced in from its pre-encoded catalog body rather than encoded again.
+    char = _present_character(await _load_character(character_id))
+    return responses.encoded_response(
+        b'{"character":' + responses.dumps(char)
+        + b',"shop":' + catalog.shop_body(char.get("level") or 1).body
+        + b',"levels":' + responses.dumps(_level_progress(char)) + b"}"
+    )
 
 
 @api_router.put("/characters/{character_id}")
+@_serialized(lambda kwargs: kwargs["character_id"])
 async def update_character(character_id: str, data: CharacterUpdate):
-    char = await db.characters.find_one({"id": character_id}, {"_id": 0})
-    if not char:
-        raise HTTPException(status_code=404, detail="Character not found")
-
     update_data = {k: v for k, v in data.model_dump().items() if v is not None}
+    expected_version = update_data.pop("version", None)
     if not update_data:
-        return char
-
-    await db.characters.update_one({"id": character_id}, {"$set": update_data})
-    updated = await db.characters.find_one({"id": character_id}, {"_id": 0})
-    return updated
+        return await get_character(character_id)
+
+    conditions = _version_condition(expected_version) if expected_version is not None else {}
+    update = {"$set": update_data}
+    if "inventory" in update_data or "equipment" in update_data:
+        # Whole-bag replacement is the one place that still rewrites every entry;
+        # the half that wasn't sent is taken from the current document, and the
+        # write only lands if nothing changed it since.
+        current = _present_character(await _load_character(character_id))
+        items, equipped = items_from_presented(
+            update_data.pop("inventory", current["inventory"]),
+            update_data.pop("equipment", current["equipment"]),
+        )
+        update = {
+            "$set": {**update_data, "items": items, "equipped": equipped},
+            "$unset": {"inventory": "", "equipment": ""},
+        }
+        if expected_version is None:
+            conditions = _version_condition(current.get("version"))
+
+    updated = await _update_character(character_id, update, conditions=conditions)
+    leaderboard.record(updated)
+    return _present_character(updated)
 
 
 @api_router.get("/items")
-async def list_items():
-    return SHOP_ITEMS
+async def list_items(request: Request):
+    return catalog.respond(request, catalog.ITEMS_BODY)
 
 
 @api_router.get("/shop")
-async def get_shop_items(level: int = 1):
-    available = [item for item in SHOP_ITEMS if item["level_req"] <= level + 2]
-    return available
+async def get_shop_items(request: Request, level: int = 1):
+    return catalog.respond(request, catalog.shop_body(level))
 
 
 @api_router.post("/shop/buy")
+@_serialized(lambda kwargs: kwargs["data"].character_id)
 async def buy_item(data: ShopBuy):
-    char = await db.characters.find_one({"id": data.character_id}, {"_id": 0})
-    if not char:
-        raise HTTPException(status_code=404, detail="Character not found")
-
-    item = next((i for i in SHOP_ITEMS if i["id"] == data.item_id), None)
+    item = ITEMS_BY_ID.get(data.item_id)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
 
-    if char["gold"] < item["price"]:
-        raise HTTPException(status_code=400, detail="Not enough gold")
+    updated = await _update_character(
+        data.character_id,
+        {"$inc": {"gold": -item["price"]}, "$set": {f"items.{new_instance_id()}": {"item_id": item["id"]}}},
+        conditions={
+            "gold": {"$gte": item["price"]},
+            "level": {"$gte": item["level_req"]},
+            "items": {"$exists": True},
+        },
+        guards=[
+            (lambda c: c["gold"] >= item["price"], "Not enough gold"),
+            (lambda c: c["level"] >= item["level_req"], "Level requirement not met"),
+        ],
+    )
+    return _present_character(updated)
 
-    if char["level"] < item["level_req"]:
-        raise HTTPException(status_code=400, detail="Level requirement not met")
 
-    new_gold = char["gold"] - item["price"]
-    new_inventory = char.get("inventory", []) + [item]
+def _catalog_price_expr(entry_path: str):
+    # Price of a stored entry as hydrate_item would report it: the catalog price for
+    # catalog references, else whatever price an uncatalogued entry carries, else 10.
+    return {"$let": {
+        "vars": {"index": {"$indexOfArray": [{"$literal": ITEM_IDS}, f"{entry_path}.item_id"]}},
+        "in": {"$cond": [
+            {"$gte": ["$$index", 0]},
+            {"$arrayElemAt": [{"$literal": ITEM_PRICES}, "$$index"]},
+            {"$ifNull": [f"{entry_path}.price", 10]},
+        ]},
+    }}
 
-    await db.characters.update_one(
-        {"id": data.character_id},
-        {"$set": {"gold": new_gold, "inventory": new_inventory}}
-    )
 
-    updated = await db.characters.find_one({"id": data.character_id}, {"_id": 0})
-    return updated
+def _not_equipped_conditions(instance_id: str, slots=EQUIPMENT_SLOTS):
+    return {f"equipped.{slot}": {"$ne": instance_id} for slot in slots}
 
 
 @api_router.post("/characters/{character_id}/sell")
+@_serialized(lambda kwargs: kwargs["character_id"])
 async def sell_item(character_id: str, data: dict):
-    char = await db.characters.find_one({"id": character_id}, {"_id": 0})
-    if not char:
-        raise HTTPException(status_code=404, detail="Character not found")
-
-    index = data.get("inventory_index")
-    inventory = char.get("inventory", [])
-    if index is None or index < 0 or index >= len(inventory):
-        raise HTTPException(status_code=400, detail="Invalid inventory index")
-
-    item = inventory[index]
-    sell_price = max(1, int(item.get("price", 10) * 0.5))
-
-    new_inventory = [i for idx, i in enumerate(inventory) if idx != index]
-    new_gold = char["gold"] + sell_price
-
-    await db.characters.update_one(
-        {"id": character_id},
-        {"$set": {"gold": new_gold, "inventory": new_inventory}}
+    instance_id = await _resolve_instance_id(character_id, data.get("instance_id"), data.get("inventory_index"))
+
+    # The pre-image tells us which item left the bag; the post-image is derived from it below.
+    char = await _update_character(
+        character_id,
+        [
+            {"$set": {"gold": {"$add": ["$gold", {"$max": [1, {"$toInt": {"$multiply": [
+                _catalog_price_expr(f"$items.{instance_id}"), 0.5
+            ]}}]}]}}},
+            {"$unset": f"items.{instance_id}"},
+        ],
+        conditions={f"items.{instance_id}": {"$exists": True}, **_not_equipped_conditions(instance_id)},
+        guards=[
+            (lambda c: instance_id in c.get("items", {}), "Item not in inventory"),
+            (lambda c: instance_id not in c.get("equipped", {}).values(), "Item is equipped"),
+        ],
+        return_document=ReturnDocument.BEFORE,
     )
 
-    updated = await db.characters.find_one({"id": character_id}, {"_id": 0})
-    return {"character": updated, "sold_price": sell_price}
+    item = hydrate_item(char["items"].pop(instance_id), instance_id)
+    sell_price = max(1, int(item.get("price", 10) * 0.5))
+    char["gold"] += sell_price
+    char["version"] = char.get("version", 0) + 1
+    character_cache.store(char)
+    return {"character": _present_character(char), "sold_price": sell_price}
 
 
 
 @api_router.post("/characters/{character_id}/equip")
+@_serialized(lambda kwargs: kwargs["character_id"])
 async def equip_item(character_id: str, data: EquipItem):
-    char = await db.characters.find_one({"id": character_id}, {"_id": 0})
-    if not char:
-        raise HTTPException(status_code=404, detail="Character not found")
-
-    inventory = char.get("inventory", [])
-    if data.inventory_index < 0 or data.inventory_index >= len(inventory):
-        raise HTTPException(status_code=400, detail="Invalid inventory index")
-
-    if data.slot not in ["weapon", "armor", "relic", "scroll"]:
+    if data.slot not in EQUIPMENT_SLOTS:
         raise HTTPException(status_code=400, detail="Invalid equipment slot")
 
-    item = inventory[data.inventory_index]
-    equipment = char.get("equipment", {"weapon": None, "armor": None, "relic": None, "scroll": None})
-
-    old_item = equipment.get(data.slot)
-    equipment[data.slot] = item
-    new_inventory = [i for idx, i in enumerate(inventory) if idx != data.inventory_index]
-    if old_item:
-        new_inventory.append(old_item)
-
-    await db.characters.update_one(
-        {"id": character_id},
-        {"$set": {"equipment": equipment, "inventory": new_inventory}}
+    instance_id = await _resolve_instance_id(character_id, data.instance_id, data.inventory_index)
+
+    # Whatever was in the slot before simply stops being referenced and shows up in
+    # the inventory again, so a swap is a single slot-scoped $set.
+    other_slots = [slot for slot in EQUIPMENT_SLOTS if slot != data.slot]
+    updated = await _update_character(
+        character_id,
+        {"$set": {f"equipped.{data.slot}": instance_id}},
+        conditions={f"items.{instance_id}": {"$exists": True}, **_not_equipped_conditions(instance_id, other_slots)},
+        guards=[
+            (lambda c: instance_id in c.get("items", {}), "Item not in inventory"),
+            (lambda c: instance_id not in c.get("equipped", {}).values(), "Item is already equipped"),
+        ],
     )
-
-    updated = await db.characters.find_one({"id": character_id}, {"_id": 0})
-    return updated
+    return _present_character(updated)
 
 
 @api_router.post("/characters/{character_id}/unequip")
+@_serialized(lambda kwargs: kwargs["character_id"])
 async def unequip_item(character_id: str, data: dict):
-    char = await db.characters.find_one({"id": character_id}, {"_id": 0})
-    if not char:
-        raise HTTPException(status_code=404, detail="Character not found")
-
     slot = data.get("slot")
-    if slot not in ["weapon", "armor", "relic", "scroll"]:
+    if slot not in EQUIPMENT_SLOTS:
         raise HTTPException(status_code=400, detail="Invalid slot")
 
-    equipment = char.get("equipment", {})
-    item = equipment.get(slot)
-    if not item:
-        raise HTTPException(status_code=400, detail="Slot is empty")
+    updated = await _update_character(
+        character_id,
+        {"$set": {f"equipped.{slot}": None}},
+        conditions={f"equipped.{slot}": {"$ne": None}},
+        guards=[(lambda c: c.get("equipped", {}).get(slot), "Slot is empty")],
+    )
+    return _present_character(updated)
+
+
+@api_router.post("/characters/{character_id}/levelup")
+@_serialized(lambda kwargs: kwargs["character_id"])
+async def level_up(character_id: str, data: LevelUpRequest):
+    if data.stat not in STATS:
+        raise HTTPException(status_code=400, detail="Invalid stat")
 
-    equipment[slot] = None
-    new_inventory = char.get("inventory", []) + [item]
+    updates = {
+        f"stats.{data.stat}": {"$add": [f"$stats.{data.stat}", 1]},
+        "stat_points": {"$subtract": ["$stat_points", 1]},
+    }
 
-    await db.characters.update_one(
-        {"id": character_id},
-        {"$set": {"equipment": equipment, "inventory": new_inventory}}
+    # Same effects as progression.spend_stat_point; a $set stage reads the values from
+    # before the stage, so a pool is capped by its maximum's new value expression.
+    effects = progression.STAT_EFFECTS.get(data.stat, {})
+    for field, amount in effects.items():
+        updates[field] = {"$add": [f"${field}", amount]}
+    for pool, maximum in progression.POOL_MAXIMA.items():
+        if pool in effects:
+            updates[pool] = {"$min": [updates[pool], updates.get(maximum, f"${maximum}")]}
+
+    updated = await _update_character(
+        character_id,
+        [{"$set": updates}],
+        conditions={"stat_points": {"$gt": 0}},
+        guards=[(lambda c: c.get("stat_points", 0) > 0, "No stat points available")],
     )
+    return _present_character(updated)
+
+
+# The batch endpoint replays the shop/inventory handlers above on an in-memory copy
+# of the stored document; each function below applies one operation with the same
+# checks and error messages as its endpoint, and returns that operation's result.
+def _batch_instance_id(char, op: BatchOperation):
+    if op.instance_id is not None:
+        if not INSTANCE_ID_RE.match(op.instance_id):
+            raise HTTPException(status_code=400, detail="Invalid instance id")
+        return op.instance_id
+    inventory = _present_character(char)["inventory"]
+    if op.inventory_index is None or op.inventory_index < 0 or op.inventory_index >= len(inventory):
+        raise HTTPException(status_code=400, detail="Invalid inventory index")
+    return inventory[op.inventory_index]["instance_id"]
 
-    updated = await db.characters.find_one({"id": character_id}, {"_id": 0})
-    return updated
 
+def _batch_buy(char, op: BatchOperation):
+    item = ITEMS_BY_ID.get(op.item_id)
+    if not item:
+        raise HTTPException(status_code=404, detail="Item not found")
+    if char["gold"] < item["price"]:
+        raise HTTPException(status_code=400, detail="Not enough gold")
+    if char["level"] < item["level_req"]:
+        raise HTTPException(status_code=400, detail="Level requirement not met")
+    instance_id = new_instance_id()
+    char["gold"] -= item["price"]
+    char["items"][instance_id] = {"item_id": item["id"]}
+    return {"instance_id": instance_id}
+
+
+def _batch_sell(char, op: BatchOperation):
+    instance_id = _batch_instance_id(char, op)
+    if instance_id not in char["items"]:
+        raise HTTPException(status_code=400, detail="Item not in inventory")
+    if instance_id in char["equipped"].values():
+        raise HTTPException(status_code=400, detail="Item is equipped")
+    item = hydrate_item(char["items"].pop(instance_id), instance_id)
+    sell_price = max(1, int(item.get("price", 10) * 0.5))
+    char["gold"] += sell_price
+    return {"instance_id": instance_id, "sold_price": sell_price}
 
-@api_router.post("/characters/{character_id}/levelup")
-async def level_up(character_id: str, data: LevelUpRequest):
-    char = await db.characters.find_one({"id": character_id}, {"_id": 0})
-    if not char:
-        raise HTTPException(status_code=404, detail="Character not found")
 
-    if char.get("stat_points", 0) <= 0:
-        raise HTTPException(status_code=400, detail="No stat points available")
+def _batch_equip(char, op: BatchOperation):
+    if op.slot not in EQUIPMENT_SLOTS:
+        raise HTTPException(status_code=400, detail="Invalid equipment slot")
+    instance_id = _batch_instance_id(char, op)
+    if instance_id not in char["items"]:
+        raise HTTPException(status_code=400, detail="Item not in inventory")
+    if any(char["equipped"].get(slot) == instance_id for slot in EQUIPMENT_SLOTS if slot != op.slot):
+        raise HTTPException(status_code=400, detail="Item is already equipped")
+    char["equipped"][op.slot] = instance_id
+    return {"instance_id": instance_id}
 
-    if data.stat not in ["str", "dex", "end", "int", "lck"]:
-        raise HTTPException(status_code=400, detail="Invalid stat")
 
-    stats = char["stats"]
-    stats[data.stat] += 1
+def _batch_unequip(char, op: BatchOperation):
+    if op.slot not in EQUIPMENT_SLOTS:
+        raise HTTPException(status_code=400, detail="Invalid slot")
+    if not char["equipped"].get(op.slot):
+        raise HTTPException(status_code=400, detail="Slot is empty")
+    char["equipped"][op.slot] = None
+    return {}
 
-    updates = {
-        "stats": stats,
-        "stat_points": char["stat_points"] - 1
-    }
 
-    if data.stat == "end":
-        updates["max_health"] = char["max_health"] + 5
-        updates["health"] = min(char["health"] + 5, char["max_health"] + 5)
-        updates["max_stamina"] = char["max_stamina"] + 3
-    elif data.stat == "int":
-        updates["max_mana"] = char["max_mana"] + 5
+def _batch_levelup(char, op: BatchOperation):
+    if op.stat not in STATS:
+        raise HTTPException(status_code=400, detail="Invalid stat")
+    if char.get("stat_points", 0) <= 0:
+        raise HTTPException(status_code=400, detail="No stat points available")
+    progression.spend_stat_point(char, op.stat)
+    return {}
 
-    await db.characters.update_one({"id": character_id}, {"$set": updates})
-    updated = await db.characters.find_one({"id": character_id}, {"_id": 0})
-    return updated
+
+_BATCH_OPERATIONS = {
+    "buy": _batch_buy,
+    "sell": _batch_sell,
+    "equip": _batch_equip,
+    "unequip": _batch_unequip,
+    "levelup": _batch_levelup,
+}
+# Every pool and its maximum, as the /levelup pipeline may move any of them.
+_BATCH_FIELDS = ["gold", "items", "equipped", "stats", "stat_points", *progression.POOL_MAXIMA, *progression.MAXIMA]
+MAX_BATCH_OPERATIONS = 100
+
+
+@api_router.post("/characters/{character_id}/batch")
+@_serialized(lambda kwargs: kwargs["character_id"])
+async def batch_operations(character_id: str, data: CharacterBatch):
+    if len(data.operations) > MAX_BATCH_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_OPERATIONS} operations per batch")
+    for index, op in enumerate(data.operations):
+        if op.op not in _BATCH_OPERATIONS:
+            raise HTTPException(status_code=400, detail=f"Operation {index}: unknown operation")
+
+    # All or nothing: the operations run in order on a copy, the first failure rejects
+    # the batch, and the final state is written once, conditional on the version it was
+    # computed from. A copy that turns out to be stale is re-read and replayed once.
+    for attempt in range(2):
+        stored = await _load_character(character_id)
+        if "items" not in stored:
+            await _upgrade_item_storage(stored)
+            stored = await _fetch_character(character_id)
+        char = copy.deepcopy(stored)
+
+        results = []
+        for index, op in enumerate(data.operations):
+            try:
+                results.append({"op": op.op, **_BATCH_OPERATIONS[op.op](char, op)})
+            except HTTPException as e:
+                raise HTTPException(status_code=e.status_code, detail=f"Operation {index} ({op.op}): {e.detail}")
+        if not results:
+            break
+
+        try:
+            char = await _update_character(
+                character_id,
+                {"$set": {field: char[field] for field in _BATCH_FIELDS if field in char}},
+                conditions=_version_condition(stored.get("version")),
+            )
+            break
+        except HTTPException as e:
+            if e.status_code != 409 or attempt:
+                raise
+
+    return {"character": _present_character(char), "results": results}
+
+
+def _game_event(type: str, data: dict, fields=()) -> GameEvent:
+    # complete-level and player-death are single events of the /game/events kind.
+    try:
+        return GameEvent(type=type, **{field: data[field] for field in fields if field in data})
+    except ValidationError as e:
+        # The same 422 /game/events gives when its GameEvent models fail to validate.
+        raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in e.errors()])
+
+
+def _character_id(data: dict) -> str:
+    # The write actor is keyed by it, so a missing id must not reach writes.merge.
+    character_id = data.get("character_id")
+    if not isinstance(character_id, str) or not character_id:
+        raise HTTPException(status_code=422, detail="character_id is required")
+    return character_id
 
 
 @api_router.post("/game/complete-level")
 async def complete_level(data: dict):
-    character_id = data.get("character_id")
-    level_id = data.get("level_id")
-    xp_gained = data.get("xp_gained", 0)
-    gold_gained = data.get("gold_gained", 0)
-    kills = data.get("kills", 0)
+    event = _game_event("complete_level", data, ["level_id", "xp_gained", "gold_gained", "kills"])
+    result = await writes.merge(_character_id(data), _apply_game_events, [event])
+    return {"character": result["character"], "leveled_up": result["leveled_up"]}
 
-    char = await db.characters.find_one({"id": character_id}, {"_id": 0})
-    if not char:
-        raise HTTPException(status_code=404, detail="Character not found")
 
-    new_xp = char["xp"] + xp_gained
-    new_gold = char["gold"] + gold_gained
-    new_kills = char["kills"] + kills
-    completed = list(set(char.get("completed_levels", []) + [level_id]))
+@api_router.post("/game/player-death")
+async def player_death(data: dict):
+    event = _game_event("death", data, ["level_id"])
+    result = await writes.merge(_character_id(data), _apply_game_events, [event])
+    return {"character": result["character"], "gold_lost": result["gold_lost"]}
+
+
+GAME_EVENT_TYPES = ["kill", "gold", "death", "complete_level"]
+MAX_GAME_EVENTS = 1000
+
+
+@api_router.post("/game/events")
+async def game_events(data: GameEventBatch):
+    if len(data.events) > MAX_GAME_EVENTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_GAME_EVENTS} events per batch")
+    for index, event in enumerate(data.events):
+        if event.type not in GAME_EVENT_TYPES:
+            raise HTTPException(status_code=400, detail=f"Invalid event type at index {index}")
+    if not data.events:
+        char = _present_character(await _load_character(data.character_id))
+        return {"character": char, "leveled_up": False, "gold_lost": 0}
+    return await writes.merge(data.character_id, _apply_game_events, data.events)
+
+
+def _game_events_stages(events: List[GameEvent]):
+    # Everything but gold adds up, and the XP of several completions levels up exactly
+    # like their sum would. Gold does not: a death costs a share of the gold held at
+    # that moment, so pickups are summed per stretch between two deaths.
+    xp_gained = kills = deaths = 0
+    completions = 0
+    level_ids = []
+    gold_stretches = [0]
+    for event in events:
+        if event.type == "kill":
+            kills += event.count
+        elif event.type == "gold":
+            gold_stretches[-1] += event.amount
+        elif event.type == "death":
+            deaths += 1
+            gold_stretches.append(0)
+        else:
+            completions += 1
+            xp_gained += event.xp_gained
+            gold_stretches[-1] += event.gold_gained
+            kills += event.kills
+            if event.level_id not in level_ids:
+                level_ids.append(event.level_id)
+
+    gold = "$gold"
+    for pickups in gold_stretches[:-1]:
+        gold = {"$let": {
+            "vars": {"gold": {"$add": [gold, {"$literal": pickups}]}},
+            "in": {"$subtract": ["$$gold", _death_penalty_expr("$$gold")]},
+        }}
+    updates = {
+        "gold": {"$add": [gold, {"$literal": gold_stretches[-1]}]},
+        "kills": {"$add": ["$kills", {"$literal": kills}]},
+        "deaths": {"$add": ["$deaths", deaths]},
+    }
+    if completions or deaths:
+        updates.update({"health": "$max_health", "mana": "$max_mana", "stamina": "$max_stamina"})
+    stages = [{"$set": updates}]
+    if completions:
+        updates["_progress"] = _xp_progress_expr(xp_gained)
+        updates["completed_levels"] = _append_unique_expr("$completed_levels", level_ids)
+        stages += _PROGRESS_STAGES
+    return stages
+
+
+def _replay_game_events(char, events: List[GameEvent]):
+    """char after events, as _game_events_stages computes it, and the gold each death cost."""
+    xp_gained = kills = deaths = completions = 0
+    gold, penalties = char["gold"], []
+    completed = char.get("completed_levels", [])
+    for event in events:
+        if event.type == "kill":
+            kills += event.count
+        elif event.type == "gold":
+            gold += event.amount
+        elif event.type == "death":
+            deaths += 1
+            penalties.append(_death_penalty(gold))
+            gold -= penalties[-1]
+        else:
+            completions += 1
+            xp_gained += event.xp_gained
+            gold += event.gold_gained
+            kills += event.kills
+            if event.level_id not in completed:
+                completed = completed + [event.level_id]
+
+    updated = {**char, "gold": gold, "kills": char["kills"] + kills, "deaths": char["deaths"] + deaths}
+    if completions or deaths:
+        updated.update({"health": char["max_health"], "mana": char["max_mana"], "stamina": char["max_stamina"]})
+    if completions:
+        updated.update(progression.gain_xp(char, xp_gained))
+        updated["completed_levels"] = completed
+    return updated, penalties
+
+
+async def _apply_game_events(character_id: str, batches: List[List[GameEvent]]):
+    """One write for every batch the character's actor had queued; a result per batch.
+
+    Each batch is replayed on the pre-image in turn, so leveled_up and gold_lost are
+    that batch's own; the character returned to all of them is the stored result.
+    """
+    stages = _game_events_stages([event for batch in batches for event in batch])
+    char = await _update_character(character_id, stages, return_document=ReturnDocument.BEFORE)
+
+    state, results = char, []
+    for batch in batches:
+        after, penalties = _replay_game_events(state, batch)
+        results.append({"leveled_up": after["level"] > state["level"], "gold_lost": sum(penalties)})
+        deaths = iter(penalties)
+        for event in batch:
+            if event.type == "complete_level":
+                run_log.record(char, "complete", event.level_id, xp=event.xp_gained, gold=event.gold_gained,
+                               kills=event.kills)
+            elif event.type == "death":
+                run_log.record(char, "death", event.level_id, gold_lost=next(deaths))
+        state = after
+
+    updated = {**state, "version": char.get("version", 0) + 1}
+    character_cache.store(updated)
+    leaderboard.record(updated)
+    presented = _present_character(updated)
+    return [{"character": presented, **result} for result in results]
 
-    new_level = char["level"]
-    new_stat_points = char.get("stat_points", 0)
-    xp_to_next = char["xp_to_next"]
 
-    while new_xp >= xp_to_next:
-        new_xp -= xp_to_next
-        new_level += 1
-        new_stat_points += 3
-        xp_to_next = new_level * 100
+@api_router.get("/leaderboard")
+async def get_leaderboard(class_type: Optional[str] = None):
+    if class_type is not None and class_type not in CHARACTER_CLASSES:
+        raise HTTPException(status_code=400, detail="Invalid class type")
+    return responses.json_response(await leaderboard.top(class_type))
 
-    updates = {
-        "xp": new_xp,
-        "xp_to_next": xp_to_next,
-        "gold": new_gold,
-        "kills": new_kills,
-        "completed_levels": completed,
-        "level": new_level,
-        "stat_points": new_stat_points,
-        "health": char["max_health"],
-        "mana": char["max_mana"],
-        "stamina": char["max_stamina"],
-    }
 
-    await db.characters.update_one({"id": character_id}, {"$set": updates})
-    updated = await db.characters.find_one({"id": character_id}, {"_id": 0})
-    return {"character": updated, "leveled_up": new_level > char["level"]}
+LEADERBOARD_KEEPALIVE = float(os.environ.get('LEADERBOARD_STREAM_KEEPALIVE', 15))
 
 
-@api_router.post("/game/player-death")
-async def player_death(data: dict):
-    character_id = data.get("character_id")
-    char = await db.characters.find_one({"id": character_id}, {"_id": 0})
-    if not char:
-        raise HTTPException(status_code=404, detail="Character not found")
+@api_router.get("/leaderboard/stream")
+async def stream_leaderboard(class_type: Optional[str] = None):
+    # Server-sent events: a snapshot on connect, then diff events carrying only the
+    # ranks that changed. All subscribers of a board share one producer.
+    if class_type is not None and class_type not in CHARACTER_CLASSES:
+        raise HTTPException(status_code=400, detail="Invalid class type")
 
-    gold_penalty = max(0, int(char["gold"] * 0.1))
-    await db.characters.update_one(
-        {"id": character_id},
-        {"$set": {
-            "deaths": char["deaths"] + 1,
-            "gold": char["gold"] - gold_penalty,
-            "health": char["max_health"],
-            "mana": char["max_mana"],
-            "stamina": char["max_stamina"],
-        }}
+    async def events():
+        async with leaderboard_feed.subscribe(class_type) as queue:
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), LEADERBOARD_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle connection.
+                    yield b": keepalive\n\n"
+                    continue
+                yield b"event: %s\nid: %d\ndata: %s\n\n" % (
+                    message["type"].encode(), message["seq"], responses.dumps(message)
+                )
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
-    updated = await db.characters.find_one({"id": character_id}, {"_id": 0})
-    return {"character": updated, "gold_lost": gold_penalty}
 
 
-@api_router.get("/leaderboard")
-async def get_leaderboard():
-    chars = await db.characters.find(
-        {}, {"_id": 0, "id": 1, "name": 1, "class_type": 1, "level": 1, "kills": 1, "completed_levels": 1}
-    ).sort([("level", -1), ("kills", -1)]).to_list(20)
-    return chars
+@api_router.get("/leaderboard/rank/{character_id}")
+async def get_leaderboard_rank(character_id: str):
+    async def rank():
+        char = await _load_character(character_id)
+        char = {field: char[field] for field in ("id", "name", "class_type", "level", "kills") if field in char}
+        return {**char, **await leaderboard.rank(char)}
+
+    return responses.json_response(await reads.do(("rank", character_id), rank))
 
 
 @api_router.delete("/characters/{character_id}")
+@_serialized(lambda kwargs: kwargs["character_id"])
 async def delete_character(character_id: str):
-    result = await db.characters.delete_one({"id": character_id})
+    result = await mongo.db.characters.delete_one({"_id": character_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Character not found")
+    character_cache.invalidate(character_id)
+    reads.forget(("character", character_id))
+    reads.forget(("rank", character_id))
+    leaderboard.remove(character_id)
     return {"deleted": True}
 
 
+# Bigger sweeps are for the offline CLI (python balance.py), not a request thread.
+BALANCE_MAX_FIGHTS = int(os.environ.get('BALANCE_MAX_FIGHTS', 200))
+BALANCE_MAX_LOADOUTS = int(os.environ.get('BALANCE_MAX_LOADOUTS', 5000))
+
+
+@ops_router.get("/admin/balance")
+async def get_balance_report(
+    level: int = Query(1, ge=1, le=100),
+    fights: int = Query(100, ge=1),
+    build: str = Query("primary", pattern="^(primary|end|even)$"),
+):
+    if fights > BALANCE_MAX_FIGHTS:
+        raise HTTPException(status_code=400,
+                            detail=f"fights is limited to {BALANCE_MAX_FIGHTS}; run balance.py offline")
+
+    # CPU-bound; runs off the event loop, and identical concurrent requests share one run.
+    def run():
+        try:
+            table = balance.simulate(level, fights, build, max_loadouts=BALANCE_MAX_LOADOUTS)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=f"{exc}; run balance.py offline")
+        return balance.report(table, level, fights)
+
+    return await reads.do(("balance", level, fights, build), lambda: run_in_threadpool(run))
+
+
+_CACHES = {"characters": character_cache, "effective_stats": effective_stats.memo}
+metrics.register_callback(
+    "cache_hits_total", "counter", "Cache lookups served from memory.",
+    lambda: [({"cache": name}, cache.hits) for name, cache in _CACHES.items()],
+)
+metrics.register_callback(
+    "cache_misses_total", "counter", "Cache lookups that had to compute or query.",
+    lambda: [({"cache": name}, cache.misses) for name, cache in _CACHES.items()],
+)
+metrics.register_callback(
+    "cache_entries", "gauge", "Entries currently held by a cache.",
+    lambda: [({"cache": name}, len(cache)) for name, cache in _CACHES.items()],
+)
+metrics.register_callback(
+    "coalesced_reads_total", "counter", "Coalesced reads, by whether they ran the query or shared one.",
+    lambda: [({"outcome": "executed"}, reads.calls), ({"outcome": "shared"}, reads.shared)],
+)
+metrics.register_callback(
+    "mongodb_pool_connections", "gauge", "MongoDB pool connections per server, by state.",
+    lambda: [
+        ({"server": address, "state": state}, count)
+        for address, server in mongo.pool.snapshot().items() for state, count in server.items()
+    ],
+)
+metrics.register_callback(
+    "mongodb_pool_checkout_timeouts_total", "counter", "Requests that timed out waiting for a pooled connection.",
+    lambda: [({}, mongo.pool.checkout_timeouts)],
+)
+
+
+@ops_router.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@api_router.get("/health/ready")
+async def get_readiness(response: Response):
+    # Load balancers take a worker out of rotation on 503: MongoDB is unreachable
+    # or every pooled connection is busy with requests already queued behind them.
+    report = await mongo.readiness(timeout=float(os.environ.get('READY_PING_TIMEOUT', 2)))
+    if not report["ready"]:
+        response.status_code = 503
+    return report
+
+
+@ops_router.get("/cache/stats")
+async def get_cache_stats():
+    return {
+        "characters": character_cache.stats(),
+        "coalesced_reads": reads.stats(),
+        "effective_stats": effective_stats.memo.stats(),
+        "leaderboard_stream": leaderboard_feed.stats(),
+        "invalidation": cache_watcher.stats(),
+        "telemetry": run_log.stats(),
+        "write_actors": writes.stats(),
+        "idempotency": idempotent.stats(),
+    }
+
+
+@api_router.get("/analytics/levels/{level_id}")
+async def get_level_analytics(level_id: int, since: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$")):
+    # All-time figures come from one pre-aggregated document per class; ``since``
+    # (a UTC day) sums the daily ones instead.
+    return await run_log.level_stats(level_id, since)
+
+
 app.include_router(api_router)
+app.include_router(ops_router)
 
+# Innermost, so replayed responses still get CORS headers and compression.
+app.add_middleware(
+    idempotency.IdempotencyMiddleware,
+    store=idempotent,
+    paths=[r"/api/shop/buy", r"/api/characters/[^/]+/sell", r"/api/game/complete-level", r"/api/game/player-death"],
+)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Idempotent-Replayed"],
+)
+app.add_middleware(
+    responses.CompressionMiddleware,
+    minimum_size=int(os.environ.get('COMPRESSION_MIN_SIZE', 1024)),
+    gzip_level=int(os.environ.get('GZIP_LEVEL', 6)),
+    brotli_quality=int(os.environ.get('BROTLI_QUALITY', 4)),
+)
+# Added last so it wraps compression and records the bytes actually sent.
+app.add_middleware(
+    metrics.MetricsMiddleware,
+    slow_request_seconds=float(os.environ.get('SLOW_REQUEST_SECONDS', 0)),
 )
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
@@ -0,0 +1,61 @@
+"""Stored item layout: compact catalog references keyed by instance id.
+
+Owned items are stored as a map keyed by a per-entry instance id ("items"), and
+the equipment slots only hold instance ids ("equipped"). Buying, selling and
+(un)equipping then touch a single "items.<id>" or "equipped.<slot>" path, so a
+write costs the same whatever the bag size. Entries only reference the catalog
+({"item_id": "w1"} plus any per-instance fields); server._present_character
+hydrates them from ITEMS_BY_ID into the inventory list / equipment dict the API
+has always returned, so catalog edits apply to items players already own.
+
+Shared by the API and the migrations, which import it without the app.
+"""
+import re
+import uuid
+
+from catalog import ITEMS_BY_ID
+
+EQUIPMENT_SLOTS = ["weapon", "armor", "relic", "scroll"]
+INSTANCE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def new_instance_id():
+    return uuid.uuid4().hex
+
+
+def compact_item(entry):
+    item = ITEMS_BY_ID.get(entry.get("item_id", entry.get("id")))
+    if item is None:
+        return dict(entry)
+    return {"item_id": item["id"], **{k: v for k, v in entry.items() if k not in item and k != "item_id"}}
+
+
+def hydrate_item(entry, instance_id):
+    extra = {k: v for k, v in entry.items() if k != "item_id"}
+    base = ITEMS_BY_ID.get(entry["item_id"], {"id": entry["item_id"]}) if "item_id" in entry else {}
+    return {**base, **extra, "instance_id": instance_id}
+
+
+def items_from_presented(inventory, equipment):
+    items = {}
+    equipment = equipment or {}
+
+    def add(entry):
+        entry = compact_item(entry)
+        instance_id = entry.pop("instance_id", None)
+        if not isinstance(instance_id, str) or not INSTANCE_ID_RE.match(instance_id) or instance_id in items:
+            instance_id = new_instance_id()
+        items[instance_id] = entry
+        return instance_id
+
+    for entry in inventory or []:
+        add(entry)
+    equipped = {slot: add(equipment[slot]) if equipment.get(slot) else None for slot in EQUIPMENT_SLOTS}
+    return items, equipped
+
+
+def compact_item_storage(char):
+    if "items" not in char:
+        return items_from_presented(char.get("inventory"), char.get("equipment"))
+    items = {instance_id: compact_item(entry) for instance_id, entry in char["items"].items()}
+    return items, char.get("equipped") or {slot: None for slot in EQUIPMENT_SLOTS}
@@ -0,0 +1,211 @@
+"""Append-only run telemetry with rolling per-level aggregates.
+
+Every finished run (a level completion or a death) becomes one small document
+in ``runs``. Handlers only append it to an in-memory buffer; a background task
+flushes the buffer every ``interval`` seconds (or as soon as ``batch_size``
+runs are waiting) with one unordered insert_many, then folds the same batch
+into ``run_stats``: one document per (day, level_id, class_type) plus an
+all-time one per (level_id, class_type), kept current with $inc upserts. The
+increments of a batch are combined per document first, so a flush costs one
+upsert per distinct document, however many runs it carries.
+
+Run ids are assigned here, so a batch whose insert failed is simply retried
+(duplicates are rejected by _id). A run the database rejects for any other
+reason would be rejected again, so it is moved to a bounded ``dead_letters``
+list and the rest of its batch goes through. Aggregates are only applied for
+runs that were stored; ``runs`` stays the source of truth if an aggregate
+write fails.
+"""
+import asyncio
+import contextlib
+import logging
+import math
+from bisect import bisect_right
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+ALL_TIME = "all"
+# Lower bounds of the gold/xp histogram buckets.
+BUCKETS = (0, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+DISTRIBUTIONS = ["gold", "xp"]
+COUNTERS = ["completions", "deaths", "kills", "gold_lost"]
+# run_stats is read by level, then by day ("all" or a range of dates).
+INDEXES = [[("level_id", ASCENDING), ("day", ASCENDING)]]
+
+
+def _bucket(value: int) -> str:
+    return str(BUCKETS[max(0, bisect_right(BUCKETS, value) - 1)])
+
+
+def stats_id(day: str, level_id, class_type) -> str:
+    return f"{day}|{level_id}|{class_type}"
+
+
+def increments(run: dict) -> dict:
+    """The $inc a run contributes to each run_stats document it belongs to."""
+    inc = {
+        "completions": int(run["outcome"] == "complete"),
+        "deaths": int(run["outcome"] == "death"),
+        "kills": run["kills"],
+        "gold_lost": run["gold_lost"],
+    }
+    if run["outcome"] == "complete":
+        for name in DISTRIBUTIONS:
+            value = run[name]
+            inc[f"{name}_sum"] = value
+            inc[f"{name}_sq"] = value * value
+            inc[f"{name}_hist.{_bucket(value)}"] = 1
+    return inc
+
+
+def summarize(docs: List[dict]) -> dict:
+    """Combine run_stats documents into counts, rates and gold/xp distributions."""
+    totals = defaultdict(int)
+    hists = {name: defaultdict(int) for name in DISTRIBUTIONS}
+    for doc in docs:
+        for field in COUNTERS:
+            totals[field] += doc.get(field, 0)
+        for name in DISTRIBUTIONS:
+            totals[f"{name}_sum"] += doc.get(f"{name}_sum", 0)
+            totals[f"{name}_sq"] += doc.get(f"{name}_sq", 0)
+            for bucket, count in (doc.get(f"{name}_hist") or {}).items():
+                hists[name][bucket] += count
+
+    runs = totals["completions"] + totals["deaths"]
+    summary = {field: totals[field] for field in COUNTERS}
+    summary["runs"] = runs
+    summary["death_rate"] = round(totals["deaths"] / runs, 4) if runs else None
+    for name in DISTRIBUTIONS:
+        count = totals["completions"]
+        mean = totals[f"{name}_sum"] / count if count else None
+        summary[name] = {
+            "mean": round(mean, 2) if mean is not None else None,
+            "stddev": round(math.sqrt(max(0.0, totals[f"{name}_sq"] / count - mean * mean)), 2) if count else None,
+            "histogram": {bucket: hists[name][bucket] for bucket in sorted(hists[name], key=int)},
+        }
+    return summary
+
+
+class RunLog:
+    def __init__(self, batch_size: int = 500, interval: float = 1.0, max_buffer: int = 50_000,
+                 max_dead_letters: int = 1000):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_buffer = max_buffer
+        self.db = None
+        self._buffer: List[dict] = []
+        self._wake = asyncio.Event()
+        # Runs the database refused, kept (newest last) for inspection.
+        self.dead_letters = deque(maxlen=max_dead_letters)
+        self.counts = {"recorded": 0, "stored": 0, "dropped": 0, "dead_lettered": 0, "aggregate_failures": 0}
+
+    def record(self, character: dict, outcome: str, level_id, xp: int = 0, gold: int = 0, kills: int = 0,
+               gold_lost: int = 0):
+        """Queue one run outcome; never touches the database."""
+        if len(self._buffer) >= self.max_buffer:
+            # The database has been unreachable for a while; keep the newest runs.
+            del self._buffer[0]
+            self.counts["dropped"] += 1
+        self._buffer.append({
+            "_id": ObjectId(),
+            "at": datetime.now(timezone.utc),
+            "character_id": character["id"],
+            "class_type": character.get("class_type"),
+            "level_id": level_id,
+            "outcome": outcome,
+            "xp": xp,
+            "gold": gold,
+            "kills": kills,
+            "gold_lost": gold_lost,
+        })
+        self.counts["recorded"] += 1
+        if len(self._buffer) >= self.batch_size:
+            self._wake.set()
+
+    async def flush(self):
+        while self._buffer:
+            batch = stored = self._buffer[:self.batch_size]
+            try:
+                await self.db.runs.insert_many(batch, ordered=False)
+            except BulkWriteError as exc:
+                # Duplicate ids are runs a failed earlier attempt already stored.
+                failed = {error["index"] for error in exc.details["writeErrors"] if error["code"] != 11000}
+                if failed:
+                    logger.warning("Storing %d runs failed, moved to dead letters: %s", len(failed),
+                                   exc.details["writeErrors"][:3])
+                    self.dead_letters.extend(batch[index] for index in sorted(failed))
+                    self.counts["dead_lettered"] += len(failed)
+                    stored = [run for index, run in enumerate(batch) if index not in failed]
+            except PyMongoError as exc:
+                logger.warning("Storing runs failed: %s; keeping %d queued", exc, len(self._buffer))
+                return
+            del self._buffer[:len(batch)]
+            self.counts["stored"] += len(stored)
+            if stored:
+                await self._aggregate(stored)
+
+    async def _aggregate(self, batch: List[dict]):
+        combined = defaultdict(lambda: defaultdict(int))
+        for run in batch:
+            inc = increments(run)
+            for day in (run["at"].date().isoformat(), ALL_TIME):
+                target = combined[(day, run["level_id"], run["class_type"])]
+                for field, value in inc.items():
+                    target[field] += value
+        ops = [
+            UpdateOne(
+                {"_id": stats_id(day, level_id, class_type)},
+                {"$inc": dict(inc), "$setOnInsert": {"day": day, "level_id": level_id, "class_type": class_type}},
+                upsert=True,
+            )
+            for (day, level_id, class_type), inc in combined.items()
+        ]
+        try:
+            await self.db.run_stats.bulk_write(ops, ordered=False)
+        except PyMongoError as exc:
+            self.counts["aggregate_failures"] += 1
+            logger.warning("Updating run aggregates failed: %s", exc)
+
+    async def _run(self):
+        while True:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            self._wake.clear()
+            await self.flush()
+
+    @contextlib.asynccontextmanager
+    async def running(self, db):
+        self.db = db
+        task = asyncio.create_task(self._run())
+        try:
+            yield self
+        finally:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+            # Whatever is still queued goes out before the client closes.
+            await self.flush()
+
+    async def level_stats(self, level_id, since: Optional[str] = None) -> dict:
+        """Per-class and overall stats for one level, all-time or from a UTC day on."""
+        query = {"level_id": level_id, "day": {"$gte": since, "$ne": ALL_TIME} if since else ALL_TIME}
+        docs = await self.db.run_stats.find(query, {"_id": 0}).to_list(None)
+        by_class = defaultdict(list)
+        for doc in docs:
+            by_class[doc["class_type"]].append(doc)
+        return {
+            "level_id": level_id,
+            "since": since,
+            "overall": summarize(docs),
+            "classes": {class_type: summarize(group) for class_type, group in sorted(by_class.items(), key=str)},
+        }
+
+    def stats(self) -> dict:
+        return {"queued": len(self._buffer), "dead_letters": len(self.dead_letters), **self.counts}
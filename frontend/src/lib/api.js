@@ -0,0 +1,23 @@
+import axios from 'axios';
+
+function newKey() {
+  return typeof crypto !== 'undefined' && crypto.randomUUID
+    ? crypto.randomUUID()
+    : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
+// POST a mutation with an Idempotency-Key. Timeouts, network errors and 409s are
+// retried with the same key, so a request that did reach the server is answered
+// from its stored response instead of being applied twice.
+export async function postIdempotent(url, data, { timeout = 4000, retries = 2 } = {}) {
+  const headers = { 'Idempotency-Key': newKey() };
+  for (let attempt = 0; ; attempt++) {
+    try {
+      return await axios.post(url, data, { headers, timeout });
+    } catch (e) {
+      const retryable = !e.response || e.response.status === 409;
+      if (!retryable || attempt >= retries) throw e;
+      await new Promise((resolve) => setTimeout(resolve, 200 * 2 ** attempt));
+    }
+  }
+}
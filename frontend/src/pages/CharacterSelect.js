@@ -20,7 +20,7 @@ export default function CharacterSelect() {
 
   useEffect(() => {
     if (mode === 'continue') {
-      axios.get(`${API}/characters`).then(res => setExistingChars(res.data)).catch(() => {});
+      axios.get(`${API}/characters?view=summary`).then(res => setExistingChars(res.data)).catch(() => {});
     }
   }, [mode]);
 
@@ -1,6 +1,7 @@
 import { useState, useEffect, useRef, useCallback } from 'react';
 import { useNavigate, useParams } from 'react-router-dom';
 import axios from 'axios';
+import { postIdempotent } from '../lib/api';
 import Phaser from 'phaser';
 import BootScene from '../game/scenes/BootScene';
 import GameScene from '../game/scenes/GameScene';
@@ -136,14 +137,14 @@ export default function GameScreen() {
 
   const handleDeath = async () => {
     try {
-      await axios.post(`${API}/game/player-death`, { character_id: characterId });
+      await postIdempotent(`${API}/game/player-death`, { character_id: characterId, level_id: parseInt(levelId) });
     } catch (e) { console.error(e); }
     navigate(`/level-select/${characterId}`);
   };
 
   const handleComplete = async () => {
     try {
-      await axios.post(`${API}/game/complete-level`, {
+      await postIdempotent(`${API}/game/complete-level`, {
         character_id: characterId,
         level_id: parseInt(levelId),
         xp_gained: levelStats?.xp || 0,
@@ -12,10 +12,14 @@ export default function LevelSelect() {
   const navigate = useNavigate();
   const { characterId } = useParams();
   const [character, setCharacter] = useState(null);
+  const [levels, setLevels] = useState([]);
 
   useEffect(() => {
-    axios.get(`${API}/characters/${characterId}`)
-      .then(res => setCharacter(res.data))
+    axios.get(`${API}/views/level-select/${characterId}`)
+      .then(res => {
+        setCharacter(res.data.character);
+        setLevels(res.data.levels);
+      })
       .catch(() => navigate('/'));
   }, [characterId, navigate]);
 
@@ -28,10 +32,7 @@ export default function LevelSelect() {
   const cls = CHARACTER_CLASSES[character.class_type];
   const completedLevels = character.completed_levels || [];
 
-  const isUnlocked = (levelId) => {
-    if (levelId === 1) return true;
-    return completedLevels.includes(levelId - 1);
-  };
+  const isUnlocked = (levelId) => levels.some(level => level.id === levelId && level.unlocked);
 
   return (
     <div className="min-h-screen bg-dark-primary" data-testid="level-select-screen">
@@ -1,6 +1,7 @@
 import { useState, useEffect } from 'react';
 import { useNavigate, useParams } from 'react-router-dom';
 import axios from 'axios';
+import { postIdempotent } from '../lib/api';
 import { RARITY_COLORS } from '../game/data/gameData';
 import { CHARACTER_CLASSES } from '../game/data/gameData';
 import { ArrowLeft, Coins, ShoppingCart, Check, Sword, Shield, Star, Scroll, Package } from 'lucide-react';
@@ -20,14 +21,9 @@ export default function Shop() {
   useEffect(() => {
     const load = async () => {
       try {
-        const [charRes, itemsRes] = await Promise.all([
-          axios.get(`${API}/characters/${characterId}`),
-          axios.get(`${API}/shop?level=1`)
-        ]);
-        setCharacter(charRes.data);
-        const lvl = charRes.data.level || 1;
-        const shopRes = await axios.get(`${API}/shop?level=${lvl}`);
-        setItems(shopRes.data);
+        const res = await axios.get(`${API}/views/shop/${characterId}`);
+        setCharacter(res.data.character);
+        setItems(res.data.shop);
       } catch (e) {
         navigate('/');
       }
@@ -38,7 +34,7 @@ export default function Shop() {
   const buyItem = async (itemId) => {
     setBuying(itemId);
     try {
-      const res = await axios.post(`${API}/shop/buy`, {
+      const res = await postIdempotent(`${API}/shop/buy`, {
         character_id: characterId,
         item_id: itemId
       });
@@ -49,10 +45,10 @@ export default function Shop() {
     setBuying(null);
   };
 
-  const equipItem = async (index, slot) => {
+  const equipItem = async (instanceId, slot) => {
     try {
       const res = await axios.post(`${API}/characters/${characterId}/equip`, {
-        inventory_index: index,
+        instance_id: instanceId,
         slot: slot
       });
       setCharacter(res.data);
@@ -70,9 +66,9 @@ export default function Shop() {
     }
   };
 
-  const sellItem = async (index) => {
+  const sellItem = async (instanceId) => {
     try {
-      const res = await axios.post(`${API}/characters/${characterId}/sell`, { inventory_index: index });
+      const res = await postIdempotent(`${API}/characters/${characterId}/sell`, { instance_id: instanceId });
       setCharacter(res.data.character);
     } catch (e) {
       console.error(e);
@@ -153,7 +149,7 @@ export default function Shop() {
               const slot = item.type === 'weapon' ? 'weapon' : item.type === 'armor' ? 'armor' : item.type === 'relic' ? 'relic' : 'scroll';
               return (
                 <div
-                  key={idx}
+                  key={item.instance_id || idx}
                   className={`flex items-center justify-between p-2 rounded border rarity-${rarity}-bg`}
                   data-testid={`inventory-item-${idx}`}
                 >
@@ -166,14 +162,14 @@ export default function Shop() {
                   </div>
                   <div className="flex items-center gap-1.5">
                     <button
-                      onClick={() => equipItem(idx, slot)}
+                      onClick={() => equipItem(item.instance_id, slot)}
                       className="px-2 py-1 bg-purple-900/40 border border-purple-500/30 rounded text-xs font-rajdhani text-purple-300 hover:bg-purple-900/60"
                       data-testid={`equip-item-${idx}`}
                     >
                       Zaloz
                     </button>
                     <button
-                      onClick={() => sellItem(idx)}
+                      onClick={() => sellItem(item.instance_id)}
                       className="px-2 py-1 bg-red-900/40 border border-red-500/30 rounded text-xs font-rajdhani text-red-300 hover:bg-red-900/60"
                       data-testid={`sell-item-${idx}`}
                     >
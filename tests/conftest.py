@@ -0,0 +1,45 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+# server builds its Mongo handle from these at import; tests swap in mongomock.
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def app_db():
+    """server wired to a fresh in-memory database, with its in-process state reset."""
+    from mongomock_motor import AsyncMongoMockClient
+
+    import server
+
+    db = AsyncMongoMockClient()["test"]
+    server.mongo.db = db
+    server.leaderboard.collection = db.characters
+    server.leaderboard.expire()
+    server.character_cache.clear()
+    server.idempotent.responses.clear()
+    server.idempotent.collection = None
+    yield db
+    server.mongo.db = None
+
+
+@pytest.fixture
+async def client(app_db):
+    """An HTTP client for server.app on top of app_db (no lifespan: no watcher, no flusher)."""
+    import httpx
+
+    import server
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+        yield http
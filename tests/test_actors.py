@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from actors import WriteActors
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_calls_for_one_key_run_in_order_and_keys_do_not_wait():
+    actors = WriteActors()
+    log = []
+    release = asyncio.Event()
+
+    async def slow():
+        log.append("a1 start")
+        await release.wait()
+        log.append("a1 end")
+
+    async def record(name):
+        log.append(name)
+        return name
+
+    first = asyncio.ensure_future(actors.call("a", slow))
+    second = asyncio.ensure_future(actors.call("a", lambda: record("a2")))
+    # b doesn't queue behind a's blocked write.
+    assert await actors.call("b", lambda: record("b1")) == "b1"
+    assert "a1 end" not in log
+    release.set()
+    await asyncio.gather(first, second)
+
+    assert [entry for entry in log if entry != "b1"] == ["a1 start", "a1 end", "a2"]
+
+
+async def test_queued_payloads_merge_into_one_batch_with_a_result_each():
+    actors = WriteActors()
+    batches = []
+
+    async def batch(key, payloads):
+        batches.append((key, payloads))
+        return [payload * 10 for payload in payloads]
+
+    results = await asyncio.gather(*(actors.merge("a", batch, n) for n in [1, 2, 3]))
+
+    assert results == [10, 20, 30]
+    assert batches == [("a", [1, 2, 3])]
+    assert (actors.counts["writes"], actors.counts["merged"]) == (1, 2)
+
+
+async def test_merging_stops_at_max_batch_and_at_other_work():
+    actors = WriteActors(max_batch=2)
+    batches = []
+
+    async def batch(key, payloads):
+        batches.append(payloads)
+        return payloads
+
+    async def plain():
+        batches.append("call")
+
+    await asyncio.gather(actors.merge("a", batch, 1), actors.merge("a", batch, 2), actors.merge("a", batch, 3),
+                         actors.call("a", plain), actors.merge("a", batch, 4))
+
+    assert batches == [[1, 2], [3], "call", [4]]
+
+
+async def test_a_failed_batch_fails_every_merged_caller():
+    actors = WriteActors()
+
+    async def batch(key, payloads):
+        raise RuntimeError("write failed")
+
+    results = await asyncio.gather(*(actors.merge("a", batch, n) for n in range(3)), return_exceptions=True)
+
+    assert [str(result) for result in results] == ["write failed"] * 3
+    # The mailbox keeps serving the key afterwards.
+    assert await actors.call("a", lambda: asyncio.sleep(0, "ok")) == "ok"
+
+
+async def test_idle_mailbox_stops_and_the_next_call_starts_a_new_one():
+    actors = WriteActors(idle_timeout=0.01)
+
+    assert await actors.call("a", lambda: asyncio.sleep(0, 1)) == 1
+    assert actors.stats()["actors"] == 1
+    await asyncio.sleep(0.05)
+    assert actors.stats()["actors"] == 0
+    assert actors.counts["stopped"] == 1
+
+    assert await actors.call("a", lambda: asyncio.sleep(0, 2)) == 2
+    assert actors.counts["started"] == 2
+
+
+async def test_caller_that_went_away_before_its_turn_is_dropped():
+    actors = WriteActors()
+    release = asyncio.Event()
+    ran = []
+
+    async def blocker():
+        await release.wait()
+
+    async def never():
+        ran.append(True)
+
+    first = asyncio.ensure_future(actors.call("a", blocker))
+    cancelled = asyncio.ensure_future(actors.call("a", never))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    release.set()
+    await first
+    await actors.call("a", lambda: asyncio.sleep(0))
+
+    assert ran == [] and actors.counts["dropped"] == 1
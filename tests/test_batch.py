@@ -0,0 +1,102 @@
+"""/characters/{id}/batch applies every operation or none of them."""
+import copy
+
+import pytest
+
+import catalog
+import progression
+
+pytestmark = pytest.mark.anyio
+
+
+async def _character(client, **fields):
+    character_id = (await client.post("/api/characters", json={"name": "Ada", "class_type": "knight"})).json()["id"]
+    if fields:
+        await client.put(f"/api/characters/{character_id}", json=fields)
+    return character_id
+
+
+async def _stored(app_db, character_id):
+    return await app_db.characters.find_one({"_id": character_id}, {"_id": 0})
+
+
+def _batch(client, character_id, *operations):
+    return client.post(f"/api/characters/{character_id}/batch", json={"operations": list(operations)})
+
+
+async def test_operations_apply_in_order_with_one_write(client, app_db):
+    character_id = await _character(client, gold=500)
+    before = await _stored(app_db, character_id)
+
+    response = await _batch(client, character_id,
+                            {"op": "buy", "item_id": "w1"},
+                            {"op": "buy", "item_id": "a1"},
+                            {"op": "equip", "inventory_index": 0, "slot": "weapon"},
+                            {"op": "sell", "inventory_index": 0})
+
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert [result["op"] for result in body["results"]] == ["buy", "buy", "equip", "sell"]
+    w1, a1 = catalog.ITEMS_BY_ID["w1"], catalog.ITEMS_BY_ID["a1"]
+    assert body["character"]["gold"] == 500 - w1["price"] - a1["price"] + max(1, a1["price"] // 2)
+    assert body["character"]["equipment"]["weapon"]["instance_id"] == body["results"][0]["instance_id"]
+    assert body["character"]["inventory"] == []
+    assert (await _stored(app_db, character_id))["version"] == before["version"] + 1
+
+
+async def test_a_failing_operation_rolls_back_the_whole_batch(client, app_db):
+    character_id = await _character(client, gold=150)
+    before = await _stored(app_db, character_id)
+
+    response = await _batch(client, character_id,
+                            {"op": "buy", "item_id": "w1"},
+                            {"op": "equip", "inventory_index": 0, "slot": "weapon"},
+                            {"op": "buy", "item_id": "a5"})
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Operation 2 (buy): Not enough gold"
+    assert await _stored(app_db, character_id) == before
+    char = (await client.get(f"/api/characters/{character_id}")).json()
+    assert (char["gold"], char["inventory"], char["equipment"]["weapon"]) == (150, [], None)
+
+
+@pytest.mark.parametrize("operation, detail", [
+    ({"op": "sell", "instance_id": "0" * 32}, "Operation 1 (sell): Item not in inventory"),
+    ({"op": "unequip", "slot": "armor"}, "Operation 1 (unequip): Slot is empty"),
+    ({"op": "levelup", "stat": "str"}, "Operation 1 (levelup): No stat points available"),
+    ({"op": "teleport"}, "Operation 1: unknown operation"),
+])
+async def test_every_kind_of_failure_leaves_the_character_untouched(client, app_db, operation, detail):
+    character_id = await _character(client, gold=500)
+    before = await _stored(app_db, character_id)
+
+    response = await _batch(client, character_id, {"op": "buy", "item_id": "w1"}, operation)
+
+    assert (response.status_code, response.json()["detail"]) == (400, detail)
+    assert await _stored(app_db, character_id) == before
+
+
+async def test_stale_cached_copy_is_replayed_on_the_current_document(client, app_db):
+    character_id = await _character(client, gold=500)
+    # Another worker spent gold; this worker's cache still has the old copy.
+    await app_db.characters.update_one({"_id": character_id}, {"$set": {"gold": 120}, "$inc": {"version": 1}})
+
+    response = await _batch(client, character_id, {"op": "buy", "item_id": "w1"})
+
+    assert response.status_code == 200
+    assert response.json()["character"]["gold"] == 120 - catalog.ITEMS_BY_ID["w1"]["price"]
+
+
+async def test_level_ups_write_pools_and_maxima(client, app_db):
+    character_id = await _character(client, stat_points=2)
+    before = await _stored(app_db, character_id)
+
+    response = await _batch(client, character_id, {"op": "levelup", "stat": "end"}, {"op": "levelup", "stat": "int"})
+
+    assert response.status_code == 200
+    expected = copy.deepcopy(before)
+    progression.spend_stat_point(expected, "end")
+    progression.spend_stat_point(expected, "int")
+    stored = await _stored(app_db, character_id)
+    for field in ["stat_points", "stats", *progression.POOL_MAXIMA, *progression.MAXIMA]:
+        assert stored[field] == expected[field], field
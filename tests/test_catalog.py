@@ -0,0 +1,40 @@
+import orjson
+import pytest
+
+import catalog
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("url", ["/api/items", "/api/classes", "/api/shop?level=3"])
+async def test_revalidation_with_the_etag_gets_an_empty_304(client, url):
+    first = await client.get(url)
+    etag = first.headers["etag"]
+
+    again = await client.get(url, headers={"If-None-Match": etag})
+
+    assert first.status_code == 200 and first.content
+    assert again.status_code == 304 and again.content == b""
+    # A compressed 200 carries the weak form of the same tag.
+    assert again.headers["etag"].removeprefix("W/") == etag.removeprefix("W/")
+
+
+@pytest.mark.parametrize("if_none_match", ['"stale"', 'W/"stale", "other"'])
+async def test_changed_etag_gets_the_full_body(client, if_none_match):
+    response = await client.get("/api/items", headers={"If-None-Match": if_none_match})
+
+    assert response.status_code == 200
+    assert response.json() == catalog.SHOP_ITEMS
+
+
+async def test_weak_and_listed_etags_match(client):
+    etag = (await client.get("/api/items")).headers["etag"].removeprefix("W/")
+
+    for if_none_match in [f"W/{etag}", f'"other", {etag}', "*"]:
+        assert (await client.get("/api/items", headers={"If-None-Match": if_none_match})).status_code == 304
+
+
+def test_shop_bodies_list_the_items_up_to_two_levels_ahead():
+    for level in range(1, 30):
+        expected = [item for item in catalog.SHOP_ITEMS if item["level_req"] <= level + 2]
+        assert orjson.loads(catalog.shop_body(level).body) == expected
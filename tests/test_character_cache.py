@@ -0,0 +1,75 @@
+import pytest
+
+import server
+from cache import CharacterCache
+
+pytestmark = pytest.mark.anyio
+
+
+def doc(version, gold=0):
+    return {"id": "c1", "version": version, "gold": gold}
+
+
+def test_older_version_never_replaces_a_newer_one():
+    cache = CharacterCache(ttl=60)
+    cache.store(doc(3, gold=30))
+
+    cache.store(doc(2, gold=20))
+
+    assert cache.get("c1") == doc(3, gold=30)
+
+
+def test_invalidation_floor_keeps_reads_that_started_before_it_out():
+    cache = CharacterCache(ttl=60)
+    cache.store(doc(1))
+
+    cache.invalidate("c1", version=3)
+    cache.store(doc(2))
+    assert cache.get("c1") is None
+
+    cache.store(doc(3, gold=30))
+    assert cache.get("c1") == doc(3, gold=30)
+
+
+def test_invalidation_without_a_version_sets_no_floor():
+    cache = CharacterCache(ttl=60)
+    cache.store(doc(5))
+
+    cache.invalidate("c1")
+    cache.store(doc(1))
+
+    assert cache.get("c1") == doc(1)
+
+
+def test_clear_drops_floors_too():
+    cache = CharacterCache(ttl=60)
+    cache.invalidate("c1", version=9)
+
+    cache.clear()
+    cache.store(doc(1))
+
+    assert cache.get("c1") == doc(1)
+
+
+async def test_reads_are_served_from_the_cache_until_a_write(client, app_db):
+    character_id = (await client.post("/api/characters", json={"name": "Ada", "class_type": "knight"})).json()["id"]
+    # Changed behind the API's back: still hidden by the cached copy.
+    await app_db.characters.update_one({"_id": character_id}, {"$set": {"name": "Elsewhere"}})
+    assert (await client.get(f"/api/characters/{character_id}")).json()["name"] == "Ada"
+
+    updated = (await client.put(f"/api/characters/{character_id}", json={"gold": 5})).json()
+    assert (updated["name"], updated["gold"], updated["version"]) == ("Elsewhere", 5, 2)
+    # A read of version 1 that finishes after the write can't bring it back.
+    stored = await app_db.characters.find_one({"_id": character_id}, {"_id": 0})
+    server.character_cache.store({**stored, "version": 1, "gold": 200})
+    assert (await client.get(f"/api/characters/{character_id}")).json()["gold"] == 5
+
+
+async def test_stale_expected_version_conflicts_and_refreshes_the_cache(client, app_db):
+    character_id = (await client.post("/api/characters", json={"name": "Ada", "class_type": "knight"})).json()["id"]
+    await app_db.characters.update_one({"_id": character_id}, {"$set": {"gold": 7}, "$inc": {"version": 1}})
+
+    response = await client.put(f"/api/characters/{character_id}", json={"gold": 50, "version": 1})
+
+    assert response.status_code == 409
+    assert (await client.get(f"/api/characters/{character_id}")).json()["gold"] == 7
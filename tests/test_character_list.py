@@ -0,0 +1,70 @@
+import orjson
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def characters(app_db):
+    # Ties on created_at and documents written before it existed must page correctly too.
+    created = [None, None, "2024-01-01T00:00:00", "2024-01-01T00:00:00", "2024-01-01T00:00:00",
+               "2024-01-02T00:00:00", "2024-01-03T00:00:00"]
+    docs = []
+    for index, created_at in enumerate(created):
+        doc = {"_id": f"c{index}", "id": f"c{index}", "name": f"n{index}", "class_type": "knight",
+               "level": 1, "kills": index, "gold": 0}
+        if created_at:
+            doc["created_at"] = created_at
+        docs.append(doc)
+    await app_db.characters.insert_many(list(reversed(docs)))
+    return [doc["id"] for doc in docs]
+
+
+async def _pages(client, limit):
+    pages, cursor = [], None
+    while True:
+        params = {"limit": limit, "view": "summary", **({"cursor": cursor} if cursor else {})}
+        response = await client.get("/api/characters", params=params)
+        assert response.status_code == 200
+        pages.append([char["id"] for char in response.json()])
+        cursor = response.headers.get("x-next-cursor")
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 7, 100])
+async def test_pages_cover_every_character_once_in_order(client, characters, limit):
+    pages = await _pages(client, limit)
+
+    assert [character_id for page in pages for character_id in page] == characters
+    assert all(len(page) == limit for page in pages[:-1])
+
+
+async def test_insert_between_pages_does_not_shift_the_next_page(client, app_db, characters):
+    first = await client.get("/api/characters", params={"limit": 3, "view": "summary"})
+    await app_db.characters.insert_one({"_id": "a", "id": "a", "name": "early", "created_at": "2023-01-01"})
+
+    rest = await client.get("/api/characters", params={"limit": 10, "cursor": first.headers["x-next-cursor"]})
+
+    assert [char["id"] for char in rest.json()] == characters[3:]
+
+
+async def test_summary_view_only_has_summary_fields(client, characters):
+    [char] = (await client.get("/api/characters", params={"limit": 1, "view": "summary"})).json()
+
+    assert set(char) <= set(server.SUMMARY_FIELDS)
+
+
+async def test_ndjson_export_streams_one_character_per_line(client, characters):
+    response = await client.get("/api/characters", params={"format": "ndjson", "view": "summary"})
+
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [orjson.loads(line)["id"] for line in response.content.splitlines()] == characters
+
+
+async def test_malformed_cursor_is_rejected(client, characters):
+    response = await client.get("/api/characters", params={"cursor": "not a cursor"})
+
+    assert response.status_code == 400
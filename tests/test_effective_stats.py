@@ -0,0 +1,29 @@
+import effective_stats
+
+
+def character(**overrides):
+    return {
+        "class_type": "knight",
+        "stats": {"str": 5, "dex": 3, "end": 4, "int": 1, "lck": 2},
+        "equipment": {"weapon": {"id": "w1"}, "armor": None, "relic": None, "scroll": None},
+        "max_health": 120, "max_mana": 20, "max_stamina": 50,
+        **overrides,
+    }
+
+
+def test_memoized_build_is_not_shared_with_callers():
+    effective_stats.memo.clear()
+    first = effective_stats.compute(character())
+    expected = {**first, "damage": dict(first["damage"])}
+    hits = effective_stats.memo.hits
+
+    first["damage"]["min"] = -1
+    first["attack"] = -1
+
+    assert effective_stats.compute(character()) == expected
+    assert effective_stats.memo.hits == hits + 1
+
+
+def test_maxima_include_equipment_bonuses():
+    stats = effective_stats.compute(character(max_health=100))
+    assert stats["max_health"] == 100 + stats["health_bonus"]
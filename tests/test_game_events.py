@@ -0,0 +1,80 @@
+"""Folded /game/events writes must store what replaying the events one by one gives."""
+import asyncio
+
+import pytest
+
+import server
+from server import GameEvent
+
+pytestmark = pytest.mark.anyio
+
+
+def kill(count=1):
+    return GameEvent(type="kill", count=count)
+
+
+def gold(amount):
+    return GameEvent(type="gold", amount=amount)
+
+
+def death():
+    return GameEvent(type="death", level_id=1)
+
+
+def complete(level_id=1, xp=0, gold_gained=0, kills=0):
+    return GameEvent(type="complete_level", level_id=level_id, xp_gained=xp, gold_gained=gold_gained, kills=kills)
+
+
+SEQUENCES = [
+    [gold(50), death(), gold(30)],
+    [death(), death(), gold(7)],
+    [gold(999), death(), gold(1), death(), death()],
+    [kill(3), complete(xp=250, gold_gained=40, kills=2), death(), complete(2, xp=10)],
+    [complete(xp=100), complete(xp=100), complete(2, xp=1_000)],
+    [gold(13), death(), complete(3, xp=5, gold_gained=11), gold(2), death()],
+]
+
+
+async def _character(db, gold_held):
+    created = await server.create_character(server.CharacterCreate(name="Ada", class_type="knight"))
+    await db.characters.update_one({"_id": created["id"]}, {"$set": {"gold": gold_held}})
+    return created["id"]
+
+
+async def _stored(db, character_id):
+    return await db.characters.find_one({"_id": character_id}, {"_id": 0})
+
+
+@pytest.mark.parametrize("events", SEQUENCES)
+async def test_folded_write_matches_sequential_replay(app_db, events):
+    character_id = await _character(app_db, 137)
+    before = await _stored(app_db, character_id)
+
+    [result] = await server._apply_game_events(character_id, [events])
+
+    expected, penalties = server._replay_game_events(before, events)
+    stored = await _stored(app_db, character_id)
+    assert {**stored, "version": None} == {**expected, "version": None}
+    assert stored["version"] == before.get("version", 0) + 1
+    assert result["gold_lost"] == sum(penalties)
+
+
+async def test_merged_batches_each_get_their_own_results(app_db):
+    character_id = await _character(app_db, 200)
+    before = await _stored(app_db, character_id)
+    batches = [[gold(100), death()], [complete(xp=10_000)], [death()]]
+    writes = server.writes.counts["writes"]
+
+    results = await asyncio.gather(*(server.writes.merge(character_id, server._apply_game_events, batch)
+                                     for batch in batches))
+
+    assert server.writes.counts["writes"] == writes + 1
+    state = before
+    for batch, result in zip(batches, results):
+        after, penalties = server._replay_game_events(state, batch)
+        assert result["gold_lost"] == sum(penalties)
+        assert result["leveled_up"] == (after["level"] > state["level"])
+        state = after
+    stored = await _stored(app_db, character_id)
+    assert stored["gold"] == state["gold"] and stored["level"] == state["level"]
+    assert all(result["character"] == results[0]["character"] for result in results)
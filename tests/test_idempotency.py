@@ -0,0 +1,152 @@
+import asyncio
+
+import httpx
+import orjson
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from idempotency import IdempotencyMiddleware, IdempotencyStore
+
+pytestmark = pytest.mark.anyio
+
+
+class Handler:
+    """An ASGI app that counts its calls and answers with ``status`` and a call number."""
+
+    def __init__(self, status=200):
+        self.status = status
+        self.calls = 0
+        self.release = None
+
+    async def __call__(self, scope, receive, send):
+        self.calls += 1
+        call = self.calls
+        body = (await receive())["body"]
+        if self.release is not None:
+            await self.release.wait()
+        content = orjson.dumps({"call": call, "echo": orjson.loads(body)})
+        await send({"type": "http.response.start", "status": self.status,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": content})
+
+
+def client(handler, store):
+    app = IdempotencyMiddleware(handler, store=store, paths=[r"/api/shop/buy"])
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+def buy(http, key, body=None):
+    return http.post("/api/shop/buy", json=body or {"item_id": "w1"}, headers={"Idempotency-Key": key})
+
+
+async def test_same_key_and_body_replays_the_stored_response():
+    handler = Handler()
+    async with client(handler, IdempotencyStore()) as http:
+        first = await buy(http, "k1")
+        retry = await buy(http, "k1")
+
+    assert handler.calls == 1
+    assert retry.status_code == first.status_code == 200
+    assert retry.json() == first.json() == {"call": 1, "echo": {"item_id": "w1"}}
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert "idempotent-replayed" not in first.headers
+
+
+async def test_key_reused_for_a_different_body_is_rejected():
+    handler = Handler()
+    async with client(handler, IdempotencyStore()) as http:
+        await buy(http, "k1")
+        response = await buy(http, "k1", {"item_id": "a1"})
+
+    assert response.status_code == 422
+    assert handler.calls == 1
+
+
+async def test_requests_without_a_key_or_on_other_paths_pass_through():
+    handler = Handler()
+    async with client(handler, IdempotencyStore()) as http:
+        await http.post("/api/shop/buy", json={})
+        await http.post("/api/shop/buy", json={})
+        await http.post("/api/other", json={}, headers={"Idempotency-Key": "k1"})
+        await http.post("/api/other", json={}, headers={"Idempotency-Key": "k1"})
+
+    assert handler.calls == 4
+
+
+async def test_concurrent_duplicate_waits_for_the_first_request():
+    handler = Handler()
+    handler.release = asyncio.Event()
+    store = IdempotencyStore()
+    async with client(handler, store) as http:
+        first = asyncio.ensure_future(buy(http, "k1"))
+        while not store.in_flight:
+            await asyncio.sleep(0)
+        second = asyncio.ensure_future(buy(http, "k1"))
+        while not store.counts["waited"]:
+            await asyncio.sleep(0)
+        handler.release.set()
+        first, second = await asyncio.gather(first, second)
+
+    assert handler.calls == 1
+    assert second.json() == first.json()
+    assert second.headers["idempotent-replayed"] == "true"
+
+
+@pytest.mark.parametrize("status", [409, 429, 500, 503])
+async def test_retryable_and_server_errors_are_not_stored(status):
+    handler = Handler(status)
+    store = IdempotencyStore()
+    async with client(handler, store) as http:
+        first = await buy(http, "k1")
+        handler.status = 200
+        retry = await buy(http, "k1")
+
+    assert first.status_code == status
+    assert retry.status_code == 200 and retry.json()["call"] == 2
+    assert "idempotent-replayed" not in retry.headers
+
+
+async def test_client_errors_are_final_and_replayed():
+    handler = Handler(400)
+    async with client(handler, IdempotencyStore()) as http:
+        await buy(http, "k1")
+        retry = await buy(http, "k1")
+
+    assert retry.status_code == 400 and handler.calls == 1
+
+
+async def test_mongo_mirror_answers_after_a_restart():
+    db = AsyncMongoMockClient()["test"]
+    handler = Handler()
+    store = IdempotencyStore()
+    await store.bind(db)
+    async with client(handler, store) as http:
+        first = await buy(http, "k1")
+
+    # A new process (or another worker): nothing in memory, same database.
+    restarted = IdempotencyStore()
+    await restarted.bind(db)
+    async with client(handler, restarted) as http:
+        retry = await buy(http, "k1")
+        mismatch = await buy(http, "k1", {"item_id": "a1"})
+
+    assert handler.calls == 1
+    assert retry.json() == first.json()
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert mismatch.status_code == 422
+
+
+async def test_mongo_claim_held_by_another_worker_conflicts():
+    db = AsyncMongoMockClient()["test"]
+    handler = Handler()
+    store = IdempotencyStore()
+    await store.bind(db)
+    # Claimed by a worker that is still running the request.
+    other = IdempotencyStore()
+    await other.bind(db)
+    assert await other.claim("/api/shop/buy|k1")
+
+    async with client(handler, store) as http:
+        response = await buy(http, "k1")
+
+    assert response.status_code == 409 and handler.calls == 0
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import AutoReconnect, OperationFailure
+
+from cache import CharacterCache
+from coalesce import SingleFlight
+from invalidation import STANDALONE_ERROR, CacheWatcher, apply_update
+from leaderboard import Leaderboard
+
+pytestmark = pytest.mark.anyio
+
+
+def character(version=1, **overrides):
+    return {"id": "c1", "version": version, "name": "Ada", "class_type": "knight", "level": 3, "kills": 10,
+            "gold": 100, "items": [{"id": "w1"}, {"id": "a1"}], "stats": {"str": 5, "end": 4}, **overrides}
+
+
+def update(version, fields=None, removed=(), truncated=()):
+    return {
+        "operationType": "update",
+        "documentKey": {"_id": "c1"},
+        "updateDescription": {"updatedFields": {"version": version, **(fields or {})},
+                              "removedFields": list(removed), "truncatedArrays": list(truncated)},
+    }
+
+
+@pytest.fixture
+def watcher():
+    return CacheWatcher(CharacterCache(ttl=5), Leaderboard(None, ttl=60), SingleFlight(),
+                        watched_ttl=300, leaderboard_watched_ttl=600)
+
+
+def test_apply_update_sets_and_removes_nested_paths_without_touching_the_original():
+    doc = character()
+    patched = apply_update(doc, {"updatedFields": {"stats.str": 6, "items.1": {"id": "a2"}, "items.2": {"id": "r1"}},
+                                 "removedFields": ["name"]})
+
+    assert patched["stats"] == {"str": 6, "end": 4}
+    assert patched["items"] == [{"id": "w1"}, {"id": "a2"}, {"id": "r1"}]
+    assert "name" not in patched
+    assert doc == character()
+
+
+@pytest.mark.parametrize("description", [
+    {"updatedFields": {"items.0": {}}, "truncatedArrays": [{"field": "items", "newSize": 1}]},
+    {"updatedFields": {"items.7": {"id": "w2"}}},
+    {"updatedFields": {"gold.amount": 1}},
+])
+def test_apply_update_gives_up_on_changes_it_cannot_replay(description):
+    assert apply_update(character(), description) is None
+
+
+def test_update_one_version_ahead_is_patched_into_the_cache(watcher):
+    watcher.character_cache.store(character(version=1))
+
+    watcher.apply(update(2, {"gold": 150}))
+
+    assert watcher.character_cache.get("c1") == character(version=2, gold=150)
+    assert watcher.counts["patched"] == 1
+
+
+def test_own_write_already_cached_is_skipped(watcher):
+    watcher.character_cache.store(character(version=2, gold=150))
+
+    watcher.apply(update(2, {"gold": 150}))
+
+    assert (watcher.counts["skipped"], watcher.counts["patched"], watcher.counts["invalidated"]) == (1, 0, 0)
+
+
+def test_boards_catch_up_when_the_cache_is_already_current(watcher):
+    # Another worker's write was read (and cached) here before its change event arrived.
+    watcher.leaderboard._boards[None] = [{"id": "c1", "name": "Ada", "class_type": "knight", "level": 3, "kills": 10}]
+    watcher.character_cache.store(character(version=2, kills=12))
+
+    watcher.apply(update(2, {"kills": 12}))
+
+    assert watcher.counts["skipped"] == 1
+    assert watcher.leaderboard._boards[None][0]["kills"] == 12
+
+
+def test_version_gap_invalidates_with_a_floor(watcher):
+    watcher.character_cache.store(character(version=1))
+
+    watcher.apply(update(3, {"gold": 150}))
+
+    assert watcher.character_cache.get("c1") is None
+    # A read that started before the change must not bring version 1 back.
+    watcher.character_cache.store(character(version=1))
+    assert watcher.character_cache.get("c1") is None
+    watcher.character_cache.store(character(version=3, gold=150))
+    assert watcher.character_cache.get("c1")["gold"] == 150
+
+
+def test_leaderboard_fields_reach_the_boards(watcher):
+    watcher.leaderboard._boards[None] = [{"id": "c1", "name": "Ada", "class_type": "knight", "level": 3, "kills": 10}]
+    watcher.character_cache.store(character(version=1))
+
+    watcher.apply(update(2, {"kills": 12}))
+    assert watcher.leaderboard._boards[None][0]["kills"] == 12
+
+    # Not cached, so the boards can only be reloaded.
+    watcher.apply({**update(2, {"kills": 14}), "documentKey": {"_id": "c2"}})
+    assert watcher.leaderboard._boards == {}
+
+
+class FakeStream:
+    def __init__(self, changes, error):
+        self.changes = changes
+        self.error = error
+        self.resume_token = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.changes:
+            raise self.error
+        change = self.changes.pop(0)
+        self.resume_token = change["_id"]
+        return change
+
+
+class FakeCollection:
+    def __init__(self, *streams):
+        self.streams = list(streams)
+        self.resumed_after = []
+
+    def watch(self, pipeline, resume_after=None):
+        self.resumed_after.append(resume_after)
+        return self.streams.pop(0)
+
+
+async def test_reconnect_resumes_after_the_last_handled_event(watcher):
+    watcher.character_cache.store(character(version=1))
+    collection = FakeCollection(
+        FakeStream([{**update(2, {"gold": 120}), "_id": {"_data": "t1"}}], AutoReconnect("connection reset")),
+        FakeStream([{**update(3, {"gold": 140}), "_id": {"_data": "t2"}}],
+                   OperationFailure("not a replica set", code=STANDALONE_ERROR)),
+    )
+
+    await watcher.watch(collection, retry_delay=0)
+
+    assert collection.resumed_after == [None, {"_data": "t1"}]
+    assert watcher.character_cache.get("c1")["gold"] == 140
+    assert watcher.mode == "fallback"
+
+
+async def test_lost_history_clears_the_caches_and_starts_over(watcher):
+    watcher.character_cache.store(character(version=1))
+    watcher.resume_token = {"_data": "old"}
+    collection = FakeCollection(
+        FakeStream([], OperationFailure("resume point no longer in the oplog", code=286)),
+        FakeStream([], OperationFailure("not a replica set", code=STANDALONE_ERROR)),
+    )
+
+    await watcher.watch(collection, retry_delay=0)
+
+    assert collection.resumed_after == [{"_data": "old"}, None]
+    assert watcher.character_cache.get("c1") is None
+    assert watcher.counts["resets"] == 1
+
+
+async def test_client_without_change_streams_falls_back_with_one_warning(watcher, caplog):
+    collection = AsyncMongoMockClient()["test"].characters
+
+    with caplog.at_level(logging.INFO, logger="invalidation"):
+        async with watcher.running(collection):
+            await asyncio.sleep(0)
+
+    assert watcher.mode == "fallback"
+    assert watcher.character_cache.ttl == 5
+    [record] = [record for record in caplog.records if record.levelno >= logging.WARNING]
+    assert "unsupported" in record.getMessage() and record.exc_info is None
@@ -0,0 +1,124 @@
+"""Owned items are addressed by instance id; every path touches only its own entry."""
+import pytest
+
+import catalog
+
+pytestmark = pytest.mark.anyio
+
+
+async def _character(client, gold=1000):
+    created = (await client.post("/api/characters", json={"name": "Ada", "class_type": "knight"})).json()
+    await client.put(f"/api/characters/{created['id']}", json={"gold": gold})
+    return created["id"]
+
+
+async def _buy(client, character_id, item_id):
+    response = await client.post("/api/shop/buy", json={"character_id": character_id, "item_id": item_id})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def test_each_purchase_gets_its_own_instance_id(client, app_db):
+    character_id = await _character(client)
+    await _buy(client, character_id, "w1")
+    char = await _buy(client, character_id, "w1")
+
+    instance_ids = [item["instance_id"] for item in char["inventory"]]
+    assert len(set(instance_ids)) == 2
+    stored = await app_db.characters.find_one({"_id": character_id})
+    assert sorted(stored["items"]) == sorted(instance_ids)
+    assert char["gold"] == 1000 - 2 * catalog.ITEMS_BY_ID["w1"]["price"]
+
+
+async def test_equip_moves_that_instance_into_the_slot(client):
+    character_id = await _character(client)
+    await _buy(client, character_id, "w1")
+    char = await _buy(client, character_id, "w1")
+    first, second = (item["instance_id"] for item in char["inventory"])
+
+    response = await client.post(f"/api/characters/{character_id}/equip",
+                                 json={"instance_id": second, "slot": "weapon"})
+
+    char = response.json()
+    assert char["equipment"]["weapon"]["instance_id"] == second
+    assert [item["instance_id"] for item in char["inventory"]] == [first]
+
+
+async def test_equipped_item_cannot_be_sold_until_unequipped(client):
+    character_id = await _character(client)
+    instance_id = (await _buy(client, character_id, "w1"))["inventory"][0]["instance_id"]
+    await client.post(f"/api/characters/{character_id}/equip", json={"instance_id": instance_id, "slot": "weapon"})
+
+    response = await client.post(f"/api/characters/{character_id}/sell", json={"instance_id": instance_id})
+    assert (response.status_code, response.json()["detail"]) == (400, "Item is equipped")
+
+    await client.post(f"/api/characters/{character_id}/unequip", json={"slot": "weapon"})
+    gold = (await client.get(f"/api/characters/{character_id}")).json()["gold"]
+    response = await client.post(f"/api/characters/{character_id}/sell", json={"instance_id": instance_id})
+
+    assert response.status_code == 200
+    sold = response.json()
+    assert sold["sold_price"] == catalog.ITEMS_BY_ID["w1"]["price"] // 2
+    assert sold["character"]["gold"] == gold + sold["sold_price"]
+    assert sold["character"]["inventory"] == []
+
+
+async def test_sell_by_inventory_index_resolves_the_instance(client):
+    character_id = await _character(client)
+    await _buy(client, character_id, "w1")
+    char = await _buy(client, character_id, "a1")
+
+    response = await client.post(f"/api/characters/{character_id}/sell", json={"inventory_index": 1})
+
+    assert [item["id"] for item in response.json()["character"]["inventory"]] == ["w1"]
+    assert [item["id"] for item in char["inventory"]] == ["w1", "a1"]
+
+
+@pytest.mark.parametrize("instance_id, detail", [
+    ("0" * 32, "Item not in inventory"),
+    ("not-an-id", "Invalid instance id"),
+])
+async def test_sell_rejects_unknown_instances(client, instance_id, detail):
+    character_id = await _character(client)
+    await _buy(client, character_id, "w1")
+
+    response = await client.post(f"/api/characters/{character_id}/sell", json={"instance_id": instance_id})
+
+    assert (response.status_code, response.json()["detail"]) == (400, detail)
+
+
+async def test_entries_are_stored_as_catalog_references_and_hydrated_on_read(client, app_db, monkeypatch):
+    character_id = await _character(client)
+    instance_id = (await _buy(client, character_id, "w1"))["inventory"][0]["instance_id"]
+
+    stored = await app_db.characters.find_one({"_id": character_id})
+    assert stored["items"] == {instance_id: {"item_id": "w1"}}
+
+    # Catalog edits show up on items players already own.
+    monkeypatch.setitem(catalog.ITEMS_BY_ID, "w1", {**catalog.ITEMS_BY_ID["w1"], "name": "Renamed Blade"})
+    [item] = (await client.get(f"/api/characters/{character_id}")).json()["inventory"]
+    assert item == {**catalog.ITEMS_BY_ID["w1"], "instance_id": instance_id}
+
+
+async def test_legacy_document_is_converted_on_first_touch(client, app_db):
+    # Written before keyed item storage (and versioning): full item copies in a list.
+    template = await app_db.characters.find_one({"_id": await _character(client)})
+    character_id = "legacy"
+    await app_db.characters.insert_one({
+        **{key: value for key, value in template.items() if key not in ("items", "equipped", "version")},
+        "_id": character_id, "id": character_id,
+        "inventory": [dict(catalog.ITEMS_BY_ID["w1"]), {**catalog.ITEMS_BY_ID["a1"], "enchant": 2}],
+        "equipment": {"weapon": None, "armor": None, "relic": None, "scroll": None},
+    })
+
+    response = await client.post(f"/api/characters/{character_id}/equip",
+                                 json={"inventory_index": 1, "slot": "armor"})
+
+    assert response.status_code == 200, response.text
+    char = response.json()
+    assert char["equipment"]["armor"]["id"] == "a1" and char["equipment"]["armor"]["enchant"] == 2
+    assert [item["id"] for item in char["inventory"]] == ["w1"]
+    stored = await app_db.characters.find_one({"_id": character_id})
+    assert "inventory" not in stored and "equipment" not in stored
+    assert sorted(entry["item_id"] for entry in stored["items"].values()) == ["a1", "w1"]
+    assert stored["items"][stored["equipped"]["armor"]] == {"item_id": "a1", "enchant": 2}
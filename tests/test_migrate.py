@@ -0,0 +1,95 @@
+import json
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import migrate
+import progression
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def db(monkeypatch):
+    db = AsyncMongoMockClient()["test"]
+    monkeypatch.setattr(migrate.mongo, "db", db)
+    # Maxima left behind by an earlier balance: every one needs re-deriving.
+    await db.characters.insert_many([
+        {"_id": f"c{index:02}", "class_type": "knight", "stats": {"str": 5, "dex": 3, "end": 4, "int": 1, "lck": 2},
+         "max_health": 1, "health": 1, "max_mana": 1, "mana": 1, "max_stamina": 1, "stamina": 1, "version": 1}
+        for index in range(10)
+    ])
+    return db
+
+
+class Crash(Exception):
+    pass
+
+
+def crash_after(chunks):
+    lines = []
+
+    def log(line):
+        lines.append(line)
+        if len(lines) == chunks:
+            raise Crash
+    return log
+
+
+async def test_interrupted_run_resumes_after_the_checkpoint(db, tmp_path):
+    checkpoint = tmp_path / "maxima.json"
+
+    with pytest.raises(Crash):
+        await migrate.run("maxima", batch_size=4, checkpoint=checkpoint, log=crash_after(2))
+    assert json.loads(checkpoint.read_text()) == {"transform": "maxima", "last_id": "c07"}
+
+    lines = []
+    totals = await migrate.run("maxima", batch_size=4, checkpoint=checkpoint, log=lines.append)
+
+    assert lines[0] == "resuming after c07"
+    assert (totals["scanned"], totals["written"]) == (2, 2)
+    assert not checkpoint.exists()
+    docs = await db.characters.find().to_list(None)
+    # Every document was rewritten exactly once across both runs.
+    assert [doc["version"] for doc in docs] == [2] * 10
+    expected = progression.maxima_batch(["knight"], [[5, 3, 4, 1, 2]])
+    assert all(doc["max_health"] == int(expected["max_health"][0]) for doc in docs)
+
+
+async def test_checkpoint_of_another_transform_is_refused(db, tmp_path):
+    checkpoint = tmp_path / "checkpoint.json"
+    checkpoint.write_text(json.dumps({"transform": "item-refs", "last_id": "c03"}))
+
+    with pytest.raises(SystemExit):
+        await migrate.run("maxima", checkpoint=checkpoint, log=lambda line: None)
+    assert (await db.characters.find_one({"_id": "c00"}))["version"] == 1
+
+
+async def test_documents_changed_since_they_were_read_are_skipped(db, monkeypatch):
+    transform = migrate.TRANSFORMS["maxima"]
+
+    await db.characters.update_one({"_id": "c01"}, {"$set": {"max_health": 99}, "$inc": {"version": 1}})
+
+    def apply_to_a_stale_read(docs):
+        # As if c01 had been read just before the live API wrote it.
+        docs[1]["version"] = 1
+        return transform.apply(docs)
+
+    monkeypatch.setitem(migrate.TRANSFORMS, "maxima", transform._replace(apply=apply_to_a_stale_read))
+
+    totals = await migrate.run("maxima", batch_size=10, log=lambda line: None)
+
+    assert (totals["written"], totals["conflicts"]) == (9, 1)
+    assert (await db.characters.find_one({"_id": "c01"}))["max_health"] == 99
+
+
+async def test_dry_run_writes_nothing(db, tmp_path):
+    lines = []
+
+    totals = await migrate.run("maxima", batch_size=4, dry_run=True, checkpoint=tmp_path / "c.json",
+                               show=3, log=lines.append)
+
+    assert (totals["changed"], totals["written"]) == (10, 0)
+    assert sum(line.startswith("c0") for line in lines) == 3
+    assert not (tmp_path / "c.json").exists()
+    assert {doc["version"] for doc in await db.characters.find().to_list(None)} == {1}
@@ -0,0 +1,56 @@
+"""The closed-form XP pipeline in server must level exactly like progression.gain_xp."""
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import progression
+import server
+
+pytestmark = pytest.mark.anyio
+
+P = progression.XP_PER_LEVEL
+
+CASES = [
+    # level, xp, xp_to_next, stat_points, xp_gained
+    (1, 0, P, 0, 0),
+    (1, 0, P, 0, P - 1),
+    (1, 0, P, 0, P),
+    (1, 0, P, 0, P + 1),
+    (1, 40, P, 2, P - 40),
+    (1, 0, P, 0, P + 2 * P),  # lands exactly on level 3
+    (1, 0, P, 0, P + 2 * P - 1),
+    (1, 0, P, 0, P + 2 * P + 3 * P),  # exactly level 4
+    (2, 150, 2 * P, 3, 10_000),
+    (3, 0, 3 * P, 0, 1_000_000),
+    (1, 0, P, 0, 123_456_789),
+    (5, 10, 250, 1, 240),  # stored xp_to_next off the curve: first level-up costs 250
+    (5, 10, 250, 1, 239),
+    (5, 10, 250, 1, 240 + 6 * P),
+    (99, 0, 99 * P, 0, 99 * P + 100 * P + 101 * P - 1),
+    (250, 12_345, 250 * P, 7, 5_000_000),
+]
+
+
+@pytest.mark.parametrize("level, xp, xp_to_next, stat_points, gained", CASES)
+async def test_pipeline_matches_gain_xp(level, xp, xp_to_next, stat_points, gained):
+    characters = AsyncMongoMockClient()["test"].characters
+    char = {"_id": "c", "level": level, "xp": xp, "xp_to_next": xp_to_next, "stat_points": stat_points}
+    await characters.insert_one(char)
+
+    await characters.update_one(
+        {"_id": "c"}, [{"$set": {"_progress": server._xp_progress_expr(gained)}}, *server._PROGRESS_STAGES]
+    )
+
+    stored = await characters.find_one({"_id": "c"}, {"_id": 0})
+    assert stored == progression.gain_xp(char, gained)
+
+
+async def test_missing_stat_points_count_as_zero():
+    characters = AsyncMongoMockClient()["test"].characters
+    await characters.insert_one({"_id": "c", "level": 1, "xp": 0, "xp_to_next": P})
+
+    await characters.update_one(
+        {"_id": "c"}, [{"$set": {"_progress": server._xp_progress_expr(3 * P)}}, *server._PROGRESS_STAGES]
+    )
+
+    stored = await characters.find_one({"_id": "c"})
+    assert (stored["level"], stored["stat_points"]) == (3, 2 * progression.STAT_POINTS_PER_LEVEL)
@@ -0,0 +1,47 @@
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import BulkWriteError
+
+from telemetry import ALL_TIME, RunLog, stats_id
+
+pytestmark = pytest.mark.anyio
+
+
+class RejectingRuns:
+    """Stores runs like insert_many(ordered=False), but rejects the ones named in ``reject``."""
+
+    def __init__(self, reject):
+        self.reject = reject
+        self.docs = {}
+
+    async def insert_many(self, docs, ordered=True):
+        errors = []
+        for index, doc in enumerate(docs):
+            if doc["_id"] in self.docs:
+                errors.append({"index": index, "code": 11000, "errmsg": "duplicate key"})
+            elif doc["character_id"] in self.reject:
+                errors.append({"index": index, "code": 121, "errmsg": "Document failed validation"})
+            else:
+                self.docs[doc["_id"]] = doc
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+
+async def test_rejected_runs_are_dead_lettered_and_the_rest_stored():
+    db = AsyncMongoMockClient()["test"]
+    db.runs = RejectingRuns(reject={"bad"})
+    run_log = RunLog(batch_size=10)
+    run_log.db = db
+    for character_id in ["a", "bad", "b"]:
+        run_log.record({"id": character_id, "class_type": "knight"}, "complete", 1, xp=10, gold=5)
+    # One run was already stored by an attempt whose response got lost.
+    first = run_log._buffer[0]
+    db.runs.docs[first["_id"]] = first
+
+    await run_log.flush()
+
+    assert run_log.stats()["queued"] == 0
+    assert [run["character_id"] for run in run_log.dead_letters] == ["bad"]
+    assert run_log.counts["stored"] == 2
+    stats = await db.run_stats.find_one({"_id": stats_id(ALL_TIME, 1, "knight")})
+    assert stats["completions"] == 2 and stats["gold_sum"] == 10